@@ -1,56 +1,129 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import plotly.utils
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import requests
 import io
 from werkzeug.utils import secure_filename
 import logging
+import random
+import threading
+import time
+from collections import Counter
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
+from requests.adapters import HTTPAdapter
+from candle_cache import CandleArrays, CandleCache, MappedCandles, MS_PER_DAY, timestamps_to_ms
+from batch_kernel import (EXIT_STOP_LOSS, EXIT_TARGET, EXIT_TIME, ENTRY_TOLERANCE_MS, _evaluate_shard, _first_at_or_below,
+                          _min_levels, _valid_bars, as_candle_arrays, evaluate_trades, find_entry_indices,
+                          find_exit_indices, resolve_entries)
+from rate_limit import get_rate_limiter
+from jobs import JobStore, JOB_COMPLETED, JOB_FAILED, JOB_RUNNING
+from session_cache import SessionCache, credential_hash
+from instruments import InstrumentMaster, SymbolTokens, SCRIP_MASTER_URL
+from trade_store import TRADE_COLUMNS, TradeStore
+from response_cache import ResponseCache, DEFAULT_MAX_BYTES, DEFAULT_TTL
+from portfolio import check_settings, simulate_portfolio, DEFAULT_CAPITAL, DEFAULT_MAX_POSITIONS, DEFAULT_POSITION_PCT
+import telemetry
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['CANDLE_CACHE_DIR'] = os.environ.get('CANDLE_CACHE_DIR', 'cache')
+app.config['SMARTAPI_BASE_URL'] = os.environ.get('SMARTAPI_BASE_URL', 'https://apiconnect.angelone.in')
+app.config['BACKTEST_WORKERS'] = int(os.environ.get('BACKTEST_WORKERS', 1))
+app.config['JOBS_FOLDER'] = os.environ.get('JOBS_FOLDER', 'jobs')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Running jobs not heard from for this many seconds are reported failed
+app.config['JOB_STALE_AFTER'] = float(os.environ.get('JOB_STALE_AFTER', 15 * 60))
+app.config['SCRIP_MASTER_URL'] = os.environ.get('SCRIP_MASTER_URL', SCRIP_MASTER_URL)
+app.config['BACKTEST_INTERVAL'] = os.environ.get('BACKTEST_INTERVAL', 'ONE_MINUTE')
+# Finer interval fetched only for bars that touch both stop loss and target, e.g. ONE_MINUTE with ONE_HOUR bars
+app.config['RESOLVE_INTERVAL'] = os.environ.get('RESOLVE_INTERVAL') or None
+app.config['RESPONSE_CACHE_BYTES'] = int(os.environ.get('RESPONSE_CACHE_BYTES', DEFAULT_MAX_BYTES))
+app.config['RESPONSE_CACHE_TTL'] = float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL))
 
 # Create uploads directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Uploaded trade lists as typed files keyed by content hash
+trade_store = TradeStore(app.config['UPLOAD_FOLDER'])
+
+# Shared on-disk candle cache so repeated backtests skip SmartAPI
+candle_cache = CandleCache(app.config['CANDLE_CACHE_DIR'])
+
+# Symbol -> token index from the scrip master, loaded on first lookup
+instrument_master = InstrumentMaster(app.config['CANDLE_CACHE_DIR'], url=app.config['SCRIP_MASTER_URL'])
+
+# SmartAPI logins shared by every request and gunicorn worker
+session_cache = SessionCache(app.config['CANDLE_CACHE_DIR'])
+
+# Finished /backtest payloads by (trade set, parameters)
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_BYTES'], ttl=app.config['RESPONSE_CACHE_TTL'])
+
+# Background backtest jobs: status lives on disk, work runs on a thread pool
+job_store = JobStore(app.config['JOBS_FOLDER'], dumps=app.json.dumps, stale_after=app.config['JOB_STALE_AFTER'])
+job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'])
+# Jobs whose process stopped (a restart or a killed worker) would otherwise stay running forever
+job_store.fail_interrupted()
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Connection pool shared by every AngelOneAPI instance so keep-alive connections are reused
+smartapi_session = requests.Session()
+smartapi_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+smartapi_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Responses worth retrying: rate limited or transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest a Retry-After header may make a request wait, in seconds
+MAX_RETRY_AFTER = 60
+
 class AngelOneAPI:
-    def __init__(self, api_key=None, client_id=None, password=None, totp=None):
+    def __init__(self, api_key=None, client_id=None, password=None, totp=None,
+                 base_url="https://apiconnect.angelone.in", max_concurrency=3, session_cache=None,
+                 instruments=None):
         self.api_key = api_key
         self.client_id = client_id
         self.password = password
         self.totp = totp
-        self.base_url = "https://apiconnect.angelone.in"
+        self.base_url = base_url
         self.access_token = None
         self.refresh_token = None
         self.feed_token = None
+        self.token_expires_at = None
         
-        # Symbol to token mapping for common NSE stocks (from Angel One SmartAPI)
-        self.symbol_tokens = {
-            'RELIANCE': '2881',
-            'TCS': '2951', 
-            'INFY': '4081',
-            'HDFCBANK': '1333',
-            'ICICIBANK': '4963',
-            'SBIN': '3045',
-            'WIPRO': '4081',
-            'LT': '11536',
-            'BAJFINANCE': '317',
-            'ASIANPAINT': '1660',
-            'ITC': '1660',
-            'ULTRACEMCO': '11536',
-            'AXISBANK': '5900',
-            'MARUTI': '10999'
-        }
+        # Cached logins are only reused by clients holding the same credentials
+        self.session_cache = session_cache
+        self.credentials = credential_hash(api_key, client_id, password, totp)
+        
+        self.session = smartapi_session
+        self.rate_limiter = get_rate_limiter(api_key)
+        self.max_concurrency = max_concurrency
+        # Caps requests in flight, including chunks of a split range fetched from several threads
+        self._in_flight = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.max_retries = 4
+        self.retry_backoff = 0.5
+        self.timeout = 30
+        self._auth_lock = threading.Lock()
+        # Set once a candle request fails (rate limit, login or network error) rather than finding no
+        # candles, so a run that lost symbols to it is known to be worth retrying
+        self.request_failed = False
+        
+        # NSE symbol -> token from the instrument master, with a built-in
+        # table for common large caps when the master is unavailable
+        self.symbol_tokens = SymbolTokens(instruments)
         
     def get_access_token(self):
         """Get access token for Angel One SmartAPI"""
@@ -68,16 +141,7 @@ class AngelOneAPI:
             
             # Use the NEW SmartAPI authentication endpoint
             url = f"{self.base_url}/rest/auth/angelbroking/user/v1/loginByPassword"
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'X-UserType': 'USER',
-                'X-SourceID': 'WEB',
-                'X-ClientLocalIP': '192.168.1.1',
-                'X-ClientPublicIP': '106.193.147.98',
-                'X-MACAddress': '00:00:00:00:00:00',
-                'X-PrivateKey': self.api_key
-            }
+            headers = self._headers()
             
             payload = {
                 "clientcode": self.client_id,
@@ -86,17 +150,16 @@ class AngelOneAPI:
             }
             
             logger.info(f"Authenticating with Angel One SmartAPI...")
-            response = requests.post(url, headers=headers, json=payload)
+            with telemetry.span('smartapi.login'):
+                response = self._post(url, headers, payload)
             
             logger.info(f"Auth response status: {response.status_code}")
-            logger.info(f"Auth response: {response.text}")
+            logger.debug(f"Auth response: {response.text}")
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('status') and data.get('data'):
-                    self.access_token = data['data']['jwtToken']
-                    self.refresh_token = data['data'].get('refreshToken')
-                    self.feed_token = data['data'].get('feedToken')
+                    self._set_tokens(data['data'])
                     logger.info("SmartAPI authentication successful")
                     return True
                 else:
@@ -108,43 +171,178 @@ class AngelOneAPI:
             logger.error(f"Error getting SmartAPI access token: {e}")
             return False
     
-    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
-        """Get historical data using Angel One SmartAPI"""
+    def refresh_access_token(self):
+        """Exchange the refresh token for a new jwt without logging in again"""
+        if not self.access_token or not self.refresh_token:
+            return False
         try:
-            # Add rate limiting - wait between API calls
-            import time
-            time.sleep(1)  # Wait 1 second between API calls
+            url = f"{self.base_url}/rest/auth/angelbroking/jwt/v1/generateTokens"
+            response = self._post(url, self._headers(self.access_token), {"refreshToken": self.refresh_token})
+            if response.status_code == 200:
+                data = response.json()
+                if data.get('status') and data.get('data'):
+                    self._set_tokens(data['data'])
+                    logger.info("SmartAPI session refreshed")
+                    return True
+            logger.warning(f"SmartAPI token refresh failed with status {response.status_code}")
+            return False
+        except Exception as e:
+            logger.error(f"Error refreshing SmartAPI access token: {e}")
+            return False
+    
+    def _headers(self, access_token=None):
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'X-UserType': 'USER',
+            'X-SourceID': 'WEB',
+            'X-ClientLocalIP': '192.168.1.1',
+            'X-ClientPublicIP': '106.193.147.98',
+            'X-MACAddress': '00:00:00:00:00:00',
+            'X-PrivateKey': self.api_key
+        }
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+        return headers
+    
+    def _set_tokens(self, data):
+        """Adopt tokens from a login or refresh response and publish them to the session cache"""
+        self.access_token = data['jwtToken']
+        self.refresh_token = data.get('refreshToken')
+        self.feed_token = data.get('feedToken')
+        if self.session_cache is not None:
+            session = self.session_cache.store(self.client_id, self.credentials, self.access_token,
+                                               self.refresh_token, self.feed_token)
+            self.token_expires_at = session['expires_at']
+    
+    def _post(self, url, headers, payload, rate_limited=False):
+        """POST through the shared session, retrying 429/5xx with jittered exponential backoff"""
+        endpoint = url.rsplit('/', 1)[-1]
+        for attempt in range(self.max_retries + 1):
+            if rate_limited:
+                with telemetry.span('smartapi.throttle'):
+                    self.rate_limiter.acquire()
             
-            if not self.access_token:
-                if not self.get_access_token():
-                    logger.error("Failed to get SmartAPI access token")
-                    return None
+            retry_after = None
+            try:
+                with self._in_flight, telemetry.span('smartapi.http'):
+                    response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                telemetry.count('smartapi_requests_total', endpoint=endpoint, status='error')
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"SmartAPI request failed ({e}), retrying ({attempt + 1}/{self.max_retries})")
+            else:
+                telemetry.count('smartapi_requests_total', endpoint=endpoint, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                logger.warning(f"SmartAPI returned {response.status_code}, retrying ({attempt + 1}/{self.max_retries})")
+                retry_after = response.headers.get('Retry-After')
+            
+            with telemetry.span('smartapi.backoff'):
+                if retry_after and retry_after.isdigit():
+                    time.sleep(min(int(retry_after), MAX_RETRY_AFTER) + random.uniform(0, self.retry_backoff))
+                else:
+                    time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+    
+    def _ensure_access_token(self):
+        """Log in once, even when several threads need a token at the same time.
+        
+        With a session cache, a live cached session is reused as is, one that
+        is about to expire is refreshed, and only a missing or unrefreshable
+        session costs a full login.
+        """
+        with self._auth_lock:
+            if self.access_token and (self.token_expires_at is None or
+                                      not self.session_cache.needs_refresh(self.token_expires_at)):
+                return True
+            if self.session_cache is None:
+                return self.get_access_token()
+            
+            with self.session_cache.lock(self.client_id):
+                # Another request (or worker) may have logged in while we waited
+                session = self.session_cache.get(self.client_id, self.credentials)
+                if session is not None:
+                    self.access_token = session['jwt_token']
+                    self.refresh_token = session['refresh_token']
+                    self.feed_token = session['feed_token']
+                    self.token_expires_at = session['expires_at']
+                    if not self.session_cache.needs_refresh(session['expires_at']):
+                        logger.info(f"Reusing cached SmartAPI session for {self.client_id}")
+                        return True
+                    if self.refresh_access_token():
+                        return True
+                return self.get_access_token()
+    
+    def _reauthenticate(self, rejected_token):
+        """Forget a token SmartAPI rejected and get a fresh one"""
+        with self._auth_lock:
+            if self.access_token == rejected_token:
+                self.access_token = None
+                if self.session_cache is not None:
+                    self.session_cache.invalidate(self.client_id, rejected_token)
+        return self._ensure_access_token()
+    
+    def get_historical_data_many(self, fetches):
+        """Fetch several (symbol, interval, from_date, to_date) requests concurrently.
+        
+        At most max_concurrency requests are in flight and every request still
+        goes through the shared rate limiter. Results come back in input order.
+        """
+        if not self._ensure_access_token():
+            logger.error("Failed to get SmartAPI access token")
+            return [None] * len(fetches)
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            return list(executor.map(lambda fetch: self.get_historical_data(*fetch), fetches))
+    
+    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
+        """Get historical data using Angel One SmartAPI.
+        
+        Ranges longer than SmartAPI returns for the interval in one request
+        are split into maximum-size chunks that are fetched concurrently and
+        stitched into one frame, sorted by timestamp without duplicates. If
+        any chunk fails the result is None, so a partial range is never
+        taken for a complete one.
+        """
+        # Default to last 30 days if dates not provided
+        if not from_date:
+            from_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        if not to_date:
+            to_date = datetime.now().strftime('%Y-%m-%d')
+        
+        chunks = split_date_range(from_date, to_date, interval)
+        if len(chunks) == 1:
+            return self._get_candle_data(symbol, interval, from_date, to_date)
+        
+        logger.info(f"Splitting {symbol} {interval} request from {from_date} to {to_date} into {len(chunks)} chunks")
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(chunks)))) as executor:
+            frames = list(executor.map(lambda chunk: self._get_candle_data(symbol, interval, *chunk), chunks))
+        if any(frame is None for frame in frames):
+            logger.error(f"Missing {symbol} {interval} data for part of {from_date} to {to_date}")
+            return None
+        return (pd.concat(frames, ignore_index=True)
+                .drop_duplicates('timestamp')
+                .sort_values('timestamp', kind='stable')
+                .reset_index(drop=True))
+    
+    def _get_candle_data(self, symbol, interval, from_date, to_date):
+        """One getCandleData request, for a range within SmartAPI's per-request limit"""
+        try:
+            if not self._ensure_access_token():
+                logger.error("Failed to get SmartAPI access token")
+                self.request_failed = True
+                return None
             
             # Get token for the symbol
             token = self.symbol_tokens.get(symbol)
             if not token:
-                logger.error(f"Invalid symbol: {symbol}. Valid symbols are: {list(self.symbol_tokens.keys())}")
-                    return None
+                logger.error(f"Invalid symbol: {symbol}. Not found in the NSE instrument master")
+                return None
             
             # Use the NEW SmartAPI historical data endpoint
             url = f"{self.base_url}/rest/secure/angelbroking/historical/v1/getCandleData"
-            headers = {
-                'Authorization': f'Bearer {self.access_token}',
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'X-UserType': 'USER',
-                'X-SourceID': 'WEB',
-                'X-ClientLocalIP': '192.168.1.1',
-                'X-ClientPublicIP': '106.193.147.98',
-                'X-MACAddress': '00:00:00:00:00:00',
-                'X-PrivateKey': self.api_key
-            }
-            
-            # Default to last 30 days if dates not provided
-            if not from_date:
-                from_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-            if not to_date:
-                to_date = datetime.now().strftime('%Y-%m-%d')
+            access_token = self.access_token
             
             # SmartAPI historical data payload format
             payload = {
@@ -158,155 +356,926 @@ class AngelOneAPI:
             }
             
             logger.info(f"Requesting SmartAPI historical data for {symbol} (token: {token}) from {from_date} to {to_date}")
-            response = requests.post(url, headers=headers, json=payload)
+            response = self._post(url, self._headers(access_token), payload, rate_limited=True)
+            if response.status_code in (401, 403) and self._reauthenticate(access_token):
+                # A cached session can be revoked (e.g. by a login elsewhere); retry once with a new one
+                logger.warning("SmartAPI rejected the session token, re-authenticated")
+                response = self._post(url, self._headers(self.access_token), payload, rate_limited=True)
             
             logger.info(f"SmartAPI historical data response status: {response.status_code}")
-            logger.info(f"SmartAPI historical data response: {response.text}")
+            logger.debug(f"SmartAPI historical data response: {response.text}")
             
             if response.status_code == 200:
                 data = response.json()
-                if data.get('status') and data.get('data'):
-                    return self._process_historical_data(data['data'])
-                else:
-                    logger.error(f"No data returned for {symbol}: {data}")
+                if data.get('status'):
+                    # An empty range (holidays, before listing) is an empty frame, so it is cached as fetched
+                    with telemetry.span('smartapi.parse'):
+                        return self._process_historical_data(data.get('data') or {})
+                logger.error(f"No data returned for {symbol}: {data}")
+                self.request_failed = True
             else:
                 logger.error(f"SmartAPI historical data request failed with status {response.status_code}: {response.text}")
+                self.request_failed = True
             return None
         except Exception as e:
             logger.error(f"Error getting SmartAPI historical data for {symbol}: {e}")
+            self.request_failed = True
             return None
     
     def _process_historical_data(self, data):
         """Process SmartAPI historical data into DataFrame"""
         try:
-            df_data = []
-            for exchange, tokens in data.items():
-                for token, candles in tokens.items():
-                    for candle in candles:
-                        # Skip candles with empty or invalid data
-                        if len(candle) < 6 or not all(candle[:6]):
-                            logger.warning(f"Skipping invalid candle data: {candle}")
-                    continue
-                
-                        try:
-                            # Safely convert to float, handling empty strings
-                            open_price = float(candle[1]) if candle[1] and candle[1] != '' else 0.0
-                            high_price = float(candle[2]) if candle[2] and candle[2] != '' else 0.0
-                            low_price = float(candle[3]) if candle[3] and candle[3] != '' else 0.0
-                            close_price = float(candle[4]) if candle[4] and candle[4] != '' else 0.0
-                            volume = int(candle[5]) if candle[5] and candle[5] != '' else 0
-                            
-                            # Skip if all prices are zero (invalid data)
-                            if open_price == 0 and high_price == 0 and low_price == 0 and close_price == 0:
-                                logger.warning(f"Skipping candle with zero prices: {candle}")
-                    continue
-                
-                            df_data.append({
-                                'timestamp': datetime.fromtimestamp(int(candle[0]) / 1000),
-                                'open': open_price,
-                                'high': high_price,
-                                'low': low_price,
-                                'close': close_price,
-                                'volume': volume
-                            })
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Skipping invalid candle data: {candle}, error: {e}")
-                continue
-        
-            if not df_data:
-                logger.error("No valid historical data found")
-            return None
+            columns = [decode_candles(candles) for tokens in data.values() for candles in tokens.values()]
+            columns = [column for column in columns if len(column[0])]
+            if not columns:
+                if any(candles for tokens in data.values() for candles in tokens.values()):
+                    logger.error("No valid historical data found")
+                    return None
+                logger.info("No SmartAPI candles in the requested range")
+                columns = [decode_candles([])]
             
-            df = pd.DataFrame(df_data)
-            df = df.sort_values('timestamp').reset_index(drop=True)
+            timestamps, prices, volume = (np.concatenate(parts) for parts in zip(*columns))
+            # SmartAPI returns candles in time order, so the sort is usually skipped
+            if len(timestamps) > 1 and not (timestamps[1:] >= timestamps[:-1]).all():
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, prices, volume = timestamps[order], prices[order], volume[order]
+            
+            df = pd.DataFrame({
+                'timestamp': pd.to_datetime(timestamps, unit='ms'),
+                'open': prices[:, 0],
+                'high': prices[:, 1],
+                'low': prices[:, 2],
+                'close': prices[:, 3],
+                'volume': volume
+            })
             logger.info(f"Processed {len(df)} SmartAPI historical data points")
             return df
         except Exception as e:
             logger.error(f"Error processing SmartAPI historical data: {e}")
             return None
 
+MS_PER_HOUR = 60 * 60 * 1000
+
+def epoch_ms_to_local(epoch_ms):
+    """Naive local wall-clock epoch ms, matching datetime.fromtimestamp per value.
+    
+    The UTC offset is looked up once per distinct hour rather than per
+    candle, which stays exact across DST changes (they happen on the hour).
+    """
+    if not len(epoch_ms):
+        return epoch_ms
+    hours, inverse = np.unique(epoch_ms // MS_PER_HOUR, return_inverse=True)
+    offsets = np.array([
+        (datetime.fromtimestamp(hour * 3600) - datetime.fromtimestamp(hour * 3600, timezone.utc).replace(tzinfo=None))
+        // timedelta(milliseconds=1)
+        for hour in hours.tolist()
+    ], dtype=np.int64)
+    return epoch_ms + offsets[inverse.reshape(-1)]
+
+def _parse_candle_timestamps(values):
+    """Wall-clock epoch ms for a column of epoch-ms numbers and/or ISO 8601 strings (NaN-free int64)"""
+    numeric = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(np.float64)
+    epoch_ms = np.zeros(len(values), dtype=np.int64)
+    is_epoch = ~np.isnan(numeric)
+    epoch_ms[is_epoch] = epoch_ms_to_local(numeric[is_epoch].astype(np.int64))
+    
+    # "2024-01-01T09:15:00+05:30" is already exchange wall-clock time; drop the offset
+    text = pd.Series(values[~is_epoch], dtype=object)
+    is_text = text.map(lambda value: isinstance(value, str)).to_numpy(bool)
+    parsed = pd.to_datetime(text.where(is_text).str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+    valid_text = parsed.notna().to_numpy()
+    text_ms = np.zeros(len(text), dtype=np.int64)
+    text_ms[valid_text] = timestamps_to_ms(parsed[valid_text].to_numpy())
+    
+    epoch_ms[~is_epoch] = text_ms
+    valid = is_epoch.copy()
+    valid[~is_epoch] = valid_text
+    return epoch_ms, valid
+
+def decode_candles(candles):
+    """Decode SmartAPI [timestamp, open, high, low, close, volume] rows into typed columns.
+    
+    Returns (wall-clock epoch ms int64, OHLC float64 of shape (n, 4), volume
+    int64). Rows that are short, have an empty or zero field, or can't be
+    converted are dropped, as the row-by-row parser did. Plain numeric
+    payloads are streamed into a single float64 buffer; anything else
+    (ISO timestamps, nulls, ragged rows) goes through a per-column path.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float64), np.empty(0, dtype=np.int64))
+    if not candles:
+        return empty
+    
+    # Fast path: equal-length rows of plain numbers stream straight into one float64 buffer
+    width = len(candles[0])
+    if width >= 6 and all(len(candle) == width for candle in candles):
+        try:
+            values = np.fromiter(chain.from_iterable(candles), dtype=np.float64, count=len(candles) * width)
+        except (TypeError, ValueError):
+            values = None
+        if values is not None:
+            values = values.reshape(len(candles), width)[:, :6]
+            valid = (values != 0).all(axis=1) & ~np.isnan(values).any(axis=1)
+            values = values[valid]
+            epoch_ms = epoch_ms_to_local(values[:, 0].astype(np.int64))
+            return epoch_ms, np.ascontiguousarray(values[:, 1:5]), values[:, 5].astype(np.int64)
+    
+    # Mixed payload: pad short rows so every column lines up, then mark them invalid
+    rows = np.empty((len(candles), 6), dtype=object)
+    long_enough = np.fromiter((len(candle) >= 6 for candle in candles), dtype=bool, count=len(candles))
+    rows[long_enough] = [candle[:6] for candle in candles if len(candle) >= 6]
+    truthy = np.frompyfunc(bool, 1, 1)(rows).astype(bool).all(axis=1) & long_enough
+    
+    epoch_ms, valid = _parse_candle_timestamps(rows[:, 0])
+    values = np.column_stack([
+        pd.to_numeric(pd.Series(rows[:, k]), errors='coerce').to_numpy(np.float64) for k in range(1, 6)
+    ])
+    valid &= truthy & ~np.isnan(values).any(axis=1)
+    # Fractional volumes are truncated like int() did
+    volume = np.trunc(values[valid, 4]).astype(np.int64)
+    prices = values[valid, :4]
+    # A row whose prices all parse to zero (e.g. "0" strings) carries no data
+    nonzero = (prices != 0).any(axis=1)
+    return epoch_ms[valid][nonzero], np.ascontiguousarray(prices[nonzero]), volume[nonzero]
+
+# Maximum number of days SmartAPI returns in one getCandleData request
+MAX_DAYS_PER_REQUEST = {
+    'ONE_MINUTE': 30,
+    'THREE_MINUTE': 60,
+    'FIVE_MINUTE': 100,
+    'TEN_MINUTE': 100,
+    'FIFTEEN_MINUTE': 200,
+    'THIRTY_MINUTE': 200,
+    'ONE_HOUR': 400,
+    'ONE_DAY': 2000
+}
+
+# Length of one bar of each interval
+INTERVAL_MINUTES = {
+    'ONE_MINUTE': 1,
+    'THREE_MINUTE': 3,
+    'FIVE_MINUTE': 5,
+    'TEN_MINUTE': 10,
+    'FIFTEEN_MINUTE': 15,
+    'THIRTY_MINUTE': 30,
+    'ONE_HOUR': 60,
+    'ONE_DAY': 24 * 60
+}
+
+DEFAULT_INTERVAL = "ONE_MINUTE"
+
+def trade_window(entry_datetime, exit_days):
+    """Date range of candles needed to evaluate one trade"""
+    from_date = (entry_datetime - timedelta(days=5)).normalize()
+    to_date = (entry_datetime + timedelta(days=exit_days + 5)).normalize()
+    return from_date, to_date
+
+def plan_fetch_windows(entry_datetimes, exit_days, interval=DEFAULT_INTERVAL):
+    """Merge per-trade windows into the fewest date ranges SmartAPI accepts"""
+    max_span = timedelta(days=MAX_DAYS_PER_REQUEST.get(interval, 30) - 1)
+    windows = sorted(trade_window(pd.Timestamp(entry), exit_days) for entry in entry_datetimes)
+    
+    # Union overlapping or adjacent windows
+    merged = []
+    for window_from, window_to in windows:
+        if merged and window_from <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], window_to)
+        else:
+            merged.append([window_from, window_to])
+    
+    # Pack the unions into requests no longer than the interval limit
+    requests_plan = []
+    for window_from, window_to in merged:
+        if requests_plan and window_to - requests_plan[-1][0] <= max_span:
+            requests_plan[-1][1] = window_to
+            continue
+        while window_to - window_from > max_span:
+            requests_plan.append([window_from, window_from + max_span])
+            window_from = window_from + max_span + timedelta(days=1)
+        requests_plan.append([window_from, window_to])
+    
+    return [(f.strftime('%Y-%m-%d'), t.strftime('%Y-%m-%d')) for f, t in requests_plan]
+
+def split_date_range(from_date, to_date, interval=DEFAULT_INTERVAL):
+    """Split an inclusive date range into consecutive chunks no longer than one request may span.
+    
+    The first and last chunk keep from_date and to_date as given (time of
+    day included); inner boundaries are plain dates.
+    """
+    max_days = MAX_DAYS_PER_REQUEST.get(interval, 30)
+    first, last = pd.Timestamp(from_date).normalize(), pd.Timestamp(to_date).normalize()
+    if (last - first).days < max_days:
+        return [(from_date, to_date)]
+    chunks = []
+    start = first
+    while start <= last:
+        end = min(start + timedelta(days=max_days - 1), last)
+        chunks.append([start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')])
+        start = end + timedelta(days=1)
+    chunks[0][0], chunks[-1][1] = from_date, to_date
+    return [tuple(chunk) for chunk in chunks]
+
+def plan_day_windows(timestamps_ms, interval=DEFAULT_INTERVAL):
+    """Fewest date ranges SmartAPI accepts that cover the days of the given epoch-ms timestamps"""
+    max_days = MAX_DAYS_PER_REQUEST.get(interval, 30)
+    windows = []
+    for day in np.unique(np.asarray(timestamps_ms, dtype=np.int64) // MS_PER_DAY).tolist():
+        if windows and day == windows[-1][1] + 1 and day - windows[-1][0] < max_days:
+            windows[-1][1] = day
+        else:
+            windows.append([day, day])
+    return [tuple(pd.Timestamp(day * MS_PER_DAY, unit='ms').strftime('%Y-%m-%d') for day in window)
+            for window in windows]
+
+# Exchange the candle cache keys series (and memoized results) by
+DEFAULT_EXCHANGE = 'NSE'
+
+def find_exit_index(timestamps, low, high, close, entry_ms, sl_price, target_price, exit_ms):
+    """Vectorized exit search over sorted candle arrays.
+    
+    Scans the bars strictly after entry_ms for the first valid bar whose low
+    touches sl_price or whose high touches target_price (stop loss wins when
+    a single bar touches both). Otherwise exits on the first bar at or after
+    exit_ms. Returns (bar index, EXIT_* code) or (None, None).
+    """
+    start = np.searchsorted(timestamps, entry_ms, side='right')
+    if start >= len(timestamps):
+        return None, None
+    
+    low, high, close = low[start:], high[start:], close[start:]
+    valid = _valid_bars(low, high, close)
+    hit_sl = valid & (low <= sl_price)
+    hit_target = valid & (high >= target_price)
+    hit = hit_sl | hit_target
+    
+    first = int(hit.argmax())
+    if hit[first]:
+        return start + first, EXIT_STOP_LOSS if hit_sl[first] else EXIT_TARGET
+    
+    exit_idx = max(np.searchsorted(timestamps, exit_ms, side='left'), start)
+    if exit_idx >= len(timestamps):
+        return None, None
+    exit_close = close[exit_idx - start]
+    if np.isnan(exit_close) or exit_close == 0:
+        logger.warning(f"Invalid exit price for time exit: {exit_close}")
+        return None, None
+    return int(exit_idx), EXIT_TIME
+
+def candle_arrays(hist_data):
+    """Contiguous NumPy columns (epoch-ms timestamps, float64 prices) for a sorted candle frame"""
+    return CandleArrays(
+        timestamps=np.ascontiguousarray(timestamps_to_ms(hist_data['timestamp'].values)),
+        open=np.ascontiguousarray(hist_data['open'].to_numpy(dtype=np.float64)),
+        high=np.ascontiguousarray(hist_data['high'].to_numpy(dtype=np.float64)),
+        low=np.ascontiguousarray(hist_data['low'].to_numpy(dtype=np.float64)),
+        close=np.ascontiguousarray(hist_data['close'].to_numpy(dtype=np.float64)),
+        volume=np.ascontiguousarray(hist_data['volume'].to_numpy(dtype=np.int64))
+    )
+
+MS_PER_MINUTE = 60 * 1000
+
+def daily_closes(candles):
+    """(epoch ms, close) of each day's last bar with a usable close, for marking open positions"""
+    usable = ~np.isnan(candles.close) & (candles.close != 0)
+    timestamps, close = candles.timestamps[usable], candles.close[usable]
+    if not len(timestamps):
+        return timestamps, close
+    days = timestamps // MS_PER_DAY
+    last = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+    return timestamps[last], close[last]
+
+def find_entry_index(timestamps, entry_ms, tolerance_ms=ENTRY_TOLERANCE_MS, allow_later=True):
+    """find_entry_indices for a single entry: a binary search, then the bars either side of it"""
+    if not allow_later:
+        at_or_before = int(np.searchsorted(timestamps, entry_ms, side='right')) - 1
+        return at_or_before if at_or_before >= 0 and entry_ms - timestamps[at_or_before] <= tolerance_ms else -1
+    after = int(np.searchsorted(timestamps, entry_ms, side='left'))
+    closest = -1
+    if after > 0 and entry_ms - timestamps[after - 1] <= tolerance_ms:
+        closest = after - 1
+    if after < len(timestamps) and timestamps[after] - entry_ms <= tolerance_ms:
+        # Ties go to the earlier bar
+        if closest < 0 or timestamps[after] - entry_ms < entry_ms - timestamps[closest]:
+            closest = after
+    return closest
+
+# Below this many candles per shard, process-pool overhead outweighs evaluating in-process
+MIN_SHARD_BARS = 100_000
+
+_shard_pool = None
+_shard_pool_workers = 0
+_shard_pool_lock = threading.Lock()
+
+def shard_pool(workers):
+    """Process pool shared by every parallel backtest, created on first use.
+    
+    Workers come from a forkserver, since forking would copy the
+    request-serving threads and their locks mid-flight; it preloads
+    batch_kernel so workers start without importing this module. The pool is
+    replaced when it is smaller than workers or has been discarded.
+    """
+    global _shard_pool, _shard_pool_workers
+    with _shard_pool_lock:
+        if _shard_pool is None or _shard_pool_workers < workers:
+            if _shard_pool is not None:
+                # Backtests still using it finish their shards first
+                _shard_pool.shutdown(wait=False)
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['batch_kernel'])
+            _shard_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _shard_pool_workers = workers
+        return _shard_pool
+
+def discard_shard_pool(pool):
+    """Drop a broken pool (e.g. a worker was killed) so the next backtest starts a new one"""
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is pool:
+            _shard_pool = None
+    pool.shutdown(wait=False)
+
 class BacktestEngine:
-    def __init__(self, api_client):
+    def __init__(self, api_client, candle_cache=None, workers=1, interval=DEFAULT_INTERVAL,
+                 resolve_interval=None, min_shard_bars=MIN_SHARD_BARS):
+        if resolve_interval and INTERVAL_MINUTES[resolve_interval] >= INTERVAL_MINUTES[interval]:
+            raise ValueError(f"resolve_interval {resolve_interval} must be finer than {interval}")
         self.api_client = api_client
+        self.candle_cache = candle_cache
+        self.workers = workers
+        # Runs with fewer candles than this per worker are evaluated in-process
+        self.min_shard_bars = min_shard_bars
+        self.interval = interval
+        # Bars longer than the usual tolerance (ONE_DAY) take the entry from the bar it falls in or the
+        # one before; the nearest bar could close well after the entry. Exits are searched after the
+        # entry, so such a bar is never also the exit bar
+        bar_ms = INTERVAL_MINUTES[interval] * MS_PER_MINUTE
+        self.entry_tolerance_ms = max(ENTRY_TOLERANCE_MS, bar_ms)
+        self.entry_allow_later = bar_ms <= ENTRY_TOLERANCE_MS
+        # Finer candles, fetched only for bars that touch both the stop loss and the target
+        self.resolve_interval = resolve_interval
+        # Trades the last run left out of its results, by reason
+        self.skipped = Counter()
+        # Trades whose ambiguous exit bar could not be resolved, so are not memoized
+        self.unresolved = set()
+        # Trades whose evaluation raised, so are not memoized either
+        self.errored = set()
+        # Without a candle cache, each symbol's daily closes from the last run (see daily_closes())
+        self._daily_closes = {}
+    
+    @property
+    def results_interval(self):
+        """Interval key memoized results are stored under"""
+        return f"{self.interval}/{self.resolve_interval}" if self.resolve_interval else self.interval
+    
+    def _get_historical_data(self, symbol, from_date, to_date, interval=DEFAULT_INTERVAL):
+        """Load candles through the candle cache when one is configured"""
+        if self.candle_cache is not None:
+            return self.candle_cache.get_historical_data(
+                self.api_client, symbol, interval=interval, from_date=from_date, to_date=to_date
+            )
+        return self.api_client.get_historical_data(
+            symbol, interval=interval, from_date=from_date, to_date=to_date
+        )
+    
+    def _load_symbol_data(self, symbol, windows, interval=DEFAULT_INTERVAL):
+        """Fetch every (from_date, to_date) window and combine them into one frame"""
+        frames = []
+        for from_date, to_date in windows:
+            hist_data = self._get_historical_data(symbol, from_date, to_date, interval=interval)
+            if hist_data is not None and not hist_data.empty:
+                frames.append(hist_data)
+        
+        if not frames:
+            return None
+        
+        hist_data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return (hist_data.drop_duplicates('timestamp')
+                .sort_values('timestamp')
+                .reset_index(drop=True))
+    
+    def _load_candles(self, symbol, windows, interval):
+        """MappedCandles from the candle cache when one is configured, else a candle frame"""
+        if self.candle_cache is not None:
+            return self.candle_cache.get_mapped_candles(self.api_client, symbol, windows, interval=interval)
+        return self._load_symbol_data(symbol, windows, interval)
+    
+    def _iter_symbol_candles(self, trades_df, exit_days):
+        """Yield (symbol, entry datetimes, candle arrays) once per symbol.
+        
+        The entry Series is indexed by the trade's position in trades_df.
+        Symbols without usable entries or candles are logged and skipped.
+        Candles come from the candle cache as MappedCandles, else CandleArrays.
+        """
+        entry_datetimes = pd.to_datetime(trades_df['entry_datetime'], errors='coerce')
         
-    def run_backtest(self, trades_df, stop_loss_pct, target_pct, exit_days):
-        """Run backtest on trades"""
-        results = []
+        symbols = []
+        for symbol, symbol_trades in trades_df.groupby('symbol', sort=False):
+            symbol_entries = entry_datetimes[symbol_trades.index].dropna()
+            if len(symbol_entries) < len(symbol_trades):
+                logger.warning(f"Skipping {len(symbol_trades) - len(symbol_entries)} {symbol} trades with invalid entry_datetime")
+                self.skipped['invalid_entry_datetime'] += len(symbol_trades) - len(symbol_entries)
+            if not symbol_entries.empty:
+                symbols.append((symbol, symbol_entries))
         
-        for _, trade in trades_df.iterrows():
+        @telemetry.bind
+        def load(item):
+            symbol, symbol_entries = item
             try:
-                # Parse entry date and time
-                entry_datetime = pd.to_datetime(trade['entry_datetime'])
-                symbol = trade['symbol']
-                
-                # Get historical data for the symbol
-                hist_data = self.api_client.get_historical_data(
-                    symbol, 
-                    from_date=(entry_datetime - timedelta(days=5)).strftime('%Y-%m-%d'),
-                    to_date=(entry_datetime + timedelta(days=exit_days + 5)).strftime('%Y-%m-%d')
-                )
-                
-                if hist_data is None or hist_data.empty:
+                with telemetry.span('engine.candles'):
+                    return self._load_candles(symbol, plan_fetch_windows(symbol_entries, exit_days, self.interval),
+                                              self.interval)
+            except Exception as e:
+                logger.error(f"Error loading historical data for {symbol}: {e}")
+                return None
+        
+        # Load symbols concurrently up to the client's limit; the rate limiter
+        # inside the client keeps the request rate within SmartAPI's limits
+        max_workers = getattr(self.api_client, 'max_concurrency', 1)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for (symbol, symbol_entries), hist_data in zip(symbols, executor.map(load, symbols)):
+                if hist_data is None or not len(hist_data):
                     logger.warning(f"No historical data for {symbol}")
+                    self.skipped['no_candles'] += len(symbol_entries)
                     continue
                 
-                # Find entry price (closest 1-hour candle)
-                entry_price = self._get_entry_price(hist_data, entry_datetime)
-                if entry_price is None:
-                    logger.warning(f"Could not find entry price for {symbol} at {entry_datetime}")
+                if isinstance(hist_data, MappedCandles):
+                    # Already shared through the page cache
+                    yield symbol, symbol_entries, hist_data
                     continue
                 
-                # Calculate stop loss and target prices
-                try:
-                    sl_price = float(entry_price) * (1 - float(stop_loss_pct) / 100)
-                    target_price = float(entry_price) * (1 + float(target_pct) / 100)
-                except (ValueError, TypeError) as e:
-                    logger.error(f"Error calculating prices for {symbol}: {e}, entry_price: {entry_price}")
-                    continue
-                
-                # Find exit conditions
-                exit_result = self._find_exit(hist_data, entry_datetime, entry_price, 
-                                            sl_price, target_price, exit_days)
+                candles = candle_arrays(hist_data)
+                if self.candle_cache is None:
+                    self._daily_closes[symbol] = daily_closes(candles)
                 
-                if exit_result:
-                    pnl_pct = ((exit_result['exit_price'] - entry_price) / entry_price) * 100
-                    results.append({
-                        'symbol': symbol,
-                        'entry_datetime': entry_datetime,
-                        'entry_price': entry_price,
-                        'exit_datetime': exit_result['exit_datetime'],
-                        'exit_price': exit_result['exit_price'],
-                        'exit_reason': exit_result['exit_reason'],
-                        'pnl_pct': pnl_pct,
-                        'pnl_amount': exit_result['exit_price'] - entry_price,
-                        'stop_loss': sl_price,
-                        'target': target_price
-                    })
-                    
-            except Exception as e:
-                logger.error(f"Error processing trade for {trade.get('symbol', 'unknown')}: {e}")
+                yield symbol, symbol_entries, candles
+    
+    def run_backtest(self, trades_df, stop_loss_pct, target_pct, exit_days, progress_callback=None):
+        """Run backtest on trades, fetching candles once per symbol.
+        
+        With a candle cache, trades evaluated by an earlier run with the same
+        parameters are taken from its result memo and only the rest are
+        evaluated. progress_callback, if given, is called as each symbol
+        finishes with (trades done, total trades, symbol, that symbol's
+        results frame); memoized trades are reported first, with no symbol.
+        """
+        trades_df = trades_df.reset_index(drop=True)
+        self.skipped = Counter()
+        self.unresolved = set()
+        self.errored = set()
+        self._daily_closes = {}
+        with telemetry.span('engine.recall'):
+            recalled, pending = self._recall_results(trades_df, stop_loss_pct, target_pct, exit_days)
+        telemetry.count('backtest_trades_total', len(trades_df) - len(pending), source='memoized')
+        telemetry.count('backtest_trades_total', len(pending), source='evaluated')
+        if progress_callback and len(pending) < len(trades_df):
+            progress_callback(len(trades_df) - len(pending), len(trades_df), None, recalled)
+            report = progress_callback
+            offset = len(trades_df) - len(pending)
+            progress_callback = lambda done, total, symbol, symbol_results: report(
+                done + offset, total + offset, symbol, symbol_results)
+        
+        if self.workers > 1:
+            results = self._run_parallel(pending, stop_loss_pct, target_pct, exit_days, progress_callback)
+        else:
+            results = self._run_sequential(pending, stop_loss_pct, target_pct, exit_days, progress_callback)
+        with telemetry.span('engine.remember'):
+            self._remember_results(pending, results, stop_loss_pct, target_pct, exit_days)
+        for reason, skipped in self.skipped.items():
+            telemetry.count('backtest_trades_skipped_total', skipped, reason=reason)
+        
+        frames = [frame for frame in (recalled, results) if frame is not None and not frame.empty]
+        if not frames:
+            return pd.DataFrame()
+        results = pd.concat(frames)
+        # Carry the uploaded groupings through for the per-group metrics
+        for column in ('market_cap', 'sector'):
+            if column in trades_df:
+                results[column] = trades_df[column].reindex(results.index).to_numpy()
+        # Keep results in the order the trades were uploaded
+        return results.sort_index().reset_index(drop=True)
+    
+    def daily_closes(self, results):
+        """{symbol: (epoch ms, close)} at each day's last bar, for marking a run's open positions.
+        
+        With a candle cache every result's window is cached by now, memoized
+        ones included, so the closes are read from the mapped snapshot over
+        each symbol's entry to exit dates. Without one, the closes kept while
+        the last run loaded each symbol are returned.
+        """
+        if self.candle_cache is None:
+            return dict(self._daily_closes)
+        closes = {}
+        for symbol, symbol_results in results.groupby('symbol', sort=False):
+            token = self.api_client.symbol_tokens.get(symbol)
+            if not token:
                 continue
+            windows = list(zip(symbol_results['entry_datetime'].dt.strftime('%Y-%m-%d'),
+                               symbol_results['exit_datetime'].dt.strftime('%Y-%m-%d')))
+            candles = self.candle_cache.map(DEFAULT_EXCHANGE, token, self.interval, windows)
+            if candles is not None:
+                closes[symbol] = daily_closes(candles.arrays())
+        return closes
+    
+    def _recall_results(self, trades_df, stop_loss_pct, target_pct, exit_days):
+        """Split trades into memoized results (indexed by trade position) and the trades still to evaluate"""
+        if self.candle_cache is None or trades_df.empty:
+            return None, trades_df
         
-        return pd.DataFrame(results)
+        entry_datetimes = pd.to_datetime(trades_df['entry_datetime'], errors='coerce')
+        recalled = []
+        done = []
+        for symbol, symbol_trades in trades_df.groupby('symbol', sort=False):
+            token = self.api_client.symbol_tokens.get(symbol)
+            symbol_entries = entry_datetimes[symbol_trades.index].dropna()
+            if not token or symbol_entries.empty:
+                continue
+            entry_ms = pd.Series(timestamps_to_ms(symbol_entries.values), index=symbol_entries.index)
+            memo = self.candle_cache.load_results(DEFAULT_EXCHANGE, token, self.results_interval, stop_loss_pct,
+                                                  target_pct, exit_days, entry_ms.to_numpy())
+            if memo.empty:
+                continue
+            memo = memo.set_index('entry_ms')
+            known = entry_ms[entry_ms.isin(memo.index)]
+            done.append(known.index)
+            
+            rows = memo.loc[known.to_numpy()].set_axis(known.index)
+            rows = rows[rows['exit_code'] >= 0]
+            if rows.empty:
+                continue
+            entry_price = rows['entry_price'].to_numpy()
+            exit_price = rows['exit_price'].to_numpy()
+            exit_code = rows['exit_code'].to_numpy()
+            recalled.append(pd.DataFrame({
+                'symbol': symbol,
+                'entry_datetime': entry_datetimes[rows.index],
+                'entry_price': entry_price,
+                'exit_datetime': pd.to_datetime(rows['exit_ms'].to_numpy(), unit='ms'),
+                'exit_price': exit_price,
+                'exit_reason': np.array(['Stop Loss', 'Target', f'Time Exit ({exit_days} days)'],
+                                        dtype=object)[exit_code],
+                'pnl_pct': ((exit_price - entry_price) / entry_price) * 100,
+                'pnl_amount': exit_price - entry_price,
+                'stop_loss': entry_price * (1 - float(stop_loss_pct) / 100),
+                'target': entry_price * (1 + float(target_pct) / 100)
+            }, index=rows.index))
+        
+        if not done:
+            return None, trades_df
+        done = np.concatenate(done)
+        logger.info(f"Reusing memoized results for {len(done)} of {len(trades_df)} trades")
+        recalled = pd.concat(recalled) if recalled else None
+        return recalled, trades_df.drop(index=done)
     
-    def _get_entry_price(self, hist_data, entry_datetime):
-        """Get entry price from closest 1-hour candle"""
-        try:
-            # Filter data around entry time (±2 hours)
-            start_time = entry_datetime - timedelta(hours=2)
-            end_time = entry_datetime + timedelta(hours=2)
+    def _remember_results(self, trades_df, results, stop_loss_pct, target_pct, exit_days):
+        """Memoize the results of trades whose whole candle window is cached, and so final"""
+        if self.candle_cache is None or trades_df.empty:
+            return
+        
+        entry_datetimes = pd.to_datetime(trades_df['entry_datetime'], errors='coerce')
+        if results is None:
+            results = pd.DataFrame(columns=['entry_price', 'exit_datetime', 'exit_price', 'exit_reason'])
+        exit_codes = {'Stop Loss': EXIT_STOP_LOSS, 'Target': EXIT_TARGET}
+        for symbol, symbol_trades in trades_df.groupby('symbol', sort=False):
+            token = self.api_client.symbol_tokens.get(symbol)
+            symbol_entries = entry_datetimes[symbol_trades.index].dropna()
+            if not token or symbol_entries.empty:
+                continue
+            windows = [tuple(day.strftime('%Y-%m-%d') for day in trade_window(entry, exit_days))
+                       for entry in symbol_entries]
+            covered = self.candle_cache.covered(DEFAULT_EXCHANGE, token, self.interval, windows)
+            evaluated = ~symbol_entries.index.isin(self.unresolved) & ~symbol_entries.index.isin(self.errored)
+            final = symbol_entries[np.asarray(covered, dtype=bool) & evaluated]
+            if final.empty:
+                continue
             
-            mask = (hist_data['timestamp'] >= start_time) & (hist_data['timestamp'] <= end_time)
-            nearby_data = hist_data[mask]
+            found = results.reindex(final.index)
+            has_result = found['exit_price'].notna().to_numpy()
+            exit_ms = np.zeros(len(found), dtype=np.int64)
+            exit_ms[has_result] = timestamps_to_ms(found['exit_datetime'][has_result].values)
+            # No entry price or exit in a complete window is final too
+            exit_code = np.where(has_result, found['exit_reason'].map(exit_codes).fillna(EXIT_TIME).astype(int), -1)
+            rows = [(entry_ms, entry_price, exit, exit_price, code) if code >= 0 else (entry_ms, None, None, None, code)
+                    for entry_ms, entry_price, exit, exit_price, code in zip(
+                        timestamps_to_ms(final.values).tolist(), found['entry_price'].tolist(),
+                        exit_ms.tolist(), found['exit_price'].tolist(), exit_code.tolist())]
+            if rows:
+                self.candle_cache.store_results(DEFAULT_EXCHANGE, token, self.results_interval,
+                                                stop_loss_pct, target_pct, exit_days, rows)
+    
+    def _run_sequential(self, trades_df, stop_loss_pct, target_pct, exit_days, progress_callback=None):
+        """Evaluate symbols one at a time; results are indexed by trade position"""
+        symbol_results = []
+        trade_counts = trades_df.groupby('symbol', sort=False).size()
+        done = 0
+        
+        for symbol, symbol_entries, candles in self._iter_symbol_candles(trades_df, exit_days):
+            done += int(trade_counts[symbol])
+            results = self._evaluate_symbol(symbol, symbol_entries, candles, stop_loss_pct, target_pct, exit_days)
+            if results is None:
+                continue
+            symbol_results.append(results)
             
-            if nearby_data.empty:
-                return None
+            if progress_callback:
+                progress_callback(done, len(trades_df), symbol, symbol_results[-1])
+        
+        if progress_callback:
+            progress_callback(len(trades_df), len(trades_df), None, None)
+        
+        return pd.concat(symbol_results) if symbol_results else None
+    
+    def _evaluate_symbol(self, symbol, symbol_entries, candles, stop_loss_pct, target_pct, exit_days):
+        """evaluate_batch then _resolve_exits for one symbol.
+        
+        Returns None if either raises, with the symbol's trades counted as
+        skipped and recorded as errored.
+        """
+        try:
+            with telemetry.span('engine.evaluate'):
+                results = self.evaluate_batch(symbol, candles, symbol_entries, stop_loss_pct, target_pct, exit_days)
+            return self._resolve_exits(symbol, candles, results)
+        except Exception as e:
+            logger.error(f"Error processing trades for {symbol}: {e}")
+            self.skipped['error'] += len(symbol_entries)
+            self.errored.update(symbol_entries.index)
+            return None
+    
+    def _run_parallel(self, trades_df, stop_loss_pct, target_pct, exit_days, progress_callback=None):
+        """Shard symbols across the shard pool, sharing candle arrays through shared memory.
+        
+        Runs with a single symbol, or under min_shard_bars candles per shard,
+        are evaluated in-process instead.
+        """
+        symbol_candles = list(self._iter_symbol_candles(trades_df, exit_days))
+        total_bars = sum(len(candles) if isinstance(candles, MappedCandles) else len(candles.timestamps)
+                         for _, _, candles in symbol_candles)
+        shard_count = min(self.workers, len(symbol_candles), total_bars // max(self.min_shard_bars, 1))
+        if shard_count < 2:
+            symbol_results = [results for results in (
+                self._evaluate_symbol(symbol, entries, candles, stop_loss_pct, target_pct, exit_days)
+                for symbol, entries, candles in symbol_candles) if results is not None]
+            if progress_callback:
+                progress_callback(len(trades_df), len(trades_df), None, None)
+            return pd.concat(symbol_results) if symbol_results else None
+        
+        shm, layouts = _pack_candles(symbol_candles)
+        try:
+            # Balance shards by candles x trades, largest symbols first
+            shards = [[] for _ in range(shard_count)]
+            loads = [0] * len(shards)
+            work = sorted(zip(symbol_candles, layouts),
+                          key=lambda item: item[1][0] * len(item[0][1]), reverse=True)
+            for (symbol, entries, candles), (bars, layout) in work:
+                shard = loads.index(min(loads))
+                shards[shard].append((symbol, bars, layout, entries.index.to_numpy(), entries.to_numpy()))
+                loads[shard] += bars * len(entries)
             
-            # Find closest timestamp
-            nearby_data['time_diff'] = abs(nearby_data['timestamp'] - entry_datetime)
-            closest_idx = nearby_data['time_diff'].idxmin()
+            symbol_results = []
+            candles_by_symbol = {symbol: candles for symbol, _, candles in symbol_candles}
+            trade_counts = trades_df.groupby('symbol', sort=False).size()
+            done = 0
+            executor = shard_pool(self.workers)
+            with telemetry.span('engine.evaluate'):
+                futures = {executor.submit(_evaluate_shard, shm.name, shard, stop_loss_pct, target_pct, exit_days,
+                                           self.entry_tolerance_ms, self.entry_allow_later): shard
+                           for shard in shards}
+                for future in as_completed(futures):
+                    try:
+                        shard_results, shard_skipped, shard_errored = future.result()
+                    except Exception as e:
+                        # e.g. a worker process that died; none of the shard's trades were evaluated
+                        logger.error(f"Error evaluating shard of {len(futures[future])} symbols: {e}")
+                        if isinstance(e, BrokenProcessPool):
+                            discard_shard_pool(executor)
+                        shard_results, shard_errored = [], [position for item in futures[future] for position in item[3]]
+                        shard_skipped = Counter(error=len(shard_errored))
+                    self.errored.update(shard_errored)
+                    # Ambiguous exits are resolved here, where the API client is
+                    shard_results = [self._resolve_exits(results['symbol'].iat[0], candles_by_symbol[results['symbol'].iat[0]],
+                                                         results) if len(results) else results for results in shard_results]
+                    symbol_results.extend(shard_results)
+                    self.skipped.update(shard_skipped)
+                    if progress_callback:
+                        done += sum(int(trade_counts[item[0]]) for item in futures[future])
+                        progress_callback(done, len(trades_df), futures[future][-1][0],
+                                          pd.concat(shard_results) if shard_results else None)
+        finally:
+            shm.close()
+            shm.unlink()
+        
+        if progress_callback:
+            progress_callback(len(trades_df), len(trades_df), None, None)
+        
+        # Shard order depends on load balancing; run_backtest sorts by trade position
+        return pd.concat(symbol_results) if symbol_results else None
+    
+    def evaluate_batch(self, symbol, candles, entry_datetimes, stop_loss_pct, target_pct, exit_days):
+        """Evaluate all of a symbol's trades against its candle arrays in one pass.
+        
+        entry_datetimes is a Series of entry timestamps; its index is kept on
+        the returned results frame. Trades without a valid entry price or exit
+        are dropped, like in the per-trade path.
+        """
+        return evaluate_trades(symbol, candles, entry_datetimes, stop_loss_pct, target_pct, exit_days,
+                               self.entry_tolerance_ms, self.entry_allow_later, self.skipped)
+    
+    def _resolve_exits(self, symbol, candles, results):
+        """Re-decide Stop Loss exits on bars that also reached the target, from resolve_interval candles.
+        
+        A coarse bar that touches both levels resolves as Stop Loss since the
+        order within it is unknown. Finer candles are fetched for just the
+        days of those bars and searched, over each bar's span, for the level
+        touched first; the exit moves to that finer bar. Trades whose finer
+        candles can't be loaded keep the coarse result.
+        """
+        if not self.resolve_interval or results.empty:
+            return results
+        candles = as_candle_arrays(candles)
+        exit_ms = timestamps_to_ms(results['exit_datetime'].values)
+        exit_idx = np.minimum(np.searchsorted(candles.timestamps, exit_ms), len(candles.timestamps) - 1)
+        target_prices = results['target'].to_numpy()
+        ambiguous = (results['exit_reason'] == 'Stop Loss').to_numpy() & (candles.high[exit_idx] >= target_prices)
+        if not ambiguous.any():
+            return results
+        
+        bar_start = exit_ms[ambiguous]
+        bar_end = bar_start + INTERVAL_MINUTES[self.interval] * MS_PER_MINUTE
+        try:
+            with telemetry.span('engine.resolve'):
+                fine = self._load_candles(symbol, plan_day_windows(bar_start, self.resolve_interval),
+                                          self.resolve_interval)
+        except Exception as e:
+            logger.error(f"Error loading {self.resolve_interval} candles for {symbol}: {e}")
+            fine = None
+        if fine is None or not len(fine):
+            exit_code = np.full(len(bar_start), -1)
+        else:
+            fine = candle_arrays(fine) if isinstance(fine, pd.DataFrame) else as_candle_arrays(fine)
+            # Only bars inside the coarse bar: strictly after its start - 1 ms, no time exit before its end
+            exit_idx, exit_code = find_exit_indices(fine, bar_start - 1, results['stop_loss'].to_numpy()[ambiguous],
+                                                    target_prices[ambiguous], bar_end, bar_end)
+        
+        resolved = exit_code >= 0
+        unresolved = results.index[ambiguous][~resolved]
+        if len(unresolved):
+            logger.warning(f"Could not resolve {len(unresolved)} {symbol} exits from {self.resolve_interval} candles")
+            self.unresolved.update(unresolved)
+        target_hit = exit_code[resolved] == EXIT_TARGET
+        telemetry.count('backtest_exits_resolved_total', int(target_hit.sum()), result='target')
+        telemetry.count('backtest_exits_resolved_total', int((~target_hit).sum()), result='stop_loss')
+        telemetry.count('backtest_exits_resolved_total', len(unresolved), result='unresolved')
+        
+        rows = results.index[ambiguous][resolved]
+        if not len(rows):
+            return results
+        results = results.copy()
+        results.loc[rows, 'exit_datetime'] = pd.to_datetime(fine.timestamps[exit_idx[resolved]], unit='ms')
+        entry_price = results.loc[rows, 'entry_price'].to_numpy()
+        exit_price = np.where(target_hit, results.loc[rows, 'target'], results.loc[rows, 'stop_loss'])
+        results.loc[rows, 'exit_price'] = exit_price
+        results.loc[rows, 'exit_reason'] = np.where(target_hit, 'Target', 'Stop Loss')
+        results.loc[rows, 'pnl_pct'] = ((exit_price - entry_price) / entry_price) * 100
+        results.loc[rows, 'pnl_amount'] = exit_price - entry_price
+        return results
+    
+    def _resolve_entries(self, symbol, candles, entry_datetimes):
+        """Entry prices for a symbol's trades; trades without one are logged and dropped"""
+        return resolve_entries(symbol, candles, entry_datetimes, self.entry_tolerance_ms, self.entry_allow_later,
+                               self.skipped)
+    
+    def optimize(self, trades_df, stop_loss_values, target_values, exit_days_values, progress_callback=None):
+        """Evaluate every (stop loss, target, exit days) combination from one data load.
+        
+        Candles are loaded once for the longest exit_days. For each trade the
+        first stop-loss touch per stop level, the first target touch per
+        target level and the time exit per exit_days are computed once; each
+        grid cell is then assembled from those arrays without rescanning
+        candles. Returns a list of dicts with the parameters and
+        calculate_metrics output, in grid order.
+        
+        progress_callback(done, total, symbol, None) is called after each
+        symbol's statistics, like run_backtest's without per-symbol results.
+        """
+        stop_loss_values = np.asarray(stop_loss_values, dtype=np.float64)
+        target_values = np.asarray(target_values, dtype=np.float64)
+        exit_days_values = [int(days) for days in exit_days_values]
+        trades_df = trades_df.reset_index(drop=True)
+        trade_counts = trades_df.groupby('symbol', sort=False).size()
+        done = 0
+        
+        paths = []
+        for symbol, symbol_entries, candles in self._iter_symbol_candles(trades_df, max(exit_days_values)):
+            paths.append(self._path_statistics(symbol, candles, symbol_entries,
+                                               stop_loss_values, target_values, exit_days_values))
+            done += int(trade_counts[symbol])
+            if progress_callback:
+                progress_callback(done, len(trades_df), symbol, None)
+        paths = [path for path in paths if len(path['entry_price'])]
+        if paths:
+            paths = {key: np.concatenate([path[key] for path in paths]) for key in paths[0]}
+        
+        grid = []
+        for e, exit_days in enumerate(exit_days_values):
+            for s, stop_loss in enumerate(stop_loss_values):
+                for t, target in enumerate(target_values):
+                    metrics = {}
+                    if paths:
+                        metrics = calculate_metrics(self._grid_cell_results(paths, s, t, e, exit_days))
+                    grid.append({
+                        'stop_loss': float(stop_loss),
+                        'target': float(target),
+                        'exit_days': exit_days,
+                        'metrics': metrics
+                    })
+        return grid
+    
+    def _path_statistics(self, symbol, candles, entry_datetimes, stop_loss_values, target_values, exit_days_values):
+        """Per-trade first-touch times for every SL/target level and time exits for every exit_days"""
+        candles = as_candle_arrays(candles)
+        entry_datetimes, entry_ms, entry_price = self._resolve_entries(symbol, candles, entry_datetimes)
+        timestamps = candles.timestamps
+        no_touch = np.iinfo(np.int64).max
+        
+        valid = _valid_bars(candles.low, candles.high, candles.close)
+        low_levels = _min_levels(np.where(valid, candles.low, np.inf))
+        negated_high_levels = _min_levels(np.where(valid, -candles.high, np.inf))
+        start = np.searchsorted(timestamps, entry_ms, side='right')
+        longest_stop_ms = timestamps_to_ms(
+            (entry_datetimes + timedelta(days=max(exit_days_values) + 6)).dt.normalize().values)
+        longest_stop = np.searchsorted(timestamps, longest_stop_ms, side='left')
+        
+        def touch_ms(levels, thresholds):
+            touched = _first_at_or_below(levels, start, longest_stop, thresholds)
+            return np.where(touched < longest_stop, timestamps[np.minimum(touched, len(timestamps) - 1)], no_touch)
+        
+        sl_prices = entry_price[:, None] * (1 - stop_loss_values[None, :] / 100)
+        target_prices = entry_price[:, None] * (1 + target_values[None, :] / 100)
+        sl_ms = np.column_stack([touch_ms(low_levels, sl_prices[:, s])
+                                 for s in range(len(stop_loss_values))])
+        target_ms = np.column_stack([touch_ms(negated_high_levels, -target_prices[:, t])
+                                     for t in range(len(target_values))])
+        
+        stop_ms, time_ms, time_close, time_ok = [], [], [], []
+        for exit_days in exit_days_values:
+            window_stop_ms = timestamps_to_ms(
+                (entry_datetimes + timedelta(days=exit_days + 6)).dt.normalize().values)
+            stop = np.searchsorted(timestamps, window_stop_ms, side='left')
+            time_idx = np.maximum(np.searchsorted(
+                timestamps, timestamps_to_ms((entry_datetimes + timedelta(days=exit_days)).values), side='left'), start)
+            close = candles.close[np.minimum(time_idx, len(timestamps) - 1)]
+            stop_ms.append(window_stop_ms)
+            time_ms.append(timestamps[np.minimum(time_idx, len(timestamps) - 1)])
+            time_close.append(close)
+            time_ok.append((time_idx < stop) & ~np.isnan(close) & (close != 0))
+        
+        return {
+            'entry_ms': entry_ms,
+            'entry_price': entry_price,
+            'sl_price': sl_prices,
+            'target_price': target_prices,
+            'sl_ms': sl_ms,
+            'target_ms': target_ms,
+            'stop_ms': np.column_stack(stop_ms),
+            'time_ms': np.column_stack(time_ms),
+            'time_close': np.column_stack(time_close),
+            'time_ok': np.column_stack(time_ok)
+        }
+    
+    def _grid_cell_results(self, paths, s, t, e, exit_days):
+        """Trade results for one grid cell, in the columns calculate_metrics reads"""
+        sl_ms = paths['sl_ms'][:, s]
+        target_ms = paths['target_ms'][:, t]
+        first_ms = np.minimum(sl_ms, target_ms)
+        hit = first_ms < paths['stop_ms'][:, e]
+        exited = hit | paths['time_ok'][:, e]
+        
+        exit_price = np.where(hit,
+                              np.where(sl_ms <= target_ms, paths['sl_price'][:, s], paths['target_price'][:, t]),
+                              paths['time_close'][:, e])[exited]
+        entry_price = paths['entry_price'][exited]
+        exit_ms = np.where(hit, first_ms, paths['time_ms'][:, e])[exited]
+        exit_reason = np.where(hit, np.where(sl_ms <= target_ms, 'Stop Loss', 'Target'),
+                               f'Time Exit ({exit_days} days)')[exited]
+        return pd.DataFrame({
+            'entry_datetime': pd.to_datetime(paths['entry_ms'][exited], unit='ms'),
+            'exit_datetime': pd.to_datetime(exit_ms, unit='ms'),
+            'exit_reason': exit_reason,
+            'pnl_pct': ((exit_price - entry_price) / entry_price) * 100
+        })
+    
+    def _get_entry_price(self, candles, entry_datetime):
+        """Get entry price from the candle closest to entry_datetime (within the entry tolerance).
+        
+        candles is a symbol's loaded candles, whose sorted int64 timestamps
+        make this a binary search per trade. A candle frame is also accepted
+        but is converted to arrays first, which costs O(n) per call.
+        """
+        try:
+            candles = candle_arrays(candles) if isinstance(candles, pd.DataFrame) else as_candle_arrays(candles)
+            closest_idx = find_entry_index(candles.timestamps, np.datetime64(entry_datetime, 'ms').astype(np.int64),
+                                           self.entry_tolerance_ms, self.entry_allow_later)
+            if closest_idx < 0:
+                return None
             
-            close_price = nearby_data.loc[closest_idx, 'close']
+            close_price = candles.close[closest_idx]
             # Ensure we have a valid price
             if pd.isna(close_price) or close_price == 0:
                 logger.warning(f"Invalid close price for {entry_datetime}: {close_price}")
@@ -319,94 +1288,136 @@ class BacktestEngine:
     def _find_exit(self, hist_data, entry_datetime, entry_price, sl_price, target_price, exit_days):
         """Find exit conditions for a trade"""
         try:
-            # Filter data after entry time
-            post_entry_data = hist_data[hist_data['timestamp'] > entry_datetime].copy()
+            timestamps = timestamps_to_ms(hist_data['timestamp'].values)
+            entry_ms = timestamps_to_ms([entry_datetime])[0]
+            exit_ms = timestamps_to_ms([entry_datetime + timedelta(days=exit_days)])[0]
             
-            if post_entry_data.empty:
-                return None
+            exit_idx, exit_code = find_exit_index(
+                timestamps,
+                hist_data['low'].to_numpy(dtype=np.float64),
+                hist_data['high'].to_numpy(dtype=np.float64),
+                hist_data['close'].to_numpy(dtype=np.float64),
+                entry_ms, sl_price, target_price, exit_ms
+            )
             
-            # Check for stop loss or target hits
-            for _, row in post_entry_data.iterrows():
-                try:
-                    # Safely convert prices to float
-                    low_price = float(row['low']) if not pd.isna(row['low']) else 0
-                    high_price = float(row['high']) if not pd.isna(row['high']) else 0
-                    close_price = float(row['close']) if not pd.isna(row['close']) else 0
-                    
-                    # Skip if prices are invalid
-                    if low_price == 0 or high_price == 0 or close_price == 0:
-                        continue
-                    
-                # Check if low hit stop loss
-                    if low_price <= sl_price:
-                    return {
-                        'exit_datetime': row['timestamp'],
-                        'exit_price': sl_price,
-                        'exit_reason': 'Stop Loss'
-                    }
-                
-                # Check if high hit target
-                    if high_price >= target_price:
-                    return {
-                        'exit_datetime': row['timestamp'],
-                        'exit_price': target_price,
-                        'exit_reason': 'Target'
-                    }
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"Error processing row data: {e}, row: {row}")
-                    continue
+            if exit_idx is None:
+                return None
             
-            # If neither hit, exit after n days
-            exit_date = entry_datetime + timedelta(days=exit_days)
-            exit_data = post_entry_data[post_entry_data['timestamp'] >= exit_date]
-            
-            if not exit_data.empty:
-                exit_row = exit_data.iloc[0]
-                try:
-                    exit_price = float(exit_row['close']) if not pd.isna(exit_row['close']) else 0
-                    if exit_price == 0:
-                        logger.warning(f"Invalid exit price for time exit: {exit_row['close']}")
-                        return None
-                return {
-                    'exit_datetime': exit_row['timestamp'],
-                        'exit_price': exit_price,
-                    'exit_reason': f'Time Exit ({exit_days} days)'
-                }
-                except (ValueError, TypeError) as e:
-                    logger.error(f"Error processing time exit: {e}, exit_row: {exit_row}")
-                    return None
+            exit_datetime = hist_data['timestamp'].iloc[exit_idx]
+            if exit_code == EXIT_STOP_LOSS:
+                return {'exit_datetime': exit_datetime, 'exit_price': sl_price, 'exit_reason': 'Stop Loss'}
+            if exit_code == EXIT_TARGET:
+                return {'exit_datetime': exit_datetime, 'exit_price': target_price, 'exit_reason': 'Target'}
             
-            return None
+            exit_price = float(hist_data['close'].iloc[exit_idx])
+            return {
+                'exit_datetime': exit_datetime,
+                'exit_price': exit_price,
+                'exit_reason': f'Time Exit ({exit_days} days)'
+            }
         except Exception as e:
             logger.error(f"Error finding exit: {e}")
             return None
 
+def _pack_candles(symbol_candles):
+    """Copy every symbol's candle arrays into one shared memory block.
+    
+    Returns the block and, per symbol, (bar count, {field: (byte offset, dtype)}).
+    MappedCandles are not copied, their layout is the handle itself.
+    """
+    size = sum(column.nbytes for _, _, candles in symbol_candles
+               if not isinstance(candles, MappedCandles)
+               for column in candles)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layouts = []
+    offset = 0
+    for _, _, candles in symbol_candles:
+        if isinstance(candles, MappedCandles):
+            # Workers map the snapshot files themselves
+            layouts.append((len(candles), candles))
+            continue
+        bars = len(candles.timestamps)
+        layout = {}
+        for field in CandleArrays._fields:
+            column = getattr(candles, field)
+            np.ndarray(bars, dtype=column.dtype, buffer=shm.buf, offset=offset)[:] = column
+            layout[field] = (offset, column.dtype.str)
+            offset += column.nbytes
+        layouts.append((bars, layout))
+    return shm, layouts
+
+def _longest_run(flags):
+    """Length of the longest run of True values"""
+    if not flags.any():
+        return 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], flags, [False])).astype(np.int8)))
+    return int((edges[1::2] - edges[::2]).max())
+
+def _group_metrics(labels, pnl):
+    """Trades, win rate, average and total P&L per distinct label, from one factorize and bincounts"""
+    codes, uniques = pd.factorize(labels)
+    uniques = [str(label) for label in uniques]
+    if (codes < 0).any():
+        # Missing labels count as 'Unknown', like missing columns do on upload
+        if 'Unknown' not in uniques:
+            uniques.append('Unknown')
+        codes = np.where(codes < 0, uniques.index('Unknown'), codes)
+    trades = np.bincount(codes, minlength=len(uniques))
+    wins = np.bincount(codes, weights=pnl > 0, minlength=len(uniques))
+    total = np.bincount(codes, weights=pnl, minlength=len(uniques))
+    return {
+        label: {
+            'trades': int(n),
+            'win_rate': round(float(w / n * 100), 2),
+            'avg_pnl': round(float(t / n), 2),
+            'total_pnl': round(float(t), 2)
+        } for label, n, w, t in zip(uniques, trades, wins, total)
+    }
+
 def calculate_metrics(results_df):
-    """Calculate performance metrics"""
+    """Calculate performance metrics from the columns of a results frame.
+    
+    Everything is computed from NumPy views of the columns in O(n) apart
+    from ordering by exit time (skipped when already ordered); results_df
+    is not modified. Sharpe and Sortino are per trade, not annualised.
+    Holding time and the exit_reason, sector and market_cap breakdowns are
+    included when those columns are present.
+    """
     if results_df.empty:
         return {}
     
-    total_trades = len(results_df)
-    winning_trades = len(results_df[results_df['pnl_pct'] > 0])
-    losing_trades = len(results_df[results_df['pnl_pct'] < 0])
+    pnl = results_df['pnl_pct'].to_numpy(dtype=np.float64)
+    exit_ms = timestamps_to_ms(results_df['exit_datetime'].values)
+    total_trades = len(pnl)
+    wins = pnl > 0
+    losses = pnl < 0
+    winning_trades = int(wins.sum())
+    losing_trades = int(losses.sum())
+    gross_profit = float(pnl[wins].sum())
+    gross_loss = float(pnl[losses].sum())
     
     win_rate = (winning_trades / total_trades) * 100 if total_trades > 0 else 0
-    avg_gain = results_df[results_df['pnl_pct'] > 0]['pnl_pct'].mean() if winning_trades > 0 else 0
-    avg_loss = results_df[results_df['pnl_pct'] < 0]['pnl_pct'].mean() if losing_trades > 0 else 0
+    avg_gain = gross_profit / winning_trades if winning_trades > 0 else 0
+    avg_loss = gross_loss / losing_trades if losing_trades > 0 else 0
     
-    # Calculate equity curve
-    results_df = results_df.sort_values('exit_datetime')
-    results_df['cumulative_pnl'] = results_df['pnl_pct'].cumsum()
+    # Equity curve in exit order; ties are broken by P&L so the order of the input never matters
+    if (np.diff(exit_ms) > 0).all():
+        ordered = pnl
+    else:
+        ordered = pnl[np.lexsort((pnl, exit_ms))]
+    cumulative_pnl = np.cumsum(ordered)
     
-    # Calculate max drawdown
-    peak = results_df['cumulative_pnl'].expanding().max()
-    drawdown = results_df['cumulative_pnl'] - peak
-    max_drawdown = drawdown.min()
+    # Max drawdown; the peak starts at the first trade rather than at zero
+    max_drawdown = float((cumulative_pnl - np.maximum.accumulate(cumulative_pnl)).min())
     
     # Risk-reward ratio
     risk_reward = abs(avg_gain / avg_loss) if avg_loss != 0 else 0
     
-    return {
+    mean = float(pnl.mean())
+    std = float(pnl.std(ddof=1)) if total_trades > 1 else 0.0
+    downside = float(np.sqrt(np.mean(np.minimum(pnl, 0) ** 2)))
+    
+    metrics = {
         'total_trades': total_trades,
         'winning_trades': winning_trades,
         'losing_trades': losing_trades,
@@ -415,8 +1426,69 @@ def calculate_metrics(results_df):
         'avg_loss': round(avg_loss, 2),
         'max_drawdown': round(max_drawdown, 2),
         'risk_reward': round(risk_reward, 2),
-        'total_pnl': round(results_df['pnl_pct'].sum(), 2)
+        'total_pnl': round(float(cumulative_pnl[-1]), 2),
+        'sharpe_ratio': round(mean / std, 2) if std > 0 else 0,
+        'sortino_ratio': round(mean / downside, 2) if downside > 0 else 0,
+        'profit_factor': round(gross_profit / -gross_loss, 2) if gross_loss != 0 else 0,
+        'expectancy': round(mean, 2),
+        'max_win_streak': _longest_run(ordered > 0),
+        'max_loss_streak': _longest_run(ordered < 0)
     }
+    
+    if 'entry_datetime' in results_df:
+        holding_ms = exit_ms - timestamps_to_ms(results_df['entry_datetime'].values)
+        metrics['avg_holding_days'] = round(float(holding_ms.mean()) / MS_PER_DAY, 2)
+    for column, key in (('exit_reason', 'by_exit_reason'), ('sector', 'by_sector'), ('market_cap', 'by_market_cap')):
+        if column in results_df:
+            metrics[key] = _group_metrics(results_df[column].to_numpy(), pnl)
+    return metrics
+
+class RunningMetrics:
+    """calculate_metrics kept up to date one trade at a time, for streamed results.
+    
+    Trades are accumulated in the order they complete, so the running max
+    drawdown can differ from the final figure, which orders by exit time.
+    """
+    def __init__(self):
+        self.total_trades = 0
+        self.winning_trades = 0
+        self.losing_trades = 0
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        self.cumulative_pnl = 0.0
+        self.peak = 0.0
+        self.max_drawdown = 0.0
+    
+    def add(self, pnl_pct):
+        self.total_trades += 1
+        if pnl_pct > 0:
+            self.winning_trades += 1
+            self.gain_sum += pnl_pct
+        elif pnl_pct < 0:
+            self.losing_trades += 1
+            self.loss_sum += pnl_pct
+        
+        self.cumulative_pnl += pnl_pct
+        # Like calculate_metrics, the peak starts at the first trade rather than at zero
+        self.peak = self.cumulative_pnl if self.total_trades == 1 else max(self.peak, self.cumulative_pnl)
+        self.max_drawdown = min(self.max_drawdown, self.cumulative_pnl - self.peak)
+    
+    def to_dict(self):
+        if not self.total_trades:
+            return {}
+        avg_gain = self.gain_sum / self.winning_trades if self.winning_trades else 0
+        avg_loss = self.loss_sum / self.losing_trades if self.losing_trades else 0
+        return {
+            'total_trades': self.total_trades,
+            'winning_trades': self.winning_trades,
+            'losing_trades': self.losing_trades,
+            'win_rate': round(self.winning_trades / self.total_trades * 100, 2),
+            'avg_gain': round(avg_gain, 2),
+            'avg_loss': round(avg_loss, 2),
+            'max_drawdown': round(self.max_drawdown, 2),
+            'risk_reward': round(abs(avg_gain / avg_loss), 2) if avg_loss != 0 else 0,
+            'total_pnl': round(self.cumulative_pnl, 2)
+        }
 
 @app.route('/')
 def index():
@@ -434,90 +1506,46 @@ def upload_file():
         
         if file and file.filename.endswith('.csv'):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Parse CSV
-            df = pd.read_csv(filepath)
-            
-            # Check if we have enough columns
-            if len(df.columns) < 2:
-                return jsonify({'error': 'CSV must have at least 2 columns: date/time and symbol'}), 400
-            
-            # Flexible column mapping - handle different CSV formats
-            column_mapping = {}
-            for i, col in enumerate(df.columns):
-                col_lower = str(col).lower().strip()
-                if any(keyword in col_lower for keyword in ['date', 'time', 'datetime', 'entry']):
-                    column_mapping[col] = 'entry_datetime'
-                elif any(keyword in col_lower for keyword in ['symbol', 'stock', 'scrip', 'ticker']):
-                    column_mapping[col] = 'symbol'
-                elif any(keyword in col_lower for keyword in ['market', 'cap', 'mcap']):
-                    column_mapping[col] = 'market_cap'
-                elif any(keyword in col_lower for keyword in ['sector', 'industry']):
-                    column_mapping[col] = 'sector'
-            
-            # Rename columns based on mapping
-            df = df.rename(columns=column_mapping)
-            
-            # If we don't have required columns, try to map by position
-            if 'entry_datetime' not in df.columns:
-                df.columns.values[0] = 'entry_datetime'
-            if 'symbol' not in df.columns:
-                df.columns.values[1] = 'symbol'
-            if 'market_cap' not in df.columns and len(df.columns) > 2:
-                df.columns.values[2] = 'market_cap'
-            if 'sector' not in df.columns and len(df.columns) > 3:
-                df.columns.values[3] = 'sector'
-            
-            # Ensure we have at least entry_datetime and symbol
-            if 'entry_datetime' not in df.columns or 'symbol' not in df.columns:
-                return jsonify({'error': 'CSV must have date/time and symbol columns'}), 400
-            
-            # Fill missing columns with defaults
-            if 'market_cap' not in df.columns:
-                df['market_cap'] = 'Unknown'
-            if 'sector' not in df.columns:
-                df['sector'] = 'Unknown'
-            
-            # Flexible date parsing - handle multiple formats
+            
+            def report_invalid(rows):
+                logger.warning(f"{filename}: {len(rows)} invalid rows, e.g. {rows[:3]}")
+            
+            # Parse the upload stream in chunks straight into a typed trade file,
+            # unless the same bytes were uploaded before
             try:
-                # Try different date formats
-                df['entry_datetime'] = pd.to_datetime(df['entry_datetime'], format='%m-%d-%Y %I:%M %p', errors='coerce')
-                if df['entry_datetime'].isna().any():
-                    # Try alternative format
-                    df['entry_datetime'] = pd.to_datetime(df['entry_datetime'], format='%d-%m-%Y %I:%M %p', errors='coerce')
-                if df['entry_datetime'].isna().any():
-                    # Try with mixed format
-                    df['entry_datetime'] = pd.to_datetime(df['entry_datetime'], format='mixed', dayfirst=True, errors='coerce')
-                if df['entry_datetime'].isna().any():
-                    # Try ISO format
-                    df['entry_datetime'] = pd.to_datetime(df['entry_datetime'], format='ISO8601', errors='coerce')
-                
-                # Check if any dates are still invalid
-                if df['entry_datetime'].isna().any():
-                    invalid_rows = df[df['entry_datetime'].isna()]
-                    return jsonify({
-                        'error': f'Invalid date format found in rows: {invalid_rows.index.tolist()}. Please use format: MM-DD-YYYY HH:MM AM/PM or DD-MM-YYYY HH:MM AM/PM'
-                    }), 400
-                    
-            except Exception as e:
-                return jsonify({'error': f'Date parsing error: {str(e)}. Please check your date format.'}), 400
+                with telemetry.span('upload.ingest'):
+                    entry, result = trade_store.ingest(file.stream, filename, on_invalid=report_invalid)
+            except ValueError as e:
+                telemetry.count('uploads_total', result='rejected')
+                return jsonify({'error': str(e)}), 400
             
-            # Store in session or temporary file
-            df.to_csv(filepath, index=False)
+            if entry is None:
+                telemetry.count('uploads_total', result='invalid')
+                rows = [row['row'] for row in result.invalid_rows]
+                more = f' and {result.invalid_count - len(rows)} more' if result.invalid_count > len(rows) else ''
+                return jsonify({
+                    'error': f'Invalid date format or missing symbol in rows: {rows}{more}. Please use format: MM-DD-YYYY HH:MM AM/PM or DD-MM-YYYY HH:MM AM/PM',
+                    'invalid_rows': result.invalid_rows,
+                    'invalid_count': result.invalid_count
+                }), 400
             
-            # Log the processed data for debugging
-            logger.info(f"Processed CSV with {len(df)} rows")
-            logger.info(f"Columns: {list(df.columns)}")
-            logger.info(f"Sample data: {df.head().to_dict('records')}")
+            telemetry.count('uploads_total', result='duplicate' if result is None else 'stored')
+            if result is None:
+                logger.info(f"{filename} is already stored as trade set {entry['id']}")
+                preview = trade_store.load(entry['id']).head().to_dict('records')
+            else:
+                logger.info(f"Processed CSV with {result.rows} rows (date format {result.date_format!r})")
+                preview = result.preview or []
             
+            # The trade set id is what /backtest, /jobs and /optimize take as 'filename'
             return jsonify({
                 'success': True,
-                'filename': filename,
-                'trades_count': len(df),
-                'preview': df.head().to_dict('records'),
-                'columns': list(df.columns)
+                'filename': entry['id'],
+                'trade_set_id': entry['id'],
+                'duplicate': result is None,
+                'trades_count': entry['rows'],
+                'preview': preview,
+                'columns': TRADE_COLUMNS
             })
         
         return jsonify({'error': 'Invalid file format. Please upload a CSV file.'}), 400
@@ -526,69 +1554,448 @@ def upload_file():
         logger.error(f"Error uploading file: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters and stage timings of this worker in the Prometheus text format"""
+    stats = response_cache.stats()
+    telemetry.registry.set('response_cache_requests_total', stats['hits'], result='hit')
+    telemetry.registry.set('response_cache_requests_total', stats['misses'], result='miss')
+    telemetry.registry.set('response_cache_evictions_total', stats['evictions'])
+    telemetry.registry.set('response_cache_bytes', stats['bytes'])
+    return Response(telemetry.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/trade-sets', methods=['GET'])
+def list_trade_sets():
+    """Catalog of uploaded trade sets with their row counts and entry date spans"""
+    return jsonify({'trade_sets': trade_store.catalog()})
+
+@app.route('/trade-sets/<trade_set_id>', methods=['GET'])
+def get_trade_set(trade_set_id):
+    entry = trade_store.get(trade_set_id)
+    if entry is None:
+        return jsonify({'error': 'Trade set not found'}), 404
+    return jsonify(entry)
+
+def execute_backtest(data, progress_callback=None):
+    """Run a backtest request and return (response body, status code)"""
+    filename = data.get('filename')
+    stop_loss = float(data.get('stop_loss', 5))
+    target = float(data.get('target', 10))
+    exit_days = int(data.get('exit_days', 10))
+    
+    # API credentials
+    api_key = data.get('api_key')
+    client_id = data.get('client_id')
+    password = data.get('password')
+    totp = data.get('totp')
+    
+    if not all([filename, api_key, client_id, password, totp]):
+        return {'error': 'Missing required parameters'}, 400
+    
+    interval = data.get('interval') or app.config['BACKTEST_INTERVAL']
+    if interval not in INTERVAL_MINUTES:
+        return {'error': f"Unknown interval {interval}; use one of {', '.join(INTERVAL_MINUTES)}"}, 400
+    
+    try:
+        portfolio = portfolio_settings(data)
+    except (TypeError, ValueError) as e:
+        return {'error': f'Invalid portfolio settings: {e}'}, 400
+    
+    # Load trades data
+    if not trade_store.exists(filename):
+        return {'error': 'Uploaded file not found'}, 400
+    with telemetry.span('backtest.load_trades'):
+        trades_df = trade_store.load(filename)
+    
+    # Initialize API client and backtest engine
+    api_client = AngelOneAPI(api_key, client_id, password, totp, base_url=app.config['SMARTAPI_BASE_URL'],
+                             session_cache=session_cache, instruments=instrument_master)
+    backtest_engine = BacktestEngine(api_client, candle_cache, workers=app.config['BACKTEST_WORKERS'],
+                                     interval=interval, resolve_interval=resolve_interval_for(interval))
+    
+    # Run backtest
+    with telemetry.span('backtest.engine'):
+        results_df = backtest_engine.run_backtest(trades_df, stop_loss, target, exit_days,
+                                                  progress_callback=progress_callback)
+    
+    if results_df.empty:
+        logger.error("No trades could be processed - results DataFrame is empty")
+        return {
+            'error': 'No trades could be processed. Common issues:\n\n1. INVALID TOTP: Get a fresh 6-digit code from your authenticator app\n2. INVALID SYMBOLS: Use NSE trading symbols as exported by Chartink, e.g. RELIANCE, TCS, INFY, HDFCBANK\n3. RATE LIMITING: Wait a few minutes before trying again\n4. API CREDENTIALS: Check your API Key, Client ID, and MPIN'
+        }, 400
+    
+    # Calculate metrics
+    with telemetry.span('backtest.metrics'):
+        metrics = calculate_metrics(results_df)
+    
+    # Create charts
+    with telemetry.span('backtest.charts'):
+        equity_curve = create_equity_curve_chart(results_df)
+        returns_distribution = create_returns_distribution_chart(results_df)
+    
+    body = {
+        'success': True,
+        'metrics': metrics,
+        'equity_curve': equity_curve,
+        'returns_distribution': returns_distribution,
+        'skipped': dict(backtest_engine.skipped),
+        # Trades were lost to something a retry may not repeat: a failed candle request, an
+        # evaluation error or finer candles that could not be loaded
+        'partial': bool(api_client.request_failed or backtest_engine.skipped['error'] or backtest_engine.unresolved)
+    }
+    if portfolio is not None:
+        with telemetry.span('backtest.portfolio'):
+            simulation = simulate_portfolio(
+                timestamps_to_ms(results_df['entry_datetime'].values),
+                timestamps_to_ms(results_df['exit_datetime'].values),
+                results_df['entry_price'].to_numpy(), results_df['exit_price'].to_numpy(),
+                symbols=results_df['symbol'].to_numpy(), marks=backtest_engine.daily_closes(results_df), **portfolio)
+            results_df = results_df.assign(quantity=simulation.quantity, portfolio_skip=simulation.skip_reason)
+            body['portfolio'] = {
+                'settings': portfolio,
+                'metrics': simulation.metrics(),
+                'equity_curve': create_portfolio_equity_chart(simulation)
+            }
+    body['results'] = results_df.to_dict('records')
+    return body, 200
+
+def resolve_interval_for(interval):
+    """RESOLVE_INTERVAL when it is finer than interval, else None"""
+    resolve_interval = app.config['RESOLVE_INTERVAL']
+    if resolve_interval and INTERVAL_MINUTES[resolve_interval] < INTERVAL_MINUTES[interval]:
+        return resolve_interval
+    return None
+
+def portfolio_settings(data):
+    """Portfolio simulation settings from a backtest request, or None when it asks for none"""
+    given = {key: data[key] for key in ('capital', 'position_pct', 'max_positions') if data.get(key) not in (None, '')}
+    if not given:
+        return None
+    settings = {
+        'capital': float(given.get('capital', DEFAULT_CAPITAL)),
+        'position_pct': float(given.get('position_pct', DEFAULT_POSITION_PCT)),
+        'max_positions': int(given.get('max_positions', DEFAULT_MAX_POSITIONS))
+    }
+    check_settings(**settings)
+    return settings
+
+def _response_cache_key(data):
+    """backtest_cache_key for a request that may be served from the response cache, else None"""
+    # Credentials are required, and part of the key: a cached result is only served to the same account
+    if not all(data.get(key) for key in ('filename', 'api_key', 'client_id', 'password', 'totp')):
+        return None
+    try:
+        return backtest_cache_key(data)
+    except (TypeError, ValueError):
+        # Not cached; execute_backtest reports the invalid parameter
+        return None
+
+def _backtest_response(data):
+    with telemetry.span('backtest.total'):
+        key = _response_cache_key(data)
+        payload = response_cache.get(key) if key else None
+        if payload is not None:
+            return app.response_class(payload, mimetype='application/json', headers={'X-Cache': 'HIT'})
+        
+        body, status = execute_backtest(data)
+        if status != 200:
+            response = jsonify(body)
+            response.status_code = status
+            return response
+        with telemetry.span('backtest.serialize'):
+            payload = app.json.dumps(body)
+        if key and not body['partial']:
+            response_cache.put(key, payload)
+        return app.response_class(payload, mimetype='application/json', headers={'X-Cache': 'MISS'})
+
+def backtest_cache_key(data):
+    """Response cache key: the trade set id (a content hash), the account and the backtest and portfolio parameters"""
+    portfolio = portfolio_settings(data)
+    account = credential_hash(data.get('api_key'), data.get('client_id'), data.get('password'), data.get('totp'))
+    return (data.get('filename'), account, float(data.get('stop_loss', 5)), float(data.get('target', 10)),
+            int(data.get('exit_days', 10)), data.get('interval') or app.config['BACKTEST_INTERVAL'],
+            tuple(portfolio.values()) if portfolio else None)
+
 @app.route('/backtest', methods=['POST'])
 def run_backtest():
     try:
-        data = request.get_json()
-        
-        filename = data.get('filename')
-        stop_loss = float(data.get('stop_loss', 5))
-        target = float(data.get('target', 10))
-        exit_days = int(data.get('exit_days', 10))
+        with telemetry.collect_timings() as timings:
+            response = _backtest_response(request.get_json())
+        # Per-stage breakdown, shown by browser dev tools
+        response.headers['Server-Timing'] = timings.server_timing()
+        return response
         
-        # API credentials
-        api_key = data.get('api_key')
-        client_id = data.get('client_id')
-        password = data.get('password')
-        totp = data.get('totp')
+    except Exception as e:
+        logger.error(f"Error running backtest: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def run_job(job_id, execute, data, cache_key=None):
+    """Job-pool worker: run execute (execute_backtest or execute_optimize) and record progress in the job store.
+    
+    A complete result is also put in the response cache under cache_key, so
+    /backtest and later jobs with the same parameters are served from it.
+    """
+    def on_progress(done, total, symbol, symbol_results):
+        job_store.update(job_id, done=done, total=total, current_symbol=symbol)
+        if symbol_results is not None and not symbol_results.empty:
+            job_store.append_results(job_id, symbol_results.to_dict('records'))
+    
+    def heartbeat():
+        # Keeps updated_at fresh through slow fetches so the job isn't taken for interrupted
+        while not finished.wait(job_store.stale_after / 3):
+            job_store.update(job_id)
+    
+    finished = threading.Event()
+    job_store.update(job_id, status=JOB_RUNNING)
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        body, status = execute(data, progress_callback=on_progress)
+        if status != 200:
+            job_store.update(job_id, status=JOB_FAILED, error=body.get('error'))
+            return
+        payload = app.json.dumps(body)
+        if cache_key and not body['partial']:
+            response_cache.put(cache_key, payload)
+        job_store.complete(job_id, payload, serialized=True)
+    except Exception as e:
+        logger.error(f"Error running job {job_id}: {e}")
+        job_store.update(job_id, status=JOB_FAILED, error=str(e))
+    finally:
+        finished.set()
+
+@app.route('/jobs', methods=['POST'])
+def submit_backtest_job():
+    try:
+        data = request.get_json()
         
-        if not all([filename, api_key, client_id, password, totp]):
+        required = ['filename', 'api_key', 'client_id', 'password', 'totp']
+        if not all(data.get(key) for key in required):
             return jsonify({'error': 'Missing required parameters'}), 400
+        if not trade_store.exists(data['filename']):
+            return jsonify({'error': 'Uploaded file not found'}), 400
         
-        # Load trades data
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        trades_df = pd.read_csv(filepath)
-        trades_df['entry_datetime'] = pd.to_datetime(trades_df['entry_datetime'])
-        
-        # Initialize API client and backtest engine
-        api_client = AngelOneAPI(api_key, client_id, password, totp)
-        backtest_engine = BacktestEngine(api_client)
+        key = _response_cache_key(data)
+        payload = response_cache.get(key) if key else None
+        job_id = job_store.create(filename=data['filename'])
+        if payload is not None:
+            # Finished already: the job's result is the cached /backtest response
+            job_store.complete(job_id, payload, serialized=True)
+        else:
+            # Credentials are handed to the worker in memory and never written to the job store
+            job_executor.submit(run_job, job_id, execute_backtest, data, key)
         
-        # Run backtest
-        results_df = backtest_engine.run_backtest(trades_df, stop_loss, target, exit_days)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}',
+            'events_url': f'/jobs/{job_id}/events'
+        }), 202, {'X-Cache': 'HIT' if payload is not None else 'MISS'}
         
-        if results_df.empty:
-            logger.error("No trades could be processed - results DataFrame is empty")
-            return jsonify({
-                'error': 'No trades could be processed. Common issues:\n\n1. INVALID TOTP: Get a fresh 6-digit code from your authenticator app\n2. INVALID SYMBOLS: Use valid NSE symbols like RELIANCE, TCS, INFY, HDFCBANK\n3. RATE LIMITING: Wait a few minutes before trying again\n4. API CREDENTIALS: Check your API Key, Client ID, and MPIN\n\nValid symbols: RELIANCE, TCS, INFY, HDFCBANK, ICICIBANK, SBIN, WIPRO, LT, BAJFINANCE, ASIANPAINT, ITC, ULTRACEMCO, AXISBANK, MARUTI'
-            }), 400
+    except Exception as e:
+        logger.error(f"Error submitting backtest job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_backtest_job(job_id):
+    status = job_store.get(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Clients pass the number of partial results they already have
+    since = request.args.get('since', 0, type=int)
+    status['partial_results'] = job_store.partial_results(job_id, since=since)
+    if status['status'] == JOB_COMPLETED:
+        status['result_url'] = f'/jobs/{job_id}/result'
+    return jsonify(status)
+
+def server_sent_event(event, data, event_id=None):
+    """Format one server-sent event"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {app.json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_backtest_job(job_id):
+    """Stream a job's trades as server-sent events while the engine produces them.
+    
+    Each trade event carries the trade record plus running metrics; its id is
+    the trade's index, so a reconnecting EventSource resumes via Last-Event-ID.
+    """
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    resume_from = request.headers.get('Last-Event-ID', -1, type=int) + 1
+    
+    def generate():
+        metrics = RunningMetrics()
+        offset = 0
+        sent = 0
+        last_progress = None
+        last_write = time.monotonic()
+        yield 'retry: 1000\n\n'
         
-        # Calculate metrics
-        metrics = calculate_metrics(results_df)
+        while True:
+            # Read the status before the results: once it reports completion,
+            # every result has already been appended
+            status = job_store.get(job_id)
+            records, offset = job_store.read_partial_results(job_id, offset)
+            for record in records:
+                metrics.add(record['pnl_pct'])
+                if sent >= resume_from:
+                    yield server_sent_event('trade', {
+                        'trade': record,
+                        'metrics': metrics.to_dict(),
+                        'cumulative_pnl': round(metrics.cumulative_pnl, 4)
+                    }, event_id=sent)
+                    last_write = time.monotonic()
+                sent += 1
+            
+            progress = (status['done'], status['total'], status['current_symbol'])
+            if progress != last_progress:
+                last_progress = progress
+                yield server_sent_event('progress', {
+                    'done': status['done'], 'total': status['total'], 'current_symbol': status['current_symbol']
+                })
+                last_write = time.monotonic()
+            
+            if status['status'] in (JOB_COMPLETED, JOB_FAILED):
+                yield server_sent_event('done', {
+                    'status': status['status'],
+                    'error': status['error'],
+                    'metrics': metrics.to_dict(),
+                    'result_url': f'/jobs/{job_id}/result' if status['status'] == JOB_COMPLETED else None
+                })
+                return
+            
+            if time.monotonic() - last_write > 15:
+                # Comment line keeps proxies from closing an idle stream
+                yield ': keep-alive\n\n'
+                last_write = time.monotonic()
+            time.sleep(0.25)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_backtest_job_result(job_id):
+    payload = job_store.result(job_id)
+    if payload is None:
+        return jsonify({'error': 'Job result not available'}), 404
+    return app.response_class(payload, mimetype='application/json')
+
+# Upper bound on (stop loss x target x exit days) combinations per /optimize call
+MAX_GRID_SIZE = 5000
+
+def parse_grid(spec, cast=float):
+    """Expand a parameter spec into a list of values.
+    
+    Accepts a single value, a list of values, or a range given as
+    {"start": ..., "stop": ..., "step": ...} with an inclusive stop.
+    """
+    if isinstance(spec, dict):
+        start = float(spec['start'])
+        stop = float(spec.get('stop', start))
+        step = float(spec.get('step', 1))
+        if step <= 0:
+            raise ValueError('Range step must be positive')
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [cast(round(start + i * step, 10)) for i in range(max(count, 0))]
+    if isinstance(spec, (list, tuple)):
+        return [cast(value) for value in spec]
+    return [cast(spec)]
+
+def optimize_parameters(data):
+    """(filename, stop loss, target and exit days values, interval) of an /optimize request.
+    
+    Raises ValueError with the message to report for an invalid request.
+    """
+    filename = data.get('filename')
+    try:
+        stop_loss_values = parse_grid(data.get('stop_loss', 5))
+        target_values = parse_grid(data.get('target', 10))
+        exit_days_values = parse_grid(data.get('exit_days', 10), cast=int)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid parameter range: {str(e)}')
+    
+    if not all(data.get(key) for key in ('filename', 'api_key', 'client_id', 'password', 'totp')):
+        raise ValueError('Missing required parameters')
+    
+    interval = data.get('interval') or app.config['BACKTEST_INTERVAL']
+    if interval not in INTERVAL_MINUTES:
+        raise ValueError(f"Unknown interval {interval}; use one of {', '.join(INTERVAL_MINUTES)}")
+    
+    grid_size = len(stop_loss_values) * len(target_values) * len(exit_days_values)
+    if grid_size == 0:
+        raise ValueError('Parameter ranges must not be empty')
+    if grid_size > MAX_GRID_SIZE:
+        raise ValueError(f'Grid has {grid_size} combinations; the maximum is {MAX_GRID_SIZE}')
+    
+    if not trade_store.exists(filename):
+        raise ValueError('Uploaded file not found')
+    return filename, stop_loss_values, target_values, exit_days_values, interval
+
+def execute_optimize(data, progress_callback=None):
+    """Run a parameter sweep and return (body, status) like execute_backtest"""
+    try:
+        filename, stop_loss_values, target_values, exit_days_values, interval = optimize_parameters(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    trades_df = trade_store.load(filename)
+    
+    api_client = AngelOneAPI(data['api_key'], data['client_id'], data['password'], data['totp'],
+                             base_url=app.config['SMARTAPI_BASE_URL'], session_cache=session_cache,
+                             instruments=instrument_master)
+    backtest_engine = BacktestEngine(api_client, candle_cache, interval=interval)
+    grid = backtest_engine.optimize(trades_df, stop_loss_values, target_values, exit_days_values,
+                                    progress_callback=progress_callback)
+    
+    scored = [cell for cell in grid if cell['metrics']]
+    if not scored:
+        return {'error': 'No trades could be processed for any parameter combination'}, 400
+    best = max(scored, key=lambda cell: cell['metrics']['total_pnl'])
+    
+    return {
+        'success': True,
+        'grid': grid,
+        'best': best,
+        'heatmap': create_optimization_heatmap(grid, best['exit_days'])
+    }, 200
+
+@app.route('/optimize', methods=['POST'])
+def optimize():
+    """Submit a parameter sweep as a background job; it is polled and fetched through /jobs like a backtest"""
+    try:
+        data = request.get_json()
+        try:
+            optimize_parameters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Create charts
-        equity_curve = create_equity_curve_chart(results_df)
-        returns_distribution = create_returns_distribution_chart(results_df)
+        job_id = job_store.create(filename=data['filename'])
+        # Credentials are handed to the worker in memory and never written to the job store
+        job_executor.submit(run_job, job_id, execute_optimize, data)
         
         return jsonify({
             'success': True,
-            'results': results_df.to_dict('records'),
-            'metrics': metrics,
-            'equity_curve': equity_curve,
-            'returns_distribution': returns_distribution
-        })
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}',
+            'events_url': f'/jobs/{job_id}/events'
+        }), 202
         
     except Exception as e:
-        logger.error(f"Error running backtest: {e}")
+        logger.error(f"Error submitting optimization job: {e}")
         return jsonify({'error': str(e)}), 500
 
 def create_equity_curve_chart(results_df):
     """Create equity curve chart"""
+    equity = results_df.sort_values('exit_datetime')
     fig = go.Figure()
     
     fig.add_trace(go.Scatter(
-        x=results_df['exit_datetime'],
-        y=results_df['cumulative_pnl'],
+        x=equity['exit_datetime'],
+        y=equity['pnl_pct'].cumsum(),
         mode='lines',
         name='Equity Curve',
         line=dict(color='blue', width=2)
@@ -603,6 +2010,28 @@ def create_equity_curve_chart(results_df):
     
     return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
+def create_portfolio_equity_chart(simulation):
+    """Create account equity chart from a portfolio simulation, one point per day"""
+    equity_ms, equity = simulation.daily_equity()
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=pd.to_datetime(equity_ms, unit='ms'),
+        y=equity,
+        mode='lines',
+        name='Portfolio Equity',
+        line=dict(color='green', width=2)
+    ))
+    
+    fig.update_layout(
+        title='Portfolio Equity',
+        xaxis_title='Date',
+        yaxis_title='Equity',
+        hovermode='x unified'
+    )
+    
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
 def create_returns_distribution_chart(results_df):
     """Create returns distribution chart"""
     fig = go.Figure()
@@ -623,6 +2052,31 @@ def create_returns_distribution_chart(results_df):
     
     return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
+def create_optimization_heatmap(grid, exit_days):
+    """Create total P&L heatmap over stop loss x target for one exit_days value"""
+    cells = [cell for cell in grid if cell['exit_days'] == exit_days]
+    stop_losses = sorted({cell['stop_loss'] for cell in cells})
+    targets = sorted({cell['target'] for cell in cells})
+    total_pnl = {(cell['stop_loss'], cell['target']): cell['metrics'].get('total_pnl') for cell in cells}
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Heatmap(
+        x=targets,
+        y=stop_losses,
+        z=[[total_pnl.get((sl, tgt)) for tgt in targets] for sl in stop_losses],
+        colorscale='RdYlGn',
+        colorbar=dict(title='Total P&L (%)')
+    ))
+    
+    fig.update_layout(
+        title=f'Total P&L by Stop Loss / Target ({exit_days} day exit)',
+        xaxis_title='Target (%)',
+        yaxis_title='Stop Loss (%)'
+    )
+    
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
 @app.route('/export', methods=['POST'])
 def export_results():
     try:
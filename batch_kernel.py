@@ -0,0 +1,218 @@
+"""
+Batched trade evaluation over one symbol's candle arrays.
+
+These are the NumPy kernels behind BacktestEngine.evaluate_batch, plus the
+process-pool worker that runs them for parallel backtests. The module only
+depends on NumPy, pandas and the candle cache's array types - not on Flask,
+Plotly or the app's module-level state - so the forkserver preloads it once
+and pool workers start without importing app.py.
+"""
+
+import logging
+from collections import Counter
+from datetime import timedelta
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from candle_cache import CandleArrays, MappedCandles, timestamps_to_ms
+
+logger = logging.getLogger(__name__)
+
+EXIT_STOP_LOSS = 0
+EXIT_TARGET = 1
+EXIT_TIME = 2
+
+ENTRY_TOLERANCE_MS = 2 * 60 * 60 * 1000
+
+
+def _valid_bars(low, high, close):
+    """Bars with usable prices - zero or NaN low/high/close are skipped"""
+    return ((low != 0) & (high != 0) & (close != 0)
+            & ~np.isnan(low) & ~np.isnan(high) & ~np.isnan(close))
+
+
+def as_candle_arrays(candles):
+    """CandleArrays for any candle representation"""
+    if isinstance(candles, MappedCandles):
+        return candles.arrays()
+    return candles
+
+
+def find_entry_indices(timestamps, entry_ms, tolerance_ms=ENTRY_TOLERANCE_MS, allow_later=True):
+    """Index of the bar closest to each entry within the tolerance, -1 where there is none.
+
+    Ties between the bar before and the bar after an entry go to the earlier bar.
+    With allow_later=False only bars starting at or before the entry are used.
+    """
+    n = len(timestamps)
+    if n == 0:
+        return np.full(len(entry_ms), -1, dtype=np.int64)
+
+    no_gap = np.iinfo(np.int64).max
+    if not allow_later:
+        # The bar the entry falls in, or else the last one before it
+        at_or_before = np.searchsorted(timestamps, entry_ms, side='right') - 1
+        gap = entry_ms - timestamps[np.maximum(at_or_before, 0)]
+        return np.where((at_or_before >= 0) & (gap <= tolerance_ms), at_or_before, -1)
+    after = np.searchsorted(timestamps, entry_ms, side='left')
+    before = after - 1
+    after_gap = np.where(after < n, timestamps[np.minimum(after, n - 1)] - entry_ms, no_gap)
+    before_gap = np.where(before >= 0, entry_ms - timestamps[np.maximum(before, 0)], no_gap)
+
+    closest = np.where(before_gap <= after_gap, before, after)
+    return np.where(np.minimum(before_gap, after_gap) <= tolerance_ms, closest, -1)
+
+
+def _min_levels(values):
+    """Sparse table: level k holds the minimum of every run of 2**k values"""
+    levels = [values]
+    step = 1
+    while step * 2 <= len(values):
+        previous = levels[-1]
+        levels.append(np.minimum(previous[:-step], previous[step:]))
+        step *= 2
+    return levels
+
+
+def _first_at_or_below(levels, start, stop, threshold):
+    """First index in [start, stop) whose value is <= threshold, or stop, for every query at once"""
+    position = start.copy()
+    for k in range(len(levels) - 1, -1, -1):
+        step = 1 << k
+        level = levels[k]
+        can_jump = position + step <= stop
+        run_min = level[np.minimum(position, len(level) - 1)]
+        position = np.where(can_jump & (run_min > threshold), position + step, position)
+    return position
+
+
+def find_exit_indices(candles, entry_ms, sl_prices, target_prices, exit_ms, stop_ms):
+    """Batched find_exit_index over one symbol's candle arrays.
+
+    Every trade is searched in the bars after its entry and before its
+    stop_ms window end. Returns (bar indices, EXIT_* codes) with -1 for
+    trades that have no exit.
+    """
+    timestamps = candles.timestamps
+    valid = _valid_bars(candles.low, candles.high, candles.close)
+
+    # Invalid bars can never trigger a stop loss or a target
+    low_levels = _min_levels(np.where(valid, candles.low, np.inf))
+    negated_high_levels = _min_levels(np.where(valid, -candles.high, np.inf))
+
+    start = np.searchsorted(timestamps, entry_ms, side='right')
+    stop = np.searchsorted(timestamps, stop_ms, side='left')
+    sl_hit = _first_at_or_below(low_levels, start, stop, sl_prices)
+    target_hit = _first_at_or_below(negated_high_levels, start, stop, -target_prices)
+
+    first_hit = np.minimum(sl_hit, target_hit)
+    hit = first_hit < stop
+    exit_idx = np.where(hit, first_hit, -1)
+    exit_code = np.where(hit, np.where(sl_hit <= target_hit, EXIT_STOP_LOSS, EXIT_TARGET), -1)
+
+    # Time exit on the first bar at or after entry + exit_days
+    time_idx = np.maximum(np.searchsorted(timestamps, exit_ms, side='left'), start)
+    time_close = candles.close[np.minimum(time_idx, len(timestamps) - 1)]
+    time_ok = ~hit & (time_idx < stop) & ~np.isnan(time_close) & (time_close != 0)
+    exit_idx = np.where(time_ok, time_idx, exit_idx)
+    exit_code = np.where(time_ok, EXIT_TIME, exit_code)
+    return exit_idx, exit_code
+
+
+def resolve_entries(symbol, candles, entry_datetimes, tolerance_ms, allow_later, skipped):
+    """Entry prices for a symbol's trades; trades without one are logged, counted in skipped and dropped"""
+    entry_ms = timestamps_to_ms(entry_datetimes.values)
+
+    entry_idx = find_entry_indices(candles.timestamps, entry_ms, tolerance_ms, allow_later)
+    entry_price = candles.close[np.maximum(entry_idx, 0)]
+    has_entry = (entry_idx >= 0) & ~np.isnan(entry_price) & (entry_price != 0)
+    for entry_datetime in entry_datetimes[~has_entry]:
+        logger.warning(f"Could not find entry price for {symbol} at {entry_datetime}")
+    skipped['no_entry_price'] += int((~has_entry).sum())
+
+    return entry_datetimes[has_entry], entry_ms[has_entry], entry_price[has_entry]
+
+
+def evaluate_trades(symbol, candles, entry_datetimes, stop_loss_pct, target_pct, exit_days,
+                    tolerance_ms, allow_later, skipped):
+    """Evaluate all of a symbol's trades against its candle arrays in one pass.
+
+    entry_datetimes is a Series of entry timestamps; its index is kept on
+    the returned results frame. Trades without a valid entry price or exit
+    are counted in skipped and dropped.
+    """
+    candles = as_candle_arrays(candles)
+    entry_datetimes, entry_ms, entry_price = resolve_entries(symbol, candles, entry_datetimes,
+                                                             tolerance_ms, allow_later, skipped)
+
+    sl_prices = entry_price * (1 - float(stop_loss_pct) / 100)
+    target_prices = entry_price * (1 + float(target_pct) / 100)
+    exit_ms = timestamps_to_ms((entry_datetimes + timedelta(days=exit_days)).values)
+    # Same window as trade_window(): up to the end of entry + exit_days + 5 days
+    stop_ms = timestamps_to_ms((entry_datetimes + timedelta(days=exit_days + 6)).dt.normalize().values)
+
+    exit_idx, exit_code = find_exit_indices(candles, entry_ms, sl_prices, target_prices, exit_ms, stop_ms)
+    has_exit = exit_idx >= 0
+    skipped['no_exit'] += int((~has_exit).sum())
+
+    exit_idx = exit_idx[has_exit]
+    exit_code = exit_code[has_exit]
+    entry_price = entry_price[has_exit]
+    sl_prices = sl_prices[has_exit]
+    target_prices = target_prices[has_exit]
+    exit_price = np.where(exit_code == EXIT_STOP_LOSS, sl_prices,
+                          np.where(exit_code == EXIT_TARGET, target_prices, candles.close[exit_idx]))
+    exit_reason = np.array(['Stop Loss', 'Target', f'Time Exit ({exit_days} days)'], dtype=object)[exit_code]
+
+    return pd.DataFrame({
+        'symbol': symbol,
+        'entry_datetime': entry_datetimes[has_exit],
+        'entry_price': entry_price,
+        'exit_datetime': pd.to_datetime(candles.timestamps[exit_idx], unit='ms'),
+        'exit_price': exit_price,
+        'exit_reason': exit_reason,
+        'pnl_pct': ((exit_price - entry_price) / entry_price) * 100,
+        'pnl_amount': exit_price - entry_price,
+        'stop_loss': sl_prices,
+        'target': target_prices
+    }, index=entry_datetimes.index[has_exit])
+
+
+def _evaluate_shard(shm_name, shard, stop_loss_pct, target_pct, exit_days, tolerance_ms, allow_later):
+    """Process-pool worker: evaluate a shard of symbols against shared candle arrays.
+
+    Returns the shard's result frames, its skipped-trade counts and the
+    positions of trades whose evaluation raised.
+    """
+    # Pool workers share the parent's resource tracker, which unlinks the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    skipped = Counter()
+    errored = set()
+    symbol_results = []
+    try:
+        for symbol, bars, layout, positions, entry_values in shard:
+            if isinstance(layout, MappedCandles):
+                candles, columns = layout, None
+            else:
+                columns = {
+                    field: np.ndarray(bars, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+                    for field, (offset, dtype) in layout.items()
+                }
+                candles = CandleArrays(**columns)
+            try:
+                symbol_results.append(evaluate_trades(
+                    symbol, candles, pd.Series(entry_values, index=positions),
+                    stop_loss_pct, target_pct, exit_days, tolerance_ms, allow_later, skipped
+                ))
+            except Exception as e:
+                logger.error(f"Error processing trades for {symbol}: {e}")
+                skipped['error'] += len(positions)
+                errored.update(positions.tolist())
+            # Views must be released before the block can be closed
+            del candles, columns
+    finally:
+        shm.close()
+    # Counters recorded in this process would be lost; the parent reports them
+    return symbol_results, skipped, errored
@@ -0,0 +1,374 @@
+"""
+Benchmarks for the backtest pipeline.
+
+Run with `python benchmark.py [BENCHMARK ...] [--scales 10 1k 100k] [--output FILE]`;
+results are printed (or written) as JSON together with the commit and
+library versions, so runs from different commits can be diffed.
+
+    candle_parsing  SmartAPI getCandleData payload -> candle DataFrame, comparing
+                    the columnar decoder with the previous row-by-row parser
+                    (parse time and peak traced memory)
+    pipeline        Each backtest stage on synthetic random-walk minute bars at
+                    10, 1k and 100k trades: candle decoding, the per-trade
+                    _get_entry_price and _find_exit, the batch kernel,
+                    calculate_metrics, chart serialization, and POST /backtest
+                    end to end against a mocked AngelOneAPI (cold and warm
+                    candle cache)
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import app as app_module
+from app import (AngelOneAPI, BacktestEngine, calculate_metrics, candle_arrays,
+                 create_equity_curve_chart, create_returns_distribution_chart)
+from fake_smartapi import wave_candles
+
+
+def legacy_process_historical_data(data):
+    """The row-by-row parser _process_historical_data used before the columnar decoder"""
+    df_data = []
+    for exchange, tokens in data.items():
+        for token, candles in tokens.items():
+            for candle in candles:
+                if len(candle) < 6 or not all(candle[:6]):
+                    continue
+                try:
+                    open_price = float(candle[1]) if candle[1] and candle[1] != '' else 0.0
+                    high_price = float(candle[2]) if candle[2] and candle[2] != '' else 0.0
+                    low_price = float(candle[3]) if candle[3] and candle[3] != '' else 0.0
+                    close_price = float(candle[4]) if candle[4] and candle[4] != '' else 0.0
+                    volume = int(candle[5]) if candle[5] and candle[5] != '' else 0
+                    if open_price == 0 and high_price == 0 and low_price == 0 and close_price == 0:
+                        continue
+                    df_data.append({
+                        'timestamp': datetime.fromtimestamp(int(candle[0]) / 1000),
+                        'open': open_price,
+                        'high': high_price,
+                        'low': low_price,
+                        'close': close_price,
+                        'volume': volume
+                    })
+                except (ValueError, TypeError):
+                    continue
+
+    if not df_data:
+        return None
+    df = pd.DataFrame(df_data)
+    return df.sort_values('timestamp').reset_index(drop=True)
+
+
+def candle_payload(days=365, interval='ONE_MINUTE', token='2885'):
+    """A getCandleData 'data' object with `days` calendar days of deterministic candles"""
+    to_date = pd.Timestamp('2024-01-01') + pd.Timedelta(days=days - 1)
+    return {'NSE': {token: wave_candles(token, interval, '2024-01-01', to_date.strftime('%Y-%m-%d'))}}
+
+
+def measure(func, *args, repeat=3):
+    """Best wall time over `repeat` runs and peak traced memory of one run"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': round(min(timings), 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def bench_candle_parsing(days=365, repeat=3):
+    data = candle_payload(days)
+    api = AngelOneAPI()
+    columnar = measure(api._process_historical_data, data, repeat=repeat)
+    legacy = measure(legacy_process_historical_data, data, repeat=repeat)
+    return {
+        'candles': len(data['NSE']['2885']),
+        'columnar': columnar,
+        'row_by_row': legacy,
+        'speedup': round(legacy['seconds'] / max(columnar['seconds'], 1e-9), 1),
+        'memory_ratio': round(legacy['peak_mb'] / max(columnar['peak_mb'], 1e-9), 1)
+    }
+
+
+MINUTES_PER_SESSION = 375  # 09:15 to 15:29
+
+# Trades, symbols and trading days of synthetic data for each pipeline scale
+SCALES = {
+    '10': {'trades': 10, 'symbols': 2, 'days': 10},
+    '1k': {'trades': 1_000, 'symbols': 10, 'days': 60},
+    '100k': {'trades': 100_000, 'symbols': 25, 'days': 120}
+}
+
+# The per-trade stages are timed on at most this many trades and extrapolated
+PER_TRADE_SAMPLE = 1_000
+
+STOP_LOSS, TARGET, EXIT_DAYS = 2, 4, 3
+
+
+class SyntheticMarket:
+    """Deterministic random-walk minute bars for `symbols` symbols over `days` trading days.
+
+    Each symbol has its own seeded generator, so adding symbols or days
+    leaves the bars of the others unchanged.
+    """
+
+    def __init__(self, symbols=10, days=60, seed=0, start='2024-01-01'):
+        sessions = pd.bdate_range(start, periods=days)
+        minutes = pd.to_timedelta(np.arange(MINUTES_PER_SESSION) + 9 * 60 + 15, unit='min')
+        wall_clock = (sessions.values[:, None] + minutes.values[None, :]).ravel()
+        self.epoch_ms = wall_clock.astype('datetime64[ms]').astype(np.int64)
+        self.symbols = [f"SYM{i:03d}" for i in range(symbols)]
+        self.symbol_tokens = {symbol: str(100_000 + i) for i, symbol in enumerate(self.symbols)}
+        self.bars = {symbol: self._walk(np.random.default_rng([seed, i]), len(self.epoch_ms))
+                     for i, symbol in enumerate(self.symbols)}
+
+    @staticmethod
+    def _walk(rng, n):
+        close = rng.uniform(50, 2000) * np.exp(np.cumsum(rng.normal(0, 0.0008, n)))
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        wick = np.abs(rng.normal(0, 0.0006, (2, n)))
+        high = np.maximum(open_, close) * (1 + wick[0])
+        low = np.minimum(open_, close) * (1 - wick[1])
+        volume = rng.integers(100, 50_000, n)
+        return np.column_stack([open_.round(2), high.round(2), low.round(2), close.round(2), volume])
+
+    def candles(self, symbol, from_date=None, to_date=None):
+        """SmartAPI [epoch_ms, o, h, l, c, v] rows for a symbol between two dates (inclusive)"""
+        start = 0 if from_date is None else np.searchsorted(self.epoch_ms, _date_ms(from_date))
+        stop = len(self.epoch_ms) if to_date is None else np.searchsorted(
+            self.epoch_ms, _date_ms(to_date) + 24 * 60 * 60 * 1000)
+        bars = self.bars[symbol][start:stop]
+        return [[ts, o, h, lo, c, int(v)] for ts, (o, h, lo, c, v)
+                in zip(self.epoch_ms[start:stop].tolist(), bars.tolist())]
+
+    def payload(self, symbol, from_date=None, to_date=None):
+        """A getCandleData 'data' object, as the JSON decoder returns it"""
+        return {'NSE': {self.symbol_tokens[symbol]: self.candles(symbol, from_date, to_date)}}
+
+    def trades(self, count, frames, seed=0):
+        """`count` trades at random bar times of the decoded candle frames, in entry order"""
+        rng = np.random.default_rng(seed)
+        symbols = rng.choice(self.symbols, count)
+        # Keep every trade's candle window (entry - 5 days to entry + exit_days + 5) inside the data
+        first = min(5 * MINUTES_PER_SESSION, len(self.epoch_ms) // 2)
+        last = len(self.epoch_ms) - (EXIT_DAYS + 6) * MINUTES_PER_SESSION
+        rows = rng.integers(first, max(last, first + 1), count)
+        entries = [frames[symbol]['timestamp'].iloc[row] for symbol, row in zip(symbols, rows)]
+        trades = pd.DataFrame({'entry_datetime': entries, 'symbol': symbols,
+                               'market_cap': 'Midcap', 'sector': 'Synthetic'})
+        return trades.sort_values('entry_datetime', kind='stable').reset_index(drop=True)
+
+
+def _date_ms(date_str):
+    return int(np.datetime64(str(date_str)[:10], 'ms').astype(np.int64))
+
+
+class SyntheticAngelOneAPI(AngelOneAPI):
+    """AngelOneAPI answering candle requests from a SyntheticMarket, without logins or network"""
+
+    def __init__(self, market, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.market = market
+        self.symbol_tokens = market.symbol_tokens
+
+    def _ensure_access_token(self):
+        return True
+
+    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
+        if symbol not in self.symbol_tokens:
+            return None
+        return self._process_historical_data(self.market.payload(symbol, from_date, to_date))
+
+
+def time_calls(func, args_list):
+    """Total wall time of calling func(*args) for every args tuple"""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return time.perf_counter() - start
+
+
+def per_trade_timing(func, args_list, trade_count):
+    """Time a per-trade stage on a sample of trades and extrapolate to all of them"""
+    seconds = time_calls(func, args_list[:PER_TRADE_SAMPLE])
+    calls = min(len(args_list), PER_TRADE_SAMPLE)
+    per_trade = seconds / max(calls, 1)
+    return {
+        'calls': calls,
+        'seconds': round(seconds, 4),
+        'per_trade_us': round(per_trade * 1e6, 1),
+        'estimated_seconds': round(per_trade * trade_count, 4)
+    }
+
+
+@contextmanager
+def synthetic_app(market, workdir):
+    """Point the Flask app's stores at workdir and its SmartAPI client at the synthetic market"""
+    from candle_cache import CandleCache
+    from response_cache import ResponseCache
+    from trade_store import TradeStore
+
+    saved = (app_module.AngelOneAPI, app_module.trade_store, app_module.candle_cache, app_module.response_cache)
+    app_module.AngelOneAPI = lambda *args, **kwargs: SyntheticAngelOneAPI(market, *args, **kwargs)
+    app_module.trade_store = TradeStore(os.path.join(workdir, 'uploads'))
+    app_module.candle_cache = CandleCache(os.path.join(workdir, 'cache'))
+    app_module.response_cache = ResponseCache()
+    try:
+        with app_module.app.test_client() as client:
+            yield client
+    finally:
+        (app_module.AngelOneAPI, app_module.trade_store, app_module.candle_cache,
+         app_module.response_cache) = saved
+
+
+def bench_backtest_endpoint(market, trades, repeat=3):
+    """POST /backtest end to end: cold candle cache once, then warm runs with the response cache cleared"""
+    credentials = {'api_key': 'bench', 'client_id': 'BENCH', 'password': '0000', 'totp': 'JBSWY3DPEHPK3PXP'}
+    csv = trades.assign(entry_datetime=trades['entry_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')).to_csv(index=False)
+    with tempfile.TemporaryDirectory() as workdir, synthetic_app(market, workdir) as client:
+        upload = client.post('/upload', data={'file': (io.BytesIO(csv.encode()), 'bench.csv')})
+        if upload.status_code != 200:
+            raise RuntimeError(f"Upload failed: {upload.get_json()}")
+        request_data = dict(credentials, filename=upload.get_json()['filename'],
+                            stop_loss=STOP_LOSS, target=TARGET, exit_days=EXIT_DAYS)
+
+        def post():
+            app_module.response_cache.clear()
+            response = client.post('/backtest', json=request_data)
+            if response.status_code != 200:
+                raise RuntimeError(f"Backtest failed: {response.get_json()}")
+            return response
+
+        start = time.perf_counter()
+        response = post()
+        cold = time.perf_counter() - start
+        warm = min(time_calls(post, [()]) for _ in range(repeat))
+        return {
+            'cold_seconds': round(cold, 4),
+            'warm_seconds': round(warm, 4),
+            'response_mb': round(len(response.data) / 2 ** 20, 2)
+        }
+
+
+def bench_pipeline_scale(trades=1_000, symbols=10, days=60, repeat=3):
+    market = SyntheticMarket(symbols=symbols, days=days)
+    api = SyntheticAngelOneAPI(market)
+    engine = BacktestEngine(api)
+    payloads = [market.payload(symbol) for symbol in market.symbols]
+
+    start = time.perf_counter()
+    frames = {symbol: api._process_historical_data(payload) for symbol, payload in zip(market.symbols, payloads)}
+    decode = time.perf_counter() - start
+    for _ in range(repeat - 1):
+        decode = min(decode, time_calls(api._process_historical_data, [(payload,) for payload in payloads]))
+    del payloads
+    trades_df = market.trades(trades, frames)
+
+    # Loaded symbols carry their sorted timestamps as arrays, like the engine's candles
+    arrays = {symbol: candle_arrays(frame) for symbol, frame in frames.items()}
+    entry_args = [(arrays[symbol], entry) for symbol, entry in zip(trades_df['symbol'], trades_df['entry_datetime'])]
+    entry_prices = [engine._get_entry_price(*args) for args in entry_args[:PER_TRADE_SAMPLE]]
+    exit_args = [(frames[symbol], entry, price, price * (1 - STOP_LOSS / 100), price * (1 + TARGET / 100), EXIT_DAYS)
+                 for symbol, entry, price in zip(trades_df['symbol'], trades_df['entry_datetime'], entry_prices)
+                 if price is not None]
+
+    def evaluate_all():
+        return pd.concat([engine.evaluate_batch(symbol, candle_arrays(frames[symbol]),
+                                                symbol_trades['entry_datetime'], STOP_LOSS, TARGET, EXIT_DAYS)
+                          for symbol, symbol_trades in trades_df.groupby('symbol', sort=False)]
+                         ).sort_index().reset_index(drop=True)
+
+    results_df = evaluate_all()
+    return {
+        'trades': trades,
+        'symbols': symbols,
+        'days': days,
+        'candles': len(market.epoch_ms) * symbols,
+        'stages': {
+            'process_historical_data': {'seconds': round(decode, 4)},
+            'get_entry_price': per_trade_timing(engine._get_entry_price, entry_args, trades),
+            'find_exit': per_trade_timing(engine._find_exit, exit_args, trades),
+            'evaluate_batch': measure(evaluate_all, repeat=repeat),
+            'calculate_metrics': measure(calculate_metrics, results_df, repeat=repeat),
+            'equity_curve_chart': measure(create_equity_curve_chart, results_df, repeat=repeat),
+            'returns_distribution_chart': measure(create_returns_distribution_chart, results_df, repeat=repeat),
+            'backtest_endpoint': bench_backtest_endpoint(market, trades_df, repeat=repeat)
+        }
+    }
+
+
+def bench_pipeline(scales=tuple(SCALES), repeat=3):
+    return {scale: bench_pipeline_scale(**SCALES[scale], repeat=repeat) for scale in scales}
+
+
+BENCHMARKS = {
+    'candle_parsing': lambda args: bench_candle_parsing(repeat=args.repeat),
+    'pipeline': lambda args: bench_pipeline(args.scales, repeat=args.repeat)
+}
+
+
+def environment():
+    """Commit and library versions a result was measured with"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--scales', nargs='+', default=list(SCALES), metavar='SCALE',
+                        help=f"pipeline trade counts: {', '.join(SCALES)} (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per timing; the best is kept (default: 3)")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    unknown = set(args.scales) - set(SCALES)
+    if unknown:
+        parser.error(f"unknown scales: {', '.join(sorted(unknown))}")
+
+    # Per-request INFO logging would dominate the timings
+    logging.disable(logging.INFO)
+    results = {'environment': environment()}
+    results.update((name, BENCHMARKS[name](args)) for name in (args.benchmarks or BENCHMARKS))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+On-disk OHLCV candle cache for Angel One SmartAPI historical data.
+
+Candles are stored in a single SQLite database keyed by
+(exchange, token, interval, timestamp). A separate coverage table records
+which date ranges have already been fetched, so repeated backtests only
+request the days that are actually missing and never touch the network
+once a window is fully cached.
+
+SQLite is the source of truth, but the backtest engine reads candles from
+per-series snapshots of fixed-layout .npy columns that it memory-maps
+read-only. Every process (gunicorn workers, process-pool shards) then
+shares one page-cache copy of the data instead of parsing its own, and a
+snapshot is only rebuilt after new candles have been stored.
+
+The same database memoizes per-trade backtest results. A result is only
+recorded once the trade's whole candle window is covered, i.e. fully in
+the past and fetched, so the candles it was computed from can no longer
+change; coverage is what versions a memoized trade.
+"""
+
+import os
+import shutil
+import sqlite3
+import logging
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Bumped whenever the engine's entry or exit rules change, which invalidates memoized trade results
+RESULTS_VERSION = 2
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+CandleArrays = namedtuple('CandleArrays', ['timestamps', 'open', 'high', 'low', 'close', 'volume'])
+
+# Superseded snapshots are kept this long for readers that still hold them
+SNAPSHOT_GRACE_SECONDS = 60 * 60
+# Written into a snapshot directory when a newer version replaces it; its mtime starts the grace period
+SUPERSEDED_MARKER = 'superseded'
+
+
+def timestamps_to_ms(values):
+    """Convert naive datetime values to int64 epoch milliseconds"""
+    return np.asarray(values, dtype='datetime64[ms]').astype(np.int64)
+
+
+def _date_to_ms(date_str):
+    return int(np.datetime64(date_str, 'ms').astype(np.int64))
+
+
+def _parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def _uncovered(rows, from_date, to_date):
+    """Sub-ranges of [from_date, to_date] outside the (from, to) date rows, which are sorted by from"""
+    start = _parse_date(from_date)
+    end = _parse_date(to_date)
+    gaps = []
+    cursor = start
+    for covered_from, covered_to in rows:
+        if covered_from > cursor:
+            gaps.append((cursor, min(covered_from - timedelta(days=1), end)))
+        cursor = max(cursor, covered_to + timedelta(days=1))
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+
+    # Weekends never have candles, so a gap made only of Saturdays and
+    # Sundays would otherwise be re-requested on every run.
+    missing = []
+    for gap_from, gap_to in gaps:
+        span = (gap_to - gap_from).days + 1
+        if all((gap_from + timedelta(days=i)).weekday() >= 5 for i in range(span)):
+            continue
+        missing.append((gap_from.strftime(DATE_FORMAT), gap_to.strftime(DATE_FORMAT)))
+    return missing
+
+
+class MappedCandles:
+    """Handle to candle rows [start, stop) of an on-disk snapshot.
+
+    Holds no candle data itself, so it is cheap to keep for every symbol and
+    to send to worker processes; arrays() maps the columns when needed.
+    """
+    __slots__ = ('directory', 'ranges')
+
+    def __init__(self, directory, ranges):
+        self.directory = directory
+        self.ranges = ranges
+
+    def __len__(self):
+        return sum(stop - start for start, stop in self.ranges)
+
+    def arrays(self):
+        """CandleArrays of read-only memory-mapped views (copied only when there are several ranges)"""
+        columns = {}
+        for field in CandleArrays._fields:
+            mapped = np.load(os.path.join(self.directory, f"{field}.npy"), mmap_mode='r')
+            parts = [mapped[start:stop] for start, stop in self.ranges]
+            columns[field] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return CandleArrays(**columns)
+
+
+class CandleCache:
+    def __init__(self, cache_dir='cache'):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 'candles.sqlite3')
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS candles (
+                    exchange TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    open REAL,
+                    high REAL,
+                    low REAL,
+                    close REAL,
+                    volume INTEGER,
+                    PRIMARY KEY (exchange, token, interval, ts)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    exchange TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    from_date TEXT NOT NULL,
+                    to_date TEXT NOT NULL,
+                    fetched_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS coverage_key
+                ON coverage (exchange, token, interval)
+            """)
+            # Bumped on every store so stale snapshots are detected
+            has_versions = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'versions'"
+            ).fetchone()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    exchange TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (exchange, token, interval)
+                )
+            """)
+            if not has_versions:
+                # Caches written before snapshots existed
+                conn.execute(
+                    "INSERT OR IGNORE INTO versions (exchange, token, interval, version) "
+                    "SELECT DISTINCT exchange, token, interval, 1 FROM candles"
+                )
+            # exit_code is -1 for trades that had no entry price or exit
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trade_results (
+                    exchange TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    interval TEXT NOT NULL,
+                    stop_loss_pct REAL NOT NULL,
+                    target_pct REAL NOT NULL,
+                    exit_days INTEGER NOT NULL,
+                    entry_ms INTEGER NOT NULL,
+                    entry_price REAL,
+                    exit_ms INTEGER,
+                    exit_price REAL,
+                    exit_code INTEGER NOT NULL,
+                    PRIMARY KEY (exchange, token, interval, stop_loss_pct, target_pct, exit_days, entry_ms)
+                ) WITHOUT ROWID
+            """)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < RESULTS_VERSION:
+                # Memoized under older entry/exit rules, so no longer what the engine would compute
+                conn.execute("DELETE FROM trade_results")
+                conn.execute(f"PRAGMA user_version = {RESULTS_VERSION}")
+
+    def missing_ranges(self, exchange, token, interval, from_date, to_date):
+        """Return the (from_date, to_date) sub-ranges that are not cached yet"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT from_date, to_date FROM coverage "
+                "WHERE exchange = ? AND token = ? AND interval = ? "
+                "AND from_date <= ? AND to_date >= ? ORDER BY from_date",
+                (exchange, token, interval, to_date, from_date)
+            ).fetchall()
+        rows = [(_parse_date(covered_from), _parse_date(covered_to)) for covered_from, covered_to in rows]
+        return _uncovered(rows, from_date, to_date)
+
+    def covered(self, exchange, token, interval, windows):
+        """Whether each (from_date, to_date) window is fully cached, from one coverage query"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT from_date, to_date FROM coverage "
+                "WHERE exchange = ? AND token = ? AND interval = ? ORDER BY from_date",
+                (exchange, token, interval)
+            ).fetchall()
+        rows = [(_parse_date(covered_from), _parse_date(covered_to)) for covered_from, covered_to in rows]
+        return [not _uncovered(rows, from_date, to_date) for from_date, to_date in windows]
+
+    def load_results(self, exchange, token, interval, stop_loss_pct, target_pct, exit_days, entry_ms):
+        """Memoized results for the given entry times, as a frame with an entry_ms column"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT entry_ms, entry_price, exit_ms, exit_price, exit_code FROM trade_results "
+                "WHERE exchange = ? AND token = ? AND interval = ? "
+                "AND stop_loss_pct = ? AND target_pct = ? AND exit_days = ?",
+                (exchange, token, interval, float(stop_loss_pct), float(target_pct), int(exit_days))
+            ).fetchall()
+        results = pd.DataFrame(rows, columns=['entry_ms', 'entry_price', 'exit_ms', 'exit_price', 'exit_code'])
+        return results[results['entry_ms'].isin(np.asarray(entry_ms))]
+
+    def store_results(self, exchange, token, interval, stop_loss_pct, target_pct, exit_days, rows):
+        """Memoize (entry_ms, entry_price, exit_ms, exit_price, exit_code) rows"""
+        key = (exchange, token, interval, float(stop_loss_pct), float(target_pct), int(exit_days))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO trade_results "
+                "(exchange, token, interval, stop_loss_pct, target_pct, exit_days, "
+                "entry_ms, entry_price, exit_ms, exit_price, exit_code) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key + tuple(row) for row in rows)
+            )
+
+    def store(self, exchange, token, interval, df, from_date, to_date):
+        """Merge fetched candles into the cache and mark the range as covered"""
+        if df is not None and not df.empty:
+            ts = timestamps_to_ms(df['timestamp'].values)
+            rows = zip(
+                [exchange] * len(df), [token] * len(df), [interval] * len(df),
+                ts.tolist(),
+                df['open'].astype(float).tolist(),
+                df['high'].astype(float).tolist(),
+                df['low'].astype(float).tolist(),
+                df['close'].astype(float).tolist(),
+                df['volume'].astype('int64').tolist()
+            )
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO candles "
+                    "(exchange, token, interval, ts, open, high, low, close, volume) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.execute(
+                    "INSERT INTO versions (exchange, token, interval, version) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (exchange, token, interval) DO UPDATE SET version = version + 1",
+                    (exchange, token, interval)
+                )
+
+        # Today's (and future) candles are still being formed, so only the
+        # part of the range that is fully in the past counts as covered.
+        last_complete = datetime.now().date() - timedelta(days=1)
+        covered_to = min(_parse_date(to_date), last_complete)
+        if covered_to < _parse_date(from_date):
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO coverage (exchange, token, interval, from_date, to_date, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (exchange, token, interval, from_date,
+                 covered_to.strftime(DATE_FORMAT), datetime.now().isoformat())
+            )
+
+    def load(self, exchange, token, interval, from_date, to_date):
+        """Load cached candles between from_date and to_date (inclusive)"""
+        start_ms = _date_to_ms(from_date)
+        end_ms = _date_to_ms(to_date) + MS_PER_DAY
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ts, open, high, low, close, volume FROM candles "
+                "WHERE exchange = ? AND token = ? AND interval = ? "
+                "AND ts >= ? AND ts < ? ORDER BY ts",
+                (exchange, token, interval, start_ms, end_ms)
+            ).fetchall()
+
+        if not rows:
+            return None
+
+        columns = list(zip(*rows))
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(np.array(columns[0], dtype=np.int64), unit='ms'),
+            'open': np.array(columns[1], dtype=np.float64),
+            'high': np.array(columns[2], dtype=np.float64),
+            'low': np.array(columns[3], dtype=np.float64),
+            'close': np.array(columns[4], dtype=np.float64),
+            'volume': np.array(columns[5], dtype=np.int64)
+        })
+
+    def _snapshot_dir(self, exchange, token, interval, version):
+        return os.path.join(self.cache_dir, 'arrays', f"{exchange}_{token}_{interval}", f"v{version}")
+
+    def snapshot(self, exchange, token, interval):
+        """Directory of the current .npy snapshot for a series, building it if stale; None if empty"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version FROM versions WHERE exchange = ? AND token = ? AND interval = ?",
+                (exchange, token, interval)
+            ).fetchone()
+        if row is None:
+            return None
+        directory = self._snapshot_dir(exchange, token, interval, row[0])
+        if os.path.isdir(directory):
+            return directory
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ts, open, high, low, close, volume FROM candles "
+                "WHERE exchange = ? AND token = ? AND interval = ? ORDER BY ts",
+                (exchange, token, interval)
+            ).fetchall()
+        columns = list(zip(*rows)) or [()] * 6
+        dtypes = [np.int64, np.float64, np.float64, np.float64, np.float64, np.int64]
+
+        # Write into a private directory and rename it into place, so readers
+        # never see a half-written snapshot
+        tmp_dir = f"{directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_dir)
+        for field, column, dtype in zip(CandleArrays._fields, columns, dtypes):
+            np.save(os.path.join(tmp_dir, f"{field}.npy"), np.array(column, dtype=dtype))
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Another process published the same version first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        logger.info(f"Built candle snapshot {directory} ({len(rows)} candles)")
+        self._prune_snapshots(os.path.dirname(directory), keep=directory)
+        return directory
+
+    def _prune_snapshots(self, series_dir, keep):
+        """Mark snapshots older than keep superseded; delete those superseded past the grace period.
+
+        The grace period runs from the superseded marker, not the snapshot's
+        own mtime: a snapshot built long ago may have been mapped just before
+        it was replaced.
+        """
+        cutoff = time.time() - SNAPSHOT_GRACE_SECONDS
+        keep_version = int(os.path.basename(keep)[1:])
+        for name in os.listdir(series_dir):
+            path = os.path.join(series_dir, name)
+            try:
+                if name.endswith('.tmp'):
+                    # Abandoned by a writer that died before publishing it
+                    if os.path.getmtime(path) < cutoff:
+                        shutil.rmtree(path)
+                    continue
+                if int(name[1:]) >= keep_version:
+                    continue
+                marker = os.path.join(path, SUPERSEDED_MARKER)
+                if not os.path.exists(marker):
+                    open(marker, 'w').close()
+                elif os.path.getmtime(marker) < cutoff:
+                    shutil.rmtree(path)
+            except (OSError, ValueError):
+                continue
+
+    def map(self, exchange, token, interval, windows):
+        """MappedCandles over the cached candles in the (from_date, to_date) windows, or None"""
+        directory = self.snapshot(exchange, token, interval)
+        if directory is None:
+            return None
+        timestamps = np.load(os.path.join(directory, 'timestamps.npy'), mmap_mode='r')
+
+        ranges = []
+        for from_date, to_date in sorted(windows):
+            start = int(np.searchsorted(timestamps, _date_to_ms(from_date), side='left'))
+            stop = int(np.searchsorted(timestamps, _date_to_ms(to_date) + MS_PER_DAY, side='left'))
+            if start >= stop:
+                continue
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], stop))
+            else:
+                ranges.append((start, stop))
+        return MappedCandles(directory, ranges) if ranges else None
+
+    def _resolve(self, api_client, symbol):
+        token = api_client.symbol_tokens.get(symbol)
+        if not token:
+            logger.error(f"Invalid symbol: {symbol}. No instrument token for it")
+        return token
+
+    def get_mapped_candles(self, api_client, symbol, windows, interval="ONE_MINUTE", exchange='NSE'):
+        """Fill every (from_date, to_date) window like get_historical_data, then map them from the snapshot"""
+        token = self._resolve(api_client, symbol)
+        if not token:
+            return None
+        for from_date, to_date in windows:
+            self._fill(api_client, symbol, exchange, token, interval, from_date, to_date)
+        return self.map(exchange, token, interval, windows)
+
+    def get_historical_data(self, api_client, symbol, interval="ONE_MINUTE",
+                            from_date=None, to_date=None, exchange='NSE'):
+        """Serve candles from the cache, fetching only the missing date ranges"""
+        token = self._resolve(api_client, symbol)
+        if not token:
+            return None
+
+        if not from_date:
+            from_date = (datetime.now() - timedelta(days=30)).strftime(DATE_FORMAT)
+        if not to_date:
+            to_date = datetime.now().strftime(DATE_FORMAT)
+
+        self._fill(api_client, symbol, exchange, token, interval, from_date, to_date)
+        return self.load(exchange, token, interval, from_date, to_date)
+
+    def _fill(self, api_client, symbol, exchange, token, interval, from_date, to_date):
+        """Fetch and store whatever part of the range is not cached yet"""
+        missing = self.missing_ranges(exchange, token, interval, from_date, to_date)
+        telemetry.count('candle_cache_lookups_total', result='miss' if missing else 'hit')
+        if missing:
+            logger.info(f"Candle cache miss for {symbol} ({interval}): fetching {missing}")
+        else:
+            logger.info(f"Candle cache hit for {symbol} ({interval}) from {from_date} to {to_date}")
+
+        for missing_from, missing_to in missing:
+            df = api_client.get_historical_data(
+                symbol, interval=interval, from_date=missing_from, to_date=missing_to
+            )
+            if df is None:
+                # Leave the range uncovered so it is retried on the next run
+                continue
+            self.store(exchange, token, interval, df, missing_from, missing_to)
@@ -0,0 +1,176 @@
+"""
+Local fake of the Angel One SmartAPI endpoints used by the dashboard.
+
+Serves loginByPassword, generateTokens, getCandleData and the scrip master over HTTP on a random local port
+so AngelOneAPI can be exercised end to end without credentials or network
+access. Candles are a deterministic function of time, and failures such as
+429 responses can be injected to test retries.
+
+    with FakeSmartAPIServer() as server:
+        api = AngelOneAPI('key', 'client', '1234', 'JBSWY3DPEHPK3PXP', base_url=server.base_url)
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+LOGIN_PATH = '/rest/auth/angelbroking/user/v1/loginByPassword'
+CANDLE_PATH = '/rest/secure/angelbroking/historical/v1/getCandleData'
+REFRESH_PATH = '/rest/auth/angelbroking/jwt/v1/generateTokens'
+SCRIP_MASTER_PATH = '/OpenAPI_File/files/OpenAPIScripMaster.json'
+
+SCRIP_MASTER_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'scrip_master.json')
+
+INTERVAL_FREQUENCIES = {
+    'ONE_MINUTE': '1min',
+    'THREE_MINUTE': '3min',
+    'FIVE_MINUTE': '5min',
+    'TEN_MINUTE': '10min',
+    'FIFTEEN_MINUTE': '15min',
+    'THIRTY_MINUTE': '30min',
+    'ONE_HOUR': '60min',
+    'ONE_DAY': '1D'
+}
+
+
+def wave_candles(token, interval, from_date, to_date):
+    """Deterministic market-hours candles as SmartAPI [epoch_ms, o, h, l, c, v] rows"""
+    from_date, to_date = str(from_date)[:10], str(to_date)[:10]
+    frequency = INTERVAL_FREQUENCIES.get(interval, '1min')
+    if interval == 'ONE_DAY':
+        timestamps = pd.date_range(f"{from_date} 09:15", f"{to_date} 09:15", freq='D')
+    else:
+        timestamps = pd.date_range(f"{from_date} 09:15", f"{to_date} 15:29", freq=frequency)
+        minute_of_day = timestamps.hour * 60 + timestamps.minute
+        timestamps = timestamps[(minute_of_day >= 9 * 60 + 15) & (minute_of_day < 15 * 60 + 30)]
+    timestamps = timestamps[timestamps.dayofweek < 5]
+
+    minutes = (timestamps - pd.Timestamp('2024-01-01')).total_seconds().values / 60
+    base = 100 + (int(token) % 50)
+    close = base + 8 * np.sin(minutes / 700) + 3 * np.sin(minutes / 97)
+    high = close + np.abs(np.sin(minutes / 13))
+    low = close - np.abs(np.cos(minutes / 17))
+    epoch_ms = np.asarray(timestamps.values, dtype='datetime64[ms]').astype(np.int64)
+    return [[int(ts), round(float(c), 2), round(float(h), 2), round(float(lo), 2), round(float(c), 2), 1000]
+            for ts, c, h, lo in zip(epoch_ms, close, high, low)]
+
+
+class FakeSmartAPIServer:
+    def __init__(self, candles=wave_candles, latency=0.0):
+        self.candles = candles
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = []
+        self.logins = 0
+        self.refreshes = 0
+        self.scrip_master_downloads = 0
+        with open(SCRIP_MASTER_FIXTURE, 'rb') as f:
+            self.scrip_master = f.read()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Status codes returned (in order) before requests start succeeding
+        self.failures = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path != SCRIP_MASTER_PATH:
+                    self._send(404, {'status': False, 'message': 'Not found'})
+                    return
+                with fake.lock:
+                    fake.scrip_master_downloads += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(fake.scrip_master)))
+                self.end_headers()
+                self.wfile.write(fake.scrip_master)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+
+                with fake.lock:
+                    fake.requests.append((self.path, body, time.monotonic()))
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    failure = fake.failures.pop(0) if fake.failures else None
+                try:
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                    if failure:
+                        self._send(failure, {'status': False, 'message': 'Injected failure'})
+                    elif self.path == LOGIN_PATH:
+                        with fake.lock:
+                            fake.logins += 1
+                        self._send(200, {'status': True, 'data': {
+                            'jwtToken': 'fake-jwt', 'refreshToken': 'fake-refresh', 'feedToken': 'fake-feed'
+                        }})
+                    elif self.path == REFRESH_PATH:
+                        if (self.headers.get('Authorization') != 'Bearer fake-jwt' or
+                                body.get('refreshToken') != 'fake-refresh'):
+                            self._send(401, {'status': False, 'message': 'Invalid refresh token'})
+                            return
+                        with fake.lock:
+                            fake.refreshes += 1
+                        self._send(200, {'status': True, 'data': {
+                            'jwtToken': 'fake-jwt', 'refreshToken': 'fake-refresh', 'feedToken': 'fake-feed'
+                        }})
+                    elif self.path == CANDLE_PATH:
+                        if self.headers.get('Authorization') != 'Bearer fake-jwt':
+                            self._send(401, {'status': False, 'message': 'Invalid token'})
+                            return
+                        data = {
+                            exchange: {token: fake.candles(token, body.get('interval'),
+                                                           body.get('fromDate'), body.get('toDate'))
+                                       for token in tokens}
+                            for exchange, tokens in body.get('exchangeTokens', {}).items()
+                        }
+                        self._send(200, {'status': True, 'data': data})
+                    else:
+                        self._send(404, {'status': False, 'message': 'Not found'})
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+        return Handler
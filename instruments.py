@@ -0,0 +1,241 @@
+"""
+Angel One instrument master: symbol to token lookup for every listed scrip.
+
+SmartAPI identifies instruments by numeric token, published daily in the
+OpenAPI scrip master (a JSON array of ~100MB). The master is downloaded at
+most once a day, streamed through an incremental JSON decoder so it is never
+held in memory whole, and reduced to a {"EXCHANGE:TRADINGSYMBOL": token}
+dict that is pickled next to the candle cache. Later boots only unpickle
+that index, and lookups are a single dict access.
+
+NSE equities are listed as e.g. "RELIANCE-EQ"; the bare symbol Chartink
+exports ("RELIANCE") is indexed as an alias of the -EQ series.
+"""
+
+import json
+import logging
+import os
+import pickle
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SCRIP_MASTER_URL = 'https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json'
+
+# Used when the scrip master has never been downloaded (e.g. offline)
+FALLBACK_TOKENS = {
+    'RELIANCE': '2885',
+    'TCS': '11536',
+    'INFY': '1594',
+    'HDFCBANK': '1333',
+    'ICICIBANK': '4963',
+    'SBIN': '3045',
+    'WIPRO': '3787',
+    'LT': '11483',
+    'BAJFINANCE': '317',
+    'ASIANPAINT': '236',
+    'ITC': '1660',
+    'ULTRACEMCO': '11532',
+    'AXISBANK': '5900',
+    'MARUTI': '10999'
+}
+
+EQUITY_SUFFIX = '-EQ'
+
+
+def iter_json_array(f, chunk_size=1 << 20):
+    """Yield the elements of a top-level JSON array from a text file, one at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = f.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            # Skip whitespace, the opening bracket and separators
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+                if buffer[position] == '[':
+                    started = True
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if not started or position >= len(buffer):
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # The element continues in the next chunk
+                break
+            yield item
+            position = end
+        if not chunk:
+            # A download cut off between elements still has to end with the bracket
+            raise ValueError("Truncated JSON array")
+
+
+def index_key(exchange, symbol):
+    return f"{exchange.upper()}:{symbol.upper()}"
+
+
+def build_index(instruments, exchanges=('NSE',)):
+    """{"EXCHANGE:TRADINGSYMBOL": token} for the given exchanges, with bare aliases for -EQ series"""
+    exchanges = {exchange.upper() for exchange in exchanges}
+    index = {}
+    aliases = {}
+    for instrument in instruments:
+        exchange = str(instrument.get('exch_seg', '')).upper()
+        symbol = str(instrument.get('symbol', ''))
+        token = str(instrument.get('token', ''))
+        if exchange not in exchanges or not symbol or not token:
+            continue
+        index[index_key(exchange, symbol)] = token
+        if symbol.upper().endswith(EQUITY_SUFFIX):
+            aliases[index_key(exchange, symbol[:-len(EQUITY_SUFFIX)])] = token
+    # A real tradingsymbol always wins over an alias
+    for key, token in aliases.items():
+        index.setdefault(key, token)
+    return index
+
+
+class InstrumentMaster:
+    def __init__(self, cache_dir='cache', url=SCRIP_MASTER_URL, exchanges=('NSE',),
+                 session=None, today=lambda: datetime.now().date()):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, 'instruments.pickle')
+        self.url = url
+        self.exchanges = tuple(exchanges)
+        self.session = session or requests.Session()
+        self.today = today
+        self.timeout = 120
+        self._index = None
+        self._downloaded = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        if saved.get('exchanges') != self.exchanges:
+            return False
+        self._index = saved['tokens']
+        self._downloaded = saved['downloaded']
+        return True
+
+    def refresh(self):
+        """Download the scrip master and rebuild the on-disk index; returns False on failure"""
+        tmp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        try:
+            logger.info(f"Downloading instrument master from {self.url}")
+            with self.session.get(self.url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                response.encoding = response.encoding or 'utf-8'
+                reader = _ResponseReader(response)
+                index = build_index(iter_json_array(reader), self.exchanges)
+            if not index:
+                raise ValueError("Instrument master has no instruments for " + ', '.join(self.exchanges))
+
+            downloaded = self.today().isoformat()
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'downloaded': downloaded, 'exchanges': self.exchanges, 'tokens': index},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.index_path)
+            self._index, self._downloaded = index, downloaded
+            logger.info(f"Indexed {len(index)} instruments")
+            return True
+        except Exception as e:
+            logger.error(f"Error downloading instrument master: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+                    # Don't retry a failed download on every lookup today
+                    self._downloaded = self.today().isoformat()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def index(self):
+        """The token index, loading or downloading it on first use; {} if unavailable"""
+        if self._index is None:
+            with self._lock:
+                if self._index is None and not self._load_index():
+                    # Nothing cached yet: the first lookup has to wait for the download
+                    if not self.refresh():
+                        self._index, self._downloaded = {}, self.today().isoformat()
+        if self._downloaded != self.today().isoformat():
+            # Serve yesterday's index while today's is fetched
+            self._refresh_in_background()
+        return self._index
+
+    def token(self, symbol, exchange='NSE'):
+        """Token for a tradingsymbol (or bare equity symbol), or None"""
+        return self.index().get(index_key(exchange, symbol))
+
+
+class SymbolTokens(Mapping):
+    """Read-only symbol -> token mapping for one exchange, backed by the instrument master.
+
+    Falls back to FALLBACK_TOKENS for symbols the master does not know, so
+    the common large caps still resolve when the master can't be downloaded.
+    """
+
+    def __init__(self, master=None, exchange='NSE', fallback=FALLBACK_TOKENS):
+        self.master = master
+        self.exchange = exchange
+        self.fallback = fallback
+
+    def __getitem__(self, symbol):
+        token = self.master.token(symbol, self.exchange) if self.master is not None else None
+        if token is None:
+            token = self.fallback.get(str(symbol).upper())
+        if token is None:
+            raise KeyError(symbol)
+        return token
+
+    def __iter__(self):
+        prefix = f"{self.exchange.upper()}:"
+        seen = set()
+        if self.master is not None:
+            for key in self.master.index():
+                if key.startswith(prefix):
+                    seen.add(key[len(prefix):])
+                    yield key[len(prefix):]
+        for symbol in self.fallback:
+            if symbol not in seen:
+                yield symbol
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _ResponseReader:
+    """Minimal text file interface over a streamed requests response"""
+
+    def __init__(self, response, chunk_size=1 << 20):
+        self.chunks = response.iter_content(chunk_size=chunk_size, decode_unicode=True)
+
+    def read(self, size=-1):
+        return next(self.chunks, '')
@@ -0,0 +1,204 @@
+"""
+File-backed job store for background backtests.
+
+Each job is a small JSON status file (state, progress, current symbol)
+plus an append-only JSON-lines file of partial trade results and, once
+finished, a JSON file with the complete response payload. Keeping state
+on disk lets any gunicorn worker answer /jobs/<id> polls, not just the
+worker that runs the job.
+
+Jobs run on threads of the web process that accepted them, so they die
+with it (a restart, or gunicorn killing a timed-out worker). Each job
+records the process running it and is heartbeat while it runs; a queued or
+running job whose process is gone, or that has not been updated for
+stale_after seconds, is reported failed rather than running forever.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+INTERRUPTED_ERROR = 'The backtest was interrupted because its worker stopped; please run it again'
+
+
+def worker_id():
+    """Host and process id of the current process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_alive(worker):
+    """Whether the process a worker_id() names is still running; True when that can't be told from here"""
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    def __init__(self, directory='jobs', dumps=json.dumps, max_age=24 * 60 * 60, stale_after=15 * 60):
+        self.directory = directory
+        self.dumps = dumps
+        self.max_age = max_age
+        # Unfinished jobs not updated for this long are failed; running jobs heartbeat well within it
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, suffix):
+        # Job ids are generated hex strings; reject anything else before touching the filesystem
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def _write(self, path, text):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def create(self, **fields):
+        """Register a new queued job and return its id"""
+        self.prune()
+        job_id = uuid.uuid4().hex
+        status = {
+            'job_id': job_id,
+            'status': JOB_QUEUED,
+            'done': 0,
+            'total': 0,
+            'current_symbol': None,
+            'results_count': 0,
+            'error': None,
+            'worker': worker_id(),
+            'created_at': time.time(),
+            'updated_at': time.time()
+        }
+        status.update(fields)
+        self._write(self._path(job_id, '.json'), self.dumps(status))
+        return job_id
+
+    def _read(self, job_id):
+        try:
+            with open(self._path(job_id, '.json')) as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def interrupted(self, status):
+        """Whether a job is still queued or running although nothing is running it any more"""
+        if status['status'] not in (JOB_QUEUED, JOB_RUNNING):
+            return False
+        if not worker_alive(status.get('worker')):
+            return True
+        # Queued jobs may wait behind others; only running ones are heartbeat
+        return status['status'] == JOB_RUNNING and time.time() - status['updated_at'] > self.stale_after
+
+    def get(self, job_id):
+        """Current status of a job, or None if it does not exist; interrupted jobs are failed first"""
+        status = self._read(job_id)
+        if status is not None and self.interrupted(status):
+            with self.lock:
+                status = self._read(job_id)
+                if self.interrupted(status):
+                    status.update(status=JOB_FAILED, error=INTERRUPTED_ERROR, updated_at=time.time())
+                    self._write(self._path(job_id, '.json'), self.dumps(status))
+        return status
+
+    def fail_interrupted(self):
+        """Fail every job left queued or running by a process that has stopped; returns their ids"""
+        failed = []
+        for name in os.listdir(self.directory):
+            job_id, suffix = os.path.splitext(name)
+            if suffix != '.json' or '.' in job_id:
+                continue
+            try:
+                status = self._read(job_id)
+            except (KeyError, ValueError):
+                continue
+            if status is not None and self.interrupted(status):
+                self.get(job_id)
+                failed.append(job_id)
+        return failed
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            status = self._read(job_id)
+            if status is None:
+                return
+            status.update(fields)
+            status['updated_at'] = time.time()
+            self._write(self._path(job_id, '.json'), self.dumps(status))
+
+    def append_results(self, job_id, records):
+        """Append partial trade results and bump the job's results_count"""
+        if not records:
+            return
+        with self.lock:
+            with open(self._path(job_id, '.partial.jsonl'), 'a') as f:
+                for record in records:
+                    f.write(self.dumps(record) + '\n')
+            status = self._read(job_id)
+            status['results_count'] += len(records)
+            status['updated_at'] = time.time()
+            self._write(self._path(job_id, '.json'), self.dumps(status))
+
+    def partial_results(self, job_id, since=0):
+        """Partial results recorded so far, starting at index since"""
+        try:
+            with open(self._path(job_id, '.partial.jsonl')) as f:
+                return [json.loads(line) for i, line in enumerate(f) if i >= since]
+        except (KeyError, FileNotFoundError):
+            return []
+
+    def read_partial_results(self, job_id, offset=0):
+        """Partial results appended after byte offset; returns (records, new offset).
+        
+        Only complete lines are consumed, so a record that is still being
+        written is picked up by the next call.
+        """
+        try:
+            with open(self._path(job_id, '.partial.jsonl'), 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except (KeyError, FileNotFoundError):
+            return [], offset
+        end = chunk.rfind(b'\n') + 1
+        records = [json.loads(line) for line in chunk[:end].splitlines() if line]
+        return records, offset + end
+
+    def complete(self, job_id, payload, serialized=False):
+        """Store the final response payload (or its JSON text, if serialized) and mark the job completed"""
+        self._write(self._path(job_id, '.result.json'), payload if serialized else self.dumps(payload))
+        self.update(job_id, status=JOB_COMPLETED)
+
+    def result(self, job_id):
+        """Serialized final payload of a completed job, or None"""
+        try:
+            with open(self._path(job_id, '.result.json')) as f:
+                return f.read()
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def prune(self):
+        """Delete job files older than max_age"""
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
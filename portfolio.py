@@ -0,0 +1,166 @@
+"""
+Portfolio-level simulation of backtested trades.
+
+The per-trade backtest treats every signal as independent, so summing
+pnl_pct overstates returns whenever signals overlap. simulate_portfolio
+replays the trades against one account instead: entries are taken in time
+order and open positions are kept in a heap keyed by exit time, so every
+exit due at or before the next entry is settled first and the two event
+streams are merged in O(n log k) for k open positions. Each entry is sized
+as a share of current equity, in whole shares, and is skipped when the
+account already holds max_positions, already holds the symbol, or cannot
+pay for a single share.
+
+Open positions are marked to market at the closes passed in marks (e.g.
+each day's last bar per symbol), merged into the same event stream, and at
+their entry price until the first one. Equity is recorded at every entry,
+exit and mark of a held symbol, so a drawdown while positions are open
+shows even when it recovers before they exit.
+"""
+
+import heapq
+
+import numpy as np
+
+DEFAULT_CAPITAL = 1_000_000
+DEFAULT_POSITION_PCT = 10
+DEFAULT_MAX_POSITIONS = 10
+
+SKIP_MAX_POSITIONS = 'max_positions'
+SKIP_SYMBOL_OPEN = 'symbol_open'
+SKIP_INSUFFICIENT_CASH = 'insufficient_cash'
+
+
+class PortfolioResult:
+    def __init__(self, capital, quantity, skip_reason, equity_ms, equity, open_positions):
+        self.capital = capital
+        self.quantity = quantity
+        self.skip_reason = skip_reason
+        self.equity_ms = equity_ms
+        self.equity = equity
+        self.open_positions = open_positions
+
+    def metrics(self):
+        taken = self.quantity > 0
+        final_equity = float(self.equity[-1]) if len(self.equity) else float(self.capital)
+        if len(self.equity):
+            peak = np.maximum.accumulate(np.concatenate(([self.capital], self.equity)))[1:]
+            max_drawdown = float(((self.equity - peak) / peak).min() * 100)
+        else:
+            max_drawdown = 0.0
+        reasons, counts = np.unique(self.skip_reason[~taken].astype(str), return_counts=True)
+        return {
+            'starting_capital': round(float(self.capital), 2),
+            'final_equity': round(final_equity, 2),
+            'total_return_pct': round((final_equity / self.capital - 1) * 100, 2),
+            'max_drawdown_pct': round(max_drawdown, 2),
+            'trades_taken': int(taken.sum()),
+            'trades_skipped': {str(reason): int(n) for reason, n in zip(reasons, counts)},
+            'max_open_positions': int(self.open_positions.max()) if len(self.open_positions) else 0
+        }
+
+    def daily_equity(self):
+        """(epoch ms, equity) at the last event of each UTC day"""
+        if not len(self.equity_ms):
+            return self.equity_ms, self.equity
+        days = self.equity_ms // (24 * 60 * 60 * 1000)
+        last = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+        return self.equity_ms[last], self.equity[last]
+
+
+def check_settings(capital, position_pct, max_positions):
+    if capital <= 0 or not 0 < position_pct <= 100 or max_positions < 1:
+        raise ValueError('capital and max_positions must be positive and position_pct in (0, 100]')
+
+
+def simulate_portfolio(entry_ms, exit_ms, entry_price, exit_price, symbols=None, capital=DEFAULT_CAPITAL,
+                       position_pct=DEFAULT_POSITION_PCT, max_positions=DEFAULT_MAX_POSITIONS, marks=None):
+    """Replay trades (parallel arrays, one element per trade) against one account.
+
+    Returns a PortfolioResult whose quantity and skip_reason arrays line
+    up with the input (quantity 0 and a reason for skipped trades). Entries
+    at the same time are taken in input order; exits at an entry's time are
+    settled before it, and before marks at that time. marks maps a symbol
+    to (epoch ms, price) arrays and is only used with symbols. Raises
+    ValueError for non-positive settings.
+    """
+    check_settings(capital, position_pct, max_positions)
+    entry_ms = np.asarray(entry_ms, dtype=np.int64)
+    exit_ms = np.asarray(exit_ms, dtype=np.int64)
+    entry_price = np.asarray(entry_price, dtype=np.float64)
+    exit_price = np.asarray(exit_price, dtype=np.float64)
+    n = len(entry_ms)
+
+    # Every symbol's marks as one time-ordered stream
+    marks = marks if symbols is not None and marks else {}
+    mark_ms = np.concatenate([np.asarray(ms, dtype=np.int64) for ms, _ in marks.values()] + [np.empty(0, np.int64)])
+    mark_price = np.concatenate([np.asarray(price, dtype=np.float64) for _, price in marks.values()] + [np.empty(0)])
+    mark_symbol = np.repeat(np.array(list(marks), dtype=object), [len(ms) for ms, _ in marks.values()])
+    order = np.argsort(mark_ms, kind='stable')
+    mark_ms, mark_price, mark_symbol = mark_ms[order].tolist(), mark_price[order].tolist(), mark_symbol[order].tolist()
+
+    quantity = np.zeros(n, dtype=np.int64)
+    skip_reason = np.full(n, None, dtype=object)
+    size = 2 * n + len(mark_ms)
+    equity_ms = np.empty(size, dtype=np.int64)
+    equity = np.empty(size, dtype=np.float64)
+    open_positions = np.empty(size, dtype=np.int64)
+    events = 0
+
+    cash = float(capital)
+    # Cash plus every open position at its latest mark, which is its entry price until the first
+    marked = float(capital)
+    last_price = entry_price.copy()
+    fraction = position_pct / 100
+    held = {}
+    heap = []
+    next_mark = 0
+
+    def settle(until_ms):
+        """Apply the exits and marks due at or before until_ms, in time order"""
+        nonlocal cash, marked, events, next_mark
+        while True:
+            exit_due = heap[0][0] if heap else None
+            mark_due = mark_ms[next_mark] if next_mark < len(mark_ms) else None
+            if exit_due is not None and exit_due <= until_ms and (mark_due is None or exit_due <= mark_due):
+                event_ms, i = heapq.heappop(heap)
+                cash += quantity[i] * exit_price[i]
+                marked += quantity[i] * (exit_price[i] - last_price[i])
+                if symbols is not None:
+                    del held[symbols[i]]
+            elif mark_due is not None and mark_due <= until_ms:
+                event_ms, i = mark_due, held.get(mark_symbol[next_mark])
+                price = mark_price[next_mark]
+                next_mark += 1
+                if i is None:
+                    continue
+                marked += quantity[i] * (price - last_price[i])
+                last_price[i] = price
+            else:
+                return
+            equity_ms[events], equity[events], open_positions[events] = event_ms, marked, len(heap)
+            events += 1
+
+    for i in np.argsort(entry_ms, kind='stable').tolist():
+        settle(entry_ms[i])
+        if len(heap) >= max_positions:
+            skip_reason[i] = SKIP_MAX_POSITIONS
+            continue
+        if symbols is not None and symbols[i] in held:
+            skip_reason[i] = SKIP_SYMBOL_OPEN
+            continue
+        shares = int(min(marked * fraction, cash) // entry_price[i]) if entry_price[i] > 0 else 0
+        if shares < 1:
+            skip_reason[i] = SKIP_INSUFFICIENT_CASH
+            continue
+        quantity[i] = shares
+        cash -= shares * entry_price[i]
+        if symbols is not None:
+            held[symbols[i]] = i
+        heapq.heappush(heap, (int(exit_ms[i]), i))
+        equity_ms[events], equity[events], open_positions[events] = entry_ms[i], marked, len(heap)
+        events += 1
+    settle(np.iinfo(np.int64).max)
+
+    return PortfolioResult(capital, quantity, skip_reason, equity_ms[:events], equity[:events],
+                           open_positions[:events])
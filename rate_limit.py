@@ -0,0 +1,63 @@
+"""
+Token-bucket rate limiting for Angel One SmartAPI requests.
+
+SmartAPI enforces several limits at once (per second, per minute, per
+hour), so a RateLimiter holds one bucket per limit and a request only goes
+out once every bucket has a token for it.
+"""
+
+import threading
+import time
+
+# Published SmartAPI limits for getCandleData as (requests, per seconds)
+SMARTAPI_HISTORICAL_LIMITS = [(3, 1), (180, 60), (5000, 60 * 60)]
+
+
+class TokenBucket:
+    def __init__(self, requests, per_seconds, clock=time.monotonic, sleep=time.sleep):
+        self.rate = requests / per_seconds
+        self.capacity = requests
+        self.tokens = float(requests)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until the bucket has enough tokens, then take them"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class RateLimiter:
+    def __init__(self, limits=SMARTAPI_HISTORICAL_LIMITS, clock=time.monotonic, sleep=time.sleep):
+        self.buckets = [TokenBucket(requests, per_seconds, clock=clock, sleep=sleep)
+                        for requests, per_seconds in limits]
+
+    def acquire(self):
+        """Block until a request is allowed by every limit"""
+        for bucket in self.buckets:
+            bucket.acquire()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key, limits=SMARTAPI_HISTORICAL_LIMITS):
+    """Process-wide limiter per API key, shared by every client using that key"""
+    with _limiters_lock:
+        if api_key not in _limiters:
+            _limiters[api_key] = RateLimiter(limits)
+        return _limiters[api_key]
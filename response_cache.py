@@ -0,0 +1,82 @@
+"""
+In-memory LRU cache of finished /backtest response bodies.
+
+The same trade set is often backtested with the same parameters again
+(shared links, page reloads). Entries hold the serialized JSON payload,
+Plotly figures included, so a hit returns it without running the engine,
+the metrics or the chart serialization. The cache is bounded by the total
+size of the stored payloads and entries expire after a TTL, since results
+for trades near today can change once more candles exist.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+DEFAULT_TTL = 15 * 60
+
+
+def payload_size(payload):
+    """Size of a payload in bytes; str payloads count as their UTF-8 encoding"""
+    return len(payload.encode()) if isinstance(payload, str) else len(payload)
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key):
+        """Cached payload for key, or None; counts a hit or a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, payload):
+        """Store a payload (bytes or str), evicting least recently used entries to stay under max_bytes"""
+        size = payload_size(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (payload, self.clock() + self.ttl, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,136 @@
+"""
+Authenticated SmartAPI session cache shared across requests and workers.
+
+A loginByPassword call costs a network round trip and a fresh TOTP, and
+SmartAPI locks accounts that log in too often, so the jwt/refresh/feed
+tokens from a login are kept in a small SQLite file keyed by client_id.
+Every AngelOneAPI instance (in any gunicorn worker) reuses them until they
+are close to expiry. Entries also store a hash of the credentials that
+produced them, so a request with a different password or API key never
+picks up someone else's session.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# SmartAPI sessions end at midnight IST; use this when the jwt has no exp claim
+DEFAULT_SESSION_TTL = 6 * 60 * 60
+
+# Refresh this long before expiry so in-flight backtests never see a dead token
+REFRESH_MARGIN = 10 * 60
+
+
+def credential_hash(api_key, client_id, password, totp_secret):
+    """Stable fingerprint of the credentials behind a session"""
+    material = '\0'.join(str(value or '') for value in (api_key, client_id, password, totp_secret))
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def token_expiry(jwt_token, now=None):
+    """Expiry (epoch seconds) from a jwt's exp claim, or now + DEFAULT_SESSION_TTL"""
+    now = time.time() if now is None else now
+    try:
+        payload = jwt_token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return now + DEFAULT_SESSION_TTL
+
+
+class SessionCache:
+    def __init__(self, cache_dir='cache', clock=time.time):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 'sessions.sqlite3')
+        self.clock = clock
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    client_id TEXT PRIMARY KEY,
+                    credential_hash TEXT NOT NULL,
+                    jwt_token TEXT NOT NULL,
+                    refresh_token TEXT,
+                    feed_token TEXT,
+                    expires_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        # Tokens are bearer credentials; keep the file private to this user
+        try:
+            os.chmod(self.db_path, 0o600)
+        except OSError:
+            pass
+
+    def lock(self, client_id):
+        """Per-client lock so concurrent requests in one worker log in only once"""
+        with self._locks_lock:
+            return self._locks.setdefault(client_id, threading.Lock())
+
+    def get(self, client_id, credentials):
+        """Cached session dict for client_id if it was created with these credentials"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT credential_hash, jwt_token, refresh_token, feed_token, expires_at "
+                "FROM sessions WHERE client_id = ?", (client_id,)
+            ).fetchone()
+        if row is None or row[0] != credentials:
+            return None
+        if row[4] <= self.clock():
+            return None
+        return {
+            'jwt_token': row[1],
+            'refresh_token': row[2],
+            'feed_token': row[3],
+            'expires_at': row[4]
+        }
+
+    def needs_refresh(self, expires_at):
+        return expires_at - self.clock() <= REFRESH_MARGIN
+
+    def store(self, client_id, credentials, jwt_token, refresh_token=None, feed_token=None):
+        """Save (or replace) the session for client_id and return it"""
+        now = self.clock()
+        session = {
+            'jwt_token': jwt_token,
+            'refresh_token': refresh_token,
+            'feed_token': feed_token,
+            'expires_at': token_expiry(jwt_token, now=now)
+        }
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(client_id, credential_hash, jwt_token, refresh_token, feed_token, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (client_id, credentials, jwt_token, refresh_token, feed_token, session['expires_at'], now)
+            )
+        return session
+
+    def invalidate(self, client_id, jwt_token=None):
+        """Drop the cached session, optionally only if it still holds jwt_token"""
+        with self._connect() as conn:
+            if jwt_token is None:
+                conn.execute("DELETE FROM sessions WHERE client_id = ?", (client_id,))
+            else:
+                conn.execute("DELETE FROM sessions WHERE client_id = ? AND jwt_token = ?",
+                             (client_id, jwt_token))
@@ -0,0 +1,169 @@
+"""
+Timing spans and counters for the backtest pipeline, in Prometheus text format.
+
+span(stage) times a block and records it in the stage_duration_seconds
+histogram. Inside collect_timings() the same spans are also summed per
+stage for the current request (e.g. for a Server-Timing header); bind()
+carries that per-request collector into worker threads. Counters are
+plain labelled totals. Everything lives in this process: with several
+gunicorn workers each one serves its own /metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# name -> (Prometheus type, help text)
+METRICS = {
+    'stage_duration_seconds': ('histogram', 'Time spent in each pipeline stage'),
+    'smartapi_requests_total': ('counter', 'SmartAPI HTTP requests by endpoint and status'),
+    'candle_cache_lookups_total': ('counter', 'Candle cache lookups by result (hit: nothing to fetch)'),
+    'backtest_trades_total': ('counter', 'Trades backtested, by whether they were evaluated or memoized'),
+    'backtest_trades_skipped_total': ('counter', 'Trades left out of backtest results, by reason'),
+    'backtest_exits_resolved_total': ('counter', 'Exits on bars touching both levels, by outcome from finer candles'),
+    'uploads_total': ('counter', 'Trade CSV uploads by result'),
+    'response_cache_requests_total': ('counter', 'Backtest response cache lookups by result'),
+    'response_cache_evictions_total': ('counter', 'Backtest responses evicted from the response cache'),
+    'response_cache_bytes': ('gauge', 'Size of the cached backtest responses')
+}
+
+_timings = ContextVar('timings', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Registry:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._values = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge, or a counter whose total is kept elsewhere"""
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._values.get((name, _label_key(labels)), 0)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(histogram) for key, histogram in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in values} | {name for name, _ in histograms}):
+            metric_type, help_text = METRICS.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Timings:
+    """Seconds and span count per stage for one request; shared by the threads working on it"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def to_dict(self):
+        """{stage: milliseconds}; stages run in several threads add up to more than wall time"""
+        with self._lock:
+            return {stage: round(total * 1000, 1) for stage, (total, _) in self.stages.items()}
+
+    def server_timing(self):
+        """Server-Timing header value"""
+        return ', '.join(f"{stage};dur={ms}" for stage, ms in self.to_dict().items())
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('stage_duration_seconds', elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+@contextmanager
+def collect_timings():
+    """Collect this request's spans into a Timings"""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def bind(func):
+    """Wrap func so spans it records in another thread count towards the caller's timings"""
+    timings = _timings.get()
+
+    def run(*args, **kwargs):
+        token = _timings.set(timings)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _timings.reset(token)
+    return run
+
+
+def count(name, amount=1, **labels):
+    registry.count(name, amount, **labels)
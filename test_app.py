@@ -1,12 +1,16 @@
-<<<<<<< HEAD
 #!/usr/bin/env python3
 """
 Simple test script to verify the application works correctly.
 Run this before deploying to ensure everything is working.
 """
 
+import json
 import os
 import sys
+import tempfile
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
@@ -83,122 +87,1387 @@ def test_flask_app():
         print(f"❌ Flask app error: {e}")
         return False
 
-def main():
-    """Run all tests"""
-    print("🧪 Running Chartink Backtesting Dashboard Tests\n")
-    
-    tests = [
-        ("Import Test", test_imports),
-        ("File Structure Test", test_file_structure),
-        ("CSV Parsing Test", test_csv_parsing),
-        ("Flask App Test", test_flask_app)
-    ]
-    
-    passed = 0
-    total = len(tests)
-    
-    for test_name, test_func in tests:
-        print(f"Running {test_name}...")
-        if test_func():
-            passed += 1
-        print()
-    
-    print(f"📊 Test Results: {passed}/{total} tests passed")
-    
-    if passed == total:
-        print("🎉 All tests passed! Your app is ready for deployment.")
-        return True
-    else:
-        print("⚠️  Some tests failed. Please fix the issues before deploying.")
-        return False
+class FakeAngelOneAPI:
+    """Stand-in for AngelOneAPI that serves hourly candles and counts calls"""
+    def __init__(self):
+        self.symbol_tokens = {'RELIANCE': '2885', 'TCS': '11536'}
+        self.calls = []
 
-if __name__ == "__main__":
-    success = main()
-    sys.exit(0 if success else 1)
-=======
-#!/usr/bin/env python3
-"""
-Simple test script to verify the application works correctly.
-Run this before deploying to ensure everything is working.
-"""
+    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
+        self.calls.append((symbol, from_date, to_date))
+        timestamps = pd.date_range(f"{from_date} 09:15", f"{to_date} 15:15", freq='h')
+        timestamps = timestamps[(timestamps.dayofweek < 5) & (timestamps.hour >= 9) & (timestamps.hour <= 15)]
+        prices = 100 + pd.Series(range(len(timestamps)), dtype=float) * 0.5
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'open': prices.values,
+            'high': prices.values + 1,
+            'low': prices.values - 1,
+            'close': prices.values,
+            'volume': 1000
+        })
 
-import os
-import sys
-import pandas as pd
-from datetime import datetime, timedelta
+def test_candle_cache():
+    """Test that cached date ranges are served without refetching"""
+    from candle_cache import CandleCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CandleCache(cache_dir)
+        api = FakeAngelOneAPI()
+
+        first = cache.get_historical_data(api, 'RELIANCE', from_date='2024-01-01', to_date='2024-01-10')
+        assert api.calls == [('RELIANCE', '2024-01-01', '2024-01-10')]
+        assert first['timestamp'].is_monotonic_increasing
+
+        # Fully covered range: no API call
+        second = cache.get_historical_data(api, 'RELIANCE', from_date='2024-01-02', to_date='2024-01-09')
+        assert len(api.calls) == 1
+        assert len(second) < len(first)
+
+        # Overlapping range: only the missing tail is fetched and merged
+        third = cache.get_historical_data(api, 'RELIANCE', from_date='2024-01-05', to_date='2024-01-15')
+        assert api.calls[-1] == ('RELIANCE', '2024-01-11', '2024-01-15')
+        assert not third['timestamp'].duplicated().any()
+        assert third['timestamp'].iloc[-1] == pd.Timestamp('2024-01-15 15:15')
+
+    print("✅ Candle cache test passed")
+
+def test_mapped_candle_store():
+    """Test that backtests read memory-mapped cache snapshots with unchanged results"""
+    from app import BacktestEngine, as_candle_arrays
+    from candle_cache import CandleCache, MappedCandles, SNAPSHOT_GRACE_SECONDS, SUPERSEDED_MARKER
+
+    rng = np.random.default_rng(13)
+    days = pd.bdate_range('2024-01-02', periods=40)
+    trades = pd.DataFrame({
+        'entry_datetime': [day + pd.Timedelta(minutes=int(m))
+                           for day, m in zip(rng.choice(days, 60), rng.integers(9 * 60 + 30, 15 * 60, 60))],
+        'symbol': rng.choice(['RELIANCE', 'TCS'], 60)
+    })
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CandleCache(cache_dir)
+        uncached = BacktestEngine(WaveAngelOneAPI()).run_backtest(trades, 2, 4, 3)
+        api = WaveAngelOneAPI()
+        mapped = BacktestEngine(api, cache).run_backtest(trades, 2, 4, 3)
+        fetches = len(api.calls)
+        parallel = BacktestEngine(api, cache, workers=2, min_shard_bars=0).run_backtest(trades, 2, 4, 3)
+        assert len(uncached) > 40
+        pd.testing.assert_frame_equal(uncached, mapped)
+        pd.testing.assert_frame_equal(uncached, parallel)
+        assert len(api.calls) == fetches
+
+        # Candles are read-only views of the snapshot files
+        windows = [('2024-01-02', '2024-01-20')]
+        handle = cache.get_mapped_candles(api, 'TCS', windows)
+        assert isinstance(handle, MappedCandles)
+        candles = as_candle_arrays(handle)
+        assert isinstance(candles.close, np.memmap) and not candles.close.flags.writeable
+        assert (np.diff(candles.timestamps) > 0).all()
+        assert pd.Timestamp(int(candles.timestamps[-1]), unit='ms') < pd.Timestamp('2024-01-21')
+
+        # Storing new candles publishes a new snapshot; the old one stays readable for the
+        # grace period after it was replaced, however long ago it was built
+        long_ago = time.time() - 2 * SNAPSHOT_GRACE_SECONDS
+        os.utime(handle.directory, (long_ago, long_ago))
+        cache.get_mapped_candles(api, 'TCS', [('2024-05-01', '2024-05-03')])
+        assert cache.snapshot('NSE', '11536', 'ONE_MINUTE') != handle.directory
+        assert len(as_candle_arrays(handle).close) == len(candles.close)
+        cache.get_mapped_candles(api, 'TCS', [('2024-06-03', '2024-06-04')])
+        assert len(as_candle_arrays(handle).close) == len(candles.close)
+
+        # Once superseded for longer than that, the next new snapshot removes it
+        marker = os.path.join(handle.directory, SUPERSEDED_MARKER)
+        os.utime(marker, (long_ago, long_ago))
+        cache.get_mapped_candles(api, 'TCS', [('2024-07-01', '2024-07-02')])
+        assert not os.path.exists(handle.directory)
+        assert len(os.listdir(os.path.dirname(handle.directory))) == 3
+
+    print("✅ Mapped candle store test passed")
+
+def test_fetch_planning():
+    """Test that trades are grouped into one merged fetch per symbol"""
+    from app import BacktestEngine, plan_fetch_windows
+
+    # Overlapping windows collapse into one request
+    entries = pd.to_datetime(['2024-01-03 10:15', '2024-01-08 11:15'])
+    assert plan_fetch_windows(entries, 10) == [('2023-12-29', '2024-01-23')]
+
+    # Disjoint windows stay separate unless one request can cover both
+    entries = pd.to_datetime(['2024-01-10 10:15', '2024-02-20 10:15'])
+    assert plan_fetch_windows(entries, 10) == [('2024-01-05', '2024-01-25'), ('2024-02-15', '2024-03-06')]
+    assert plan_fetch_windows(entries, 10, interval='ONE_HOUR') == [('2024-01-05', '2024-03-06')]
+
+    # Long spans are split at the ONE_MINUTE request limit
+    entries = pd.to_datetime(['2024-01-10 10:15'])
+    assert plan_fetch_windows(entries, 40) == [('2024-01-05', '2024-02-03'), ('2024-02-04', '2024-02-24')]
+
+    api = FakeAngelOneAPI()
+    trades = pd.DataFrame({
+        'entry_datetime': pd.to_datetime(['2024-01-03 10:15', '2024-01-03 11:15', '2024-01-08 11:15']),
+        'symbol': ['RELIANCE', 'TCS', 'RELIANCE']
+    })
+    results = BacktestEngine(api).run_backtest(trades, 5, 10, 3)
+    assert sorted(call[0] for call in api.calls) == ['RELIANCE', 'TCS']
+    assert list(results['symbol']) == ['RELIANCE', 'TCS', 'RELIANCE']
+
+    print("✅ Fetch planning test passed")
+
+def reference_find_exit(hist_data, entry_datetime, entry_price, sl_price, target_price, exit_days):
+    """Original row-by-row BacktestEngine._find_exit, kept as the parity baseline"""
+    post_entry_data = hist_data[hist_data['timestamp'] > entry_datetime].copy()
+    if post_entry_data.empty:
+        return None
+
+    for _, row in post_entry_data.iterrows():
+        low_price = float(row['low']) if not pd.isna(row['low']) else 0
+        high_price = float(row['high']) if not pd.isna(row['high']) else 0
+        close_price = float(row['close']) if not pd.isna(row['close']) else 0
+        if low_price == 0 or high_price == 0 or close_price == 0:
+            continue
+        if low_price <= sl_price:
+            return {'exit_datetime': row['timestamp'], 'exit_price': sl_price, 'exit_reason': 'Stop Loss'}
+        if high_price >= target_price:
+            return {'exit_datetime': row['timestamp'], 'exit_price': target_price, 'exit_reason': 'Target'}
+
+    exit_date = entry_datetime + timedelta(days=exit_days)
+    exit_data = post_entry_data[post_entry_data['timestamp'] >= exit_date]
+    if not exit_data.empty:
+        exit_row = exit_data.iloc[0]
+        exit_price = float(exit_row['close']) if not pd.isna(exit_row['close']) else 0
+        if exit_price == 0:
+            return None
+        return {
+            'exit_datetime': exit_row['timestamp'],
+            'exit_price': exit_price,
+            'exit_reason': f'Time Exit ({exit_days} days)'
+        }
+    return None
+
+def reference_get_entry_price(hist_data, entry_datetime):
+    """Original mask-and-idxmin BacktestEngine._get_entry_price, kept as the parity baseline"""
+    nearby_data = hist_data[(hist_data['timestamp'] >= entry_datetime - timedelta(hours=2))
+                            & (hist_data['timestamp'] <= entry_datetime + timedelta(hours=2))].copy()
+    if nearby_data.empty:
+        return None
+    nearby_data['time_diff'] = abs(nearby_data['timestamp'] - entry_datetime)
+    close_price = nearby_data.loc[nearby_data['time_diff'].idxmin(), 'close']
+    if pd.isna(close_price) or close_price == 0:
+        return None
+    return float(close_price)
+
+def test_entry_price_lookup():
+    """Test that the binary-search entry lookup matches the original mask-based one"""
+    from app import BacktestEngine, candle_arrays
+
+    engine = BacktestEngine(api_client=None)
+    rng = np.random.default_rng(25)
+    compared = 0
+    for _ in range(30):
+        hist_data = make_random_candles(rng, int(rng.integers(1, 300)))
+        candles = candle_arrays(hist_data)
+        first, last = hist_data['timestamp'].iloc[0], hist_data['timestamp'].iloc[-1]
+        span_minutes = int((last - first).total_seconds() // 60)
+        # On and between bars, exactly 2h away from one, and well outside the data
+        entries = [first + pd.Timedelta(minutes=int(m)) for m in rng.integers(-300, span_minutes + 300, size=20)]
+        entries += [first - pd.Timedelta(hours=2), last + pd.Timedelta(hours=2), last + pd.Timedelta(minutes=121)]
+        for entry_datetime in entries:
+            expected = reference_get_entry_price(hist_data, entry_datetime)
+            assert engine._get_entry_price(candles, entry_datetime) == expected
+            assert engine._get_entry_price(hist_data, entry_datetime) == expected
+            compared += expected is not None
+    assert compared > 200
+
+    # Equidistant bars: the earlier one wins, as with idxmin
+    tie = pd.DataFrame({'timestamp': pd.to_datetime(['2024-01-01 10:00', '2024-01-01 11:00']),
+                        'open': [1.0, 2.0], 'high': [1.0, 2.0], 'low': [1.0, 2.0], 'close': [1.0, 2.0], 'volume': 1})
+    assert engine._get_entry_price(candle_arrays(tie), pd.Timestamp('2024-01-01 10:30')) == 1.0
+
+    print("✅ Entry price lookup test passed")
+
+def test_entry_bar_look_ahead():
+    """Test that daily entries never take a later bar, so they never exit on their entry bar"""
+    from app import BacktestEngine, candle_arrays
+
+    days = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04']),
+        'open': [100.0, 100.0, 150.0, 100.0], 'high': [100.0, 100.0, 160.0, 100.0],
+        'low': [100.0, 100.0, 97.0, 100.0], 'close': [100.0, 100.0, 150.0, 100.0], 'volume': 1
+    })
+    engine = BacktestEngine(api_client=None, interval='ONE_DAY')
+    # 14:00 is nearer the Jan 3 bar, but only the Jan 2 bar has started
+    entries = pd.Series(pd.to_datetime(['2024-01-02 14:00', '2023-12-31 20:00']))
+    results = engine.evaluate_batch('TEST', candle_arrays(days), entries, 5, 10, 5)
+    assert len(results) == 1 and engine.skipped['no_entry_price'] == 1
+    trade = results.iloc[0]
+    assert trade['entry_price'] == 100.0
+    assert trade['exit_datetime'] == pd.Timestamp('2024-01-03') and trade['exit_reason'] == 'Target'
+    assert engine._get_entry_price(days, pd.Timestamp('2024-01-02 14:00')) == 100.0
+    assert engine._get_entry_price(days, pd.Timestamp('2024-01-03')) == 150.0
+    paths = engine._path_statistics('TEST', candle_arrays(days), entries[:1], np.array([5.0]), np.array([10.0]), [5])
+    assert paths['entry_price'].tolist() == [100.0]
+    assert pd.to_datetime(paths['target_ms'][0, 0], unit='ms') == pd.Timestamp('2024-01-03')
+
+    # Intraday entries keep the original rules: the nearest bar, even a later one, and exits from the
+    # first bar after the entry, which may be that same bar
+    hours = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2024-01-02 09:15', '2024-01-02 10:15', '2024-01-02 11:15']),
+        'open': 100.0, 'high': [100.0, 100.0, 120.0], 'low': [100.0, 90.0, 100.0],
+        'close': [100.0, 100.0, 100.0], 'volume': 1
+    })
+    intraday = BacktestEngine(api_client=None)
+    results = intraday.evaluate_batch('TEST', candle_arrays(hours), pd.Series([pd.Timestamp('2024-01-02 10:00')]),
+                                      5, 10, 5)
+    assert results['exit_datetime'].tolist() == [pd.Timestamp('2024-01-02 10:15')]
+    assert results['exit_reason'].tolist() == ['Stop Loss']
+    expected = reference_find_exit(hours, pd.Timestamp('2024-01-02 10:00'), 100.0, 95.0, 110.0, 5)
+    assert expected['exit_datetime'] == pd.Timestamp('2024-01-02 10:15') and expected['exit_reason'] == 'Stop Loss'
+
+    print("✅ Entry bar look-ahead test passed")
+
+def make_random_candles(rng, bars, start='2024-01-01 09:15'):
+    """Random-walk candles with a sprinkling of zero and NaN prices"""
+    gaps = rng.integers(1, 90, size=bars)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(gaps.cumsum(), unit='min')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.004, size=bars)))
+    high = close * (1 + rng.uniform(0, 0.01, size=bars))
+    low = close * (1 - rng.uniform(0, 0.01, size=bars))
+    for column in (low, high, close):
+        column[rng.random(bars) < 0.02] = 0.0
+        column[rng.random(bars) < 0.02] = np.nan
+    return pd.DataFrame({'timestamp': timestamps, 'open': close, 'high': high,
+                         'low': low, 'close': close, 'volume': 1000})
+
+def test_find_exit_parity():
+    """Test that the vectorized exit kernel matches the row-by-row implementation"""
+    from app import BacktestEngine
+
+    engine = BacktestEngine(api_client=None)
+    rng = np.random.default_rng(42)
+    compared = 0
+    for _ in range(40):
+        hist_data = make_random_candles(rng, int(rng.integers(1, 400)))
+        for _ in range(10):
+            # Entries both on and between bars, including past the last bar
+            first, last = hist_data['timestamp'].iloc[0], hist_data['timestamp'].iloc[-1]
+            span_minutes = int((last - first).total_seconds() // 60)
+            entry_datetime = first + pd.Timedelta(minutes=int(rng.integers(-60, span_minutes + 60)))
+            if rng.random() < 0.3:
+                entry_datetime = hist_data['timestamp'].iloc[int(rng.integers(len(hist_data)))]
+            entry_price = 100.0
+            sl_price = entry_price * (1 - rng.uniform(0, 8) / 100)
+            target_price = entry_price * (1 + rng.uniform(0, 15) / 100)
+            exit_days = int(rng.integers(0, 6))
+
+            expected = reference_find_exit(hist_data, entry_datetime, entry_price, sl_price, target_price, exit_days)
+            actual = engine._find_exit(hist_data, entry_datetime, entry_price, sl_price, target_price, exit_days)
+            assert expected == actual, (entry_datetime, expected, actual)
+            compared += 1
+
+    # A single bar touching both levels resolves as a stop loss
+    both = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2024-01-01 09:15', '2024-01-01 09:16']),
+        'open': [100.0, 100.0], 'high': [100.0, 120.0], 'low': [100.0, 80.0],
+        'close': [100.0, 100.0], 'volume': [1, 1]
+    })
+    entry = pd.Timestamp('2024-01-01 09:15')
+    assert engine._find_exit(both, entry, 100.0, 95.0, 110.0, 1)['exit_reason'] == 'Stop Loss'
+    assert reference_find_exit(both, entry, 100.0, 95.0, 110.0, 1)['exit_reason'] == 'Stop Loss'
+
+    print(f"✅ Exit kernel parity test passed ({compared} trades)")
+
+def test_batch_parity():
+    """Test that batched evaluation matches evaluating trades one at a time"""
+    from app import BacktestEngine, candle_arrays, trade_window
+
+    engine = BacktestEngine(api_client=None)
+    rng = np.random.default_rng(7)
+    for _ in range(20):
+        hist_data = make_random_candles(rng, int(rng.integers(50, 3000)))
+        first, last = hist_data['timestamp'].iloc[0], hist_data['timestamp'].iloc[-1]
+        span_minutes = int((last - first).total_seconds() // 60)
+        entries = pd.Series(sorted(
+            first + pd.Timedelta(minutes=int(m)) for m in rng.integers(-200, span_minutes + 200, size=25)
+        ))
+        stop_loss, target, exit_days = rng.uniform(0.5, 6), rng.uniform(0.5, 12), int(rng.integers(1, 6))
+
+        expected = []
+        for position, entry_datetime in entries.items():
+            window_from, window_to = trade_window(entry_datetime, exit_days)
+            window = hist_data[(hist_data['timestamp'] >= window_from)
+                               & (hist_data['timestamp'] < window_to + timedelta(days=1))]
+            entry_price = engine._get_entry_price(window, entry_datetime)
+            if entry_price is None:
+                continue
+            sl_price = entry_price * (1 - stop_loss / 100)
+            target_price = entry_price * (1 + target / 100)
+            exit_result = engine._find_exit(window, entry_datetime, entry_price, sl_price, target_price, exit_days)
+            if exit_result:
+                expected.append((position, entry_price, exit_result['exit_datetime'],
+                                 exit_result['exit_price'], exit_result['exit_reason']))
+
+        batch = engine.evaluate_batch('TEST', candle_arrays(hist_data), entries, stop_loss, target, exit_days)
+        actual = list(zip(batch.index, batch['entry_price'], batch['exit_datetime'],
+                          batch['exit_price'], batch['exit_reason']))
+        assert actual == expected
+
+    print("✅ Batch evaluation parity test passed")
+
+class WaveAngelOneAPI(FakeAngelOneAPI):
+    """Fake API whose 15-minute candles are a deterministic function of time"""
+    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
+        self.calls.append((symbol, from_date, to_date))
+        timestamps = pd.date_range(f"{from_date} 09:15", f"{to_date} 15:30", freq='15min')
+        timestamps = timestamps[(timestamps.dayofweek < 5) & (timestamps.hour >= 9) & (timestamps.hour <= 15)]
+        minutes = (timestamps - pd.Timestamp('2024-01-01')).total_seconds().values / 60
+        close = 100 + 8 * np.sin(minutes / 700) + 3 * np.sin(minutes / 97)
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'open': close,
+            'high': close + np.abs(np.sin(minutes / 13)),
+            'low': close - np.abs(np.cos(minutes / 17)),
+            'close': close,
+            'volume': 1000
+        })
+
+def test_incremental_backtest():
+    """Test that re-runs only evaluate trades without a memoized result"""
+    from app import BacktestEngine
+    from candle_cache import CandleCache
+
+    rng = np.random.default_rng(17)
+    days = pd.bdate_range('2024-02-01', periods=30)
+    trades = pd.DataFrame({
+        'entry_datetime': [day + pd.Timedelta(minutes=int(m))
+                           for day, m in zip(rng.choice(days, 50), rng.integers(9 * 60 + 30, 15 * 60, 50))],
+        'symbol': rng.choice(['RELIANCE', 'TCS'], 50)
+    })
+    new_trades = pd.DataFrame({
+        'entry_datetime': pd.to_datetime(['2024-03-18 10:15', '2024-03-19 11:45', '2024-03-19 13:00']),
+        'symbol': ['TCS', 'RELIANCE', 'RELIANCE']
+    })
+    grown = pd.concat([trades, new_trades], ignore_index=True)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine = BacktestEngine(WaveAngelOneAPI(), CandleCache(cache_dir))
+        evaluated = []
+        evaluate_batch = engine.evaluate_batch
+        engine.evaluate_batch = lambda symbol, candles, entries, *args: (
+            evaluated.extend(entries.index), evaluate_batch(symbol, candles, entries, *args))[1]
+
+        first = engine.run_backtest(trades, 2, 4, 3)
+        pd.testing.assert_frame_equal(first, BacktestEngine(WaveAngelOneAPI()).run_backtest(trades, 2, 4, 3))
+        assert len(evaluated) == 50
+
+        # Appending a day's signals evaluates only the new trades
+        evaluated.clear()
+        progress = []
+        grown_results = engine.run_backtest(grown, 2, 4, 3, progress_callback=lambda *args: progress.append(args[:3]))
+        assert sorted(evaluated) == [50, 51, 52]
+        assert progress[0] == (50, 53, None)
+        assert progress[-1] == (53, 53, None)
+        pd.testing.assert_frame_equal(grown_results, BacktestEngine(WaveAngelOneAPI()).run_backtest(grown, 2, 4, 3))
+
+        # Other parameters are a different key
+        evaluated.clear()
+        engine.run_backtest(grown, 2, 4, 5)
+        assert len(evaluated) == 53
+
+        # Windows that reach into today are never memoized
+        recent = pd.DataFrame({'entry_datetime': [pd.Timestamp.now().normalize() - pd.Timedelta(days=1)],
+                               'symbol': ['TCS']})
+        engine.run_backtest(recent, 2, 4, 3)
+        evaluated.clear()
+        engine.run_backtest(recent, 2, 4, 3)
+        assert evaluated == [0]
+
+    # Trades whose evaluation raised are reported, not memoized as having no exit
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine = BacktestEngine(WaveAngelOneAPI(), CandleCache(cache_dir))
+        evaluate_batch = engine.evaluate_batch
+        failures = ['RELIANCE']
+
+        def flaky_evaluate_batch(symbol, *args):
+            if symbol in failures:
+                failures.remove(symbol)
+                raise RuntimeError("Evaluation failed")
+            return evaluate_batch(symbol, *args)
+
+        engine.evaluate_batch = flaky_evaluate_batch
+        failed = engine.run_backtest(trades, 2, 4, 3)
+        reliance = set(trades.index[trades['symbol'] == 'RELIANCE'])
+        assert engine.skipped['error'] == len(reliance) and engine.errored == reliance
+        assert set(failed['symbol']) == {'TCS'}
+        rerun = engine.run_backtest(trades, 2, 4, 3)
+        assert not engine.skipped['error'] and not engine.errored
+        pd.testing.assert_frame_equal(rerun, first)
+
+    print("✅ Incremental backtest test passed")
+
+class MinuteAngelOneAPI(FakeAngelOneAPI):
+    """Fake API serving wave-shaped minute candles, and coarser intervals aggregated from them"""
+    def __init__(self):
+        super().__init__()
+        self.intervals = []
+
+    def get_historical_data(self, symbol, interval="ONE_MINUTE", from_date=None, to_date=None):
+        self.calls.append((symbol, from_date, to_date))
+        self.intervals.append(interval)
+        timestamps = pd.date_range(f"{from_date} 09:15", f"{to_date} 15:29", freq='min')
+        minute_of_day = timestamps.hour * 60 + timestamps.minute
+        timestamps = timestamps[(timestamps.dayofweek < 5) & (minute_of_day >= 9 * 60 + 15)
+                                & (minute_of_day < 15 * 60 + 30)]
+        minutes = (timestamps - pd.Timestamp('2024-01-01')).total_seconds().values / 60
+        close = 100 + 8 * np.sin(minutes / 700) + 3 * np.sin(minutes / 97) + 0.4 * np.sin(minutes / 3)
+        bars = pd.DataFrame({'timestamp': timestamps, 'open': close, 'high': close + 0.05, 'low': close - 0.05,
+                             'close': close, 'volume': 1000})
+        if interval == 'ONE_MINUTE':
+            return bars
+        # Bars start at 09:15 like SmartAPI's
+        bars = bars.set_index('timestamp').resample('60min', offset='15min').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
+        return bars.dropna().reset_index()
+
+def test_multi_resolution_exits():
+    """Test that bars touching both levels are re-decided from minute candles"""
+    from app import BacktestEngine
+    from candle_cache import CandleCache
+
+    rng = np.random.default_rng(23)
+    days = pd.bdate_range('2024-03-01', periods=20)
+    trades = pd.DataFrame({
+        'entry_datetime': [day + pd.Timedelta(hours=int(h), minutes=15)
+                           for day, h in zip(rng.choice(days, 40), rng.integers(9, 15, 40))],
+        'symbol': rng.choice(['RELIANCE', 'TCS'], 40)
+    })
+
+    coarse = BacktestEngine(MinuteAngelOneAPI(), interval='ONE_HOUR').run_backtest(trades, 0.5, 0.5, 3)
+    api = MinuteAngelOneAPI()
+    resolved = BacktestEngine(api, interval='ONE_HOUR', resolve_interval='ONE_MINUTE').run_backtest(
+        trades, 0.5, 0.5, 3)
+    assert len(resolved) == len(coarse) > 30
+
+    hourly = MinuteAngelOneAPI().get_historical_data('RELIANCE', 'ONE_HOUR', '2024-02-20', '2024-04-10')
+    hourly = hourly.set_index('timestamp')
+    minutes = MinuteAngelOneAPI().get_historical_data('RELIANCE', 'ONE_MINUTE', '2024-02-20', '2024-04-10')
+    minutes = minutes.set_index('timestamp')
+    ambiguous = (coarse['exit_reason'] == 'Stop Loss') & (
+        hourly['high'].reindex(coarse['exit_datetime']).to_numpy() >= coarse['target'].to_numpy())
+    assert ambiguous.sum() >= 3
+    # Everything else is left exactly as the coarse run decided it
+    pd.testing.assert_frame_equal(resolved[~ambiguous], coarse[~ambiguous])
+
+    # Every symbol's candles are the same function of time, so RELIANCE's minutes serve as the truth
+    for (_, before), (_, after) in zip(coarse[ambiguous].iterrows(), resolved[ambiguous].iterrows()):
+        bar = minutes.loc[before['exit_datetime']:before['exit_datetime'] + pd.Timedelta(minutes=59)]
+        touched = (bar['low'] <= before['stop_loss']) | (bar['high'] >= before['target'])
+        first = touched.idxmax()
+        expected = 'Stop Loss' if bar.loc[first, 'low'] <= before['stop_loss'] else 'Target'
+        assert after['exit_reason'] == expected and after['exit_datetime'] == first
+    assert (resolved[ambiguous]['exit_reason'] == 'Target').any()
+
+    # Minute candles were only fetched for the days of ambiguous bars
+    minute_days = {from_date for (_, from_date, _), interval in zip(api.calls, api.intervals)
+                   if interval == 'ONE_MINUTE'}
+    assert minute_days <= {str(day.date()) for day in coarse[ambiguous]['exit_datetime']}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CandleCache(cache_dir)
+        cached = BacktestEngine(MinuteAngelOneAPI(), cache, workers=2, min_shard_bars=0, interval='ONE_HOUR',
+                                resolve_interval='ONE_MINUTE').run_backtest(trades, 0.5, 0.5, 3)
+        pd.testing.assert_frame_equal(cached, resolved)
 
-def test_imports():
-    """Test if all required modules can be imported"""
     try:
-        import flask
-        import pandas
-        import numpy
-        import plotly
-        import requests
-        print("✅ All required modules imported successfully")
-        return True
-    except ImportError as e:
-        print(f"❌ Import error: {e}")
-        return False
+        BacktestEngine(api, interval='ONE_MINUTE', resolve_interval='ONE_HOUR')
+        assert False, "resolve_interval coarser than interval should be rejected"
+    except ValueError:
+        pass
 
-def test_csv_parsing():
-    """Test CSV parsing functionality"""
+    print("✅ Multi-resolution exits test passed")
+
+def test_calculate_metrics():
+    """Test the extended metrics against straightforward pandas computations"""
+    from app import calculate_metrics
+
+    rng = np.random.default_rng(21)
+    n = 5000
+    entry = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 200 * 24 * 60, n), unit='min')
+    results = pd.DataFrame({
+        'entry_datetime': entry,
+        # Coarse exit times so there are many ties
+        'exit_datetime': (entry + pd.to_timedelta(rng.integers(1, 5 * 24 * 60, n), unit='min')).floor('D'),
+        'exit_reason': rng.choice(['Stop Loss', 'Target', 'Time Exit (3 days)'], n),
+        'pnl_pct': rng.normal(0.1, 2, n).round(1),
+        'sector': rng.choice(['IT', 'Banking', None], n),
+        'market_cap': rng.choice(['Largecap', 'Midcap'], n)
+    })
+    before = results.copy()
+    metrics = calculate_metrics(results)
+    pd.testing.assert_frame_equal(results, before)
+
+    pnl = results['pnl_pct']
+    assert metrics['total_trades'] == n and metrics['winning_trades'] == (pnl > 0).sum()
+    assert metrics['avg_loss'] == round(pnl[pnl < 0].mean(), 2)
+    assert metrics['expectancy'] == round(pnl.mean(), 2)
+    assert metrics['sharpe_ratio'] == round(pnl.mean() / pnl.std(), 2)
+    assert metrics['sortino_ratio'] == round(pnl.mean() / np.sqrt((pnl.clip(upper=0) ** 2).mean()), 2)
+    assert metrics['profit_factor'] == round(pnl[pnl > 0].sum() / -pnl[pnl < 0].sum(), 2)
+    assert metrics['avg_holding_days'] == round(
+        (results['exit_datetime'] - results['entry_datetime']).mean() / pd.Timedelta(days=1), 2)
+
+    ordered = results.sort_values(['exit_datetime', 'pnl_pct'])['pnl_pct']
+    equity = ordered.cumsum()
+    assert metrics['max_drawdown'] == round((equity - equity.cummax()).min(), 2)
+    signs = np.sign(ordered.to_numpy())
+    runs = pd.Series(signs).groupby((pd.Series(signs) != pd.Series(signs).shift()).cumsum())
+    assert metrics['max_win_streak'] == max(len(run) for _, run in runs if run.iloc[0] > 0)
+    assert metrics['max_loss_streak'] == max(len(run) for _, run in runs if run.iloc[0] < 0)
+
+    # Input order does not matter, ties included
+    shuffled = calculate_metrics(results.sample(frac=1, random_state=3))
+    assert shuffled == metrics
+
+    by_reason = results.groupby('exit_reason')['pnl_pct']
+    assert metrics['by_exit_reason']['Target'] == {
+        'trades': by_reason.size()['Target'],
+        'win_rate': round((by_reason.apply(lambda p: (p > 0).mean())['Target']) * 100, 2),
+        'avg_pnl': round(by_reason.mean()['Target'], 2),
+        'total_pnl': round(by_reason.sum()['Target'], 2)}
+    assert set(metrics['by_sector']) == {'IT', 'Banking', 'Unknown'}
+    assert sum(group['trades'] for group in metrics['by_market_cap'].values()) == n
+
+    # Only the columns /optimize grid cells have
+    assert 'by_sector' not in calculate_metrics(results[['exit_datetime', 'pnl_pct']])
+    assert calculate_metrics(results.iloc[:0]) == {}
+
+    print("✅ Calculate metrics test passed")
+
+def test_portfolio_simulation():
+    """Test the heap-merged portfolio replay by hand and through /backtest"""
+    from portfolio import simulate_portfolio
+
+    # entry_ms, exit_ms, entry_price, exit_price, symbol
+    trades = [(0, 10, 10, 12, 'A'), (1, 5, 10, 8, 'B'), (2, 30, 10, 10, 'C'),
+              (5, 20, 10, 10, 'A'), (6, 8, 100, 110, 'D')]
+    columns = [np.array(column) for column in zip(*trades)]
+    result = simulate_portfolio(*columns[:4], symbols=columns[4], capital=1000, position_pct=50, max_positions=3)
+    assert result.quantity.tolist() == [50, 50, 0, 0, 4]
+    assert result.skip_reason.tolist() == [None, None, 'insufficient_cash', 'symbol_open', None]
+    # B's exit at 5 frees cash before the entries at 5 and 6
+    assert result.equity_ms.tolist() == [0, 1, 5, 6, 8, 10]
+    assert result.equity.tolist() == [1000, 1000, 900, 900, 940, 1040]
+    metrics = result.metrics()
+    assert metrics['final_equity'] == 1040 and metrics['total_return_pct'] == 4
+    assert metrics['max_drawdown_pct'] == -10 and metrics['max_open_positions'] == 2
+    assert metrics['trades_skipped'] == {'insufficient_cash': 1, 'symbol_open': 1}
+
+    order = [3, 0, 4, 2, 1]
+    shuffled = simulate_portfolio(*(column[order] for column in columns[:4]), symbols=columns[4][order],
+                                  capital=1000, position_pct=50, max_positions=3)
+    assert shuffled.quantity.tolist() == result.quantity[order].tolist()
+    capped = simulate_portfolio(*columns[:4], capital=1000, position_pct=50, max_positions=1)
+    assert capped.skip_reason.tolist()[:3] == [None, 'max_positions', 'max_positions']
+
+    # Open positions are marked to market: a dip that recovers before the exit still counts as a drawdown
+    marks = {'A': (np.array([-1, 3, 6]), np.array([5.0, 8.0, 11.0])), 'B': (np.array([4]), np.array([1.0]))}
+    held = simulate_portfolio([0], [10], [10.0], [12.0], symbols=np.array(['A']), capital=1000, position_pct=50,
+                              marks=marks)
+    assert held.equity_ms.tolist() == [0, 3, 6, 10]
+    assert held.equity.tolist() == [1000, 900, 1050, 1100]
+    assert held.metrics()['max_drawdown_pct'] == -10 and held.metrics()['final_equity'] == 1100
+    at_cost = simulate_portfolio([0], [10], [10.0], [12.0], symbols=np.array(['A']), capital=1000, position_pct=50)
+    assert at_cost.metrics()['max_drawdown_pct'] == 0
+
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        plain = client.post('/backtest', json=request_data).get_json()
+        assert 'portfolio' not in plain and 'quantity' not in plain['results'][0]
+
+        response = client.post('/backtest', json=dict(request_data, capital=100000, max_positions=1))
+        assert response.status_code == 200 and response.headers['X-Cache'] == 'MISS'
+        data = response.get_json()
+        portfolio = data['portfolio']
+        assert portfolio['settings'] == {'capital': 100000, 'position_pct': 10, 'max_positions': 1}
+        taken = [trade for trade in data['results'] if trade['quantity'] > 0]
+        skipped = sum(portfolio['metrics']['trades_skipped'].values())
+        assert len(taken) == portfolio['metrics']['trades_taken'] and len(taken) + skipped == len(data['results'])
+        # One position at a time: every taken trade exits before the next one enters
+        spans = sorted((pd.Timestamp(t['entry_datetime']), pd.Timestamp(t['exit_datetime'])) for t in taken)
+        assert all(exit <= entry for (_, exit), (entry, _) in zip(spans, spans[1:]))
+
+        invalid = client.post('/backtest', json=dict(request_data, max_positions=0))
+        assert invalid.status_code == 400
+
+    # Marks come from the candles the run loaded, or from the cache when every result was memoized
+    from app import BacktestEngine
+    from candle_cache import CandleCache, MS_PER_DAY
+    trades = pd.DataFrame({'entry_datetime': pd.to_datetime(['2024-01-03 10:15', '2024-01-09 11:15']),
+                           'symbol': ['RELIANCE', 'TCS']})
+    engine = BacktestEngine(WaveAngelOneAPI())
+    results = engine.run_backtest(trades, 20, 40, 5)
+    closes = engine.daily_closes(results)
+    assert sorted(closes) == ['RELIANCE', 'TCS']
+    close_ms, close = closes['TCS']
+    assert (np.diff(close_ms // MS_PER_DAY) > 0).all() and len(close_ms) >= 5
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cached = BacktestEngine(WaveAngelOneAPI(), CandleCache(cache_dir))
+        cached.run_backtest(trades, 20, 40, 5)
+        recalled = cached.run_backtest(trades, 20, 40, 5)
+        assert not cached.skipped and sorted(cached.daily_closes(recalled)) == ['RELIANCE', 'TCS']
+        cached_ms, cached_close = cached.daily_closes(recalled)['TCS']
+        inside = (close_ms >= cached_ms[0]) & (close_ms <= cached_ms[-1])
+        assert close_ms[inside].tolist() == cached_ms.tolist() and close[inside].tolist() == cached_close.tolist()
+
+    print("✅ Portfolio simulation test passed")
+
+def test_optimize_matches_backtest():
+    """Test that every /optimize grid cell matches a standalone backtest"""
+    from app import BacktestEngine, calculate_metrics, parse_grid
+
+    assert parse_grid({'start': 1, 'stop': 2, 'step': 0.5}) == [1.0, 1.5, 2.0]
+    assert parse_grid([3, 5], cast=int) == [3, 5]
+    assert parse_grid('7') == [7.0]
+
+    trades = pd.DataFrame({
+        'entry_datetime': pd.to_datetime(['2024-01-03 10:15', '2024-01-04 11:15', '2024-01-09 13:15',
+                                          '2024-01-16 09:30', '2024-01-17 14:45']),
+        'symbol': ['RELIANCE', 'TCS', 'RELIANCE', 'TCS', 'RELIANCE']
+    })
+    engine = BacktestEngine(WaveAngelOneAPI())
+    grid = engine.optimize(trades, [1, 3, 20], [2, 9, 25], [1, 4])
+    assert len(grid) == 18
+
+    for cell in grid:
+        results = engine.run_backtest(trades, cell['stop_loss'], cell['target'], cell['exit_days'])
+        expected = calculate_metrics(results)
+        assert cell['metrics'] == expected, (cell, expected)
+
+    print("✅ Optimization grid test passed")
+
+def test_parallel_backtest():
+    """Test that the process-pool backtest matches the serial one"""
+    import app as app_module
+    from app import BacktestEngine
+
+    rng = np.random.default_rng(3)
+    days = pd.bdate_range('2024-01-02', periods=30)
+    trades = pd.DataFrame({
+        'entry_datetime': [day + pd.Timedelta(minutes=int(m))
+                           for day, m in zip(rng.choice(days, 120), rng.integers(9 * 60 + 30, 15 * 60, 120))],
+        'symbol': rng.choice([f'SYM{i}' for i in range(6)], 120)
+    })
+
+    serial = BacktestEngine(WaveAngelOneAPI()).run_backtest(trades, 2, 4, 3)
+    parallel = BacktestEngine(WaveAngelOneAPI(), workers=3, min_shard_bars=0).run_backtest(trades, 2, 4, 3)
+    assert len(serial) > 100
+    pd.testing.assert_frame_equal(serial, parallel)
+
+    # Backtests share one long-lived pool
+    pool_factory = app_module.shard_pool
+    pool = pool_factory(3)
+    pd.testing.assert_frame_equal(
+        BacktestEngine(WaveAngelOneAPI(), workers=2, min_shard_bars=0).run_backtest(trades, 2, 4, 3), serial)
+    assert pool_factory(2) is pool
+
+    # Too few candles to be worth sharding are evaluated in-process
+    def no_pool(workers):
+        raise AssertionError("small runs must not use the process pool")
+
+    app_module.shard_pool = no_pool
     try:
-        # Create a test CSV
-        test_data = {
-            'entry_datetime': ['06-08-2025 10:15 am', '06-08-2025 11:15 am'],
-            'symbol': ['YATHARTH', 'KAMATHOTEL'],
-            'market_cap': ['Midcap', 'Smallcap'],
-            'sector': ['Pharmaceuticals', 'Services']
-        }
-        
-        df = pd.DataFrame(test_data)
-        df['entry_datetime'] = pd.to_datetime(df['entry_datetime'])
-        
-        print("✅ CSV parsing test passed")
-        return True
-    except Exception as e:
-        print(f"❌ CSV parsing error: {e}")
-        return False
+        pd.testing.assert_frame_equal(BacktestEngine(WaveAngelOneAPI(), workers=3).run_backtest(trades, 2, 4, 3), serial)
+    finally:
+        app_module.shard_pool = pool_factory
 
-def test_file_structure():
-    """Test if all required files exist"""
-    required_files = [
-        'app.py',
-        'requirements.txt',
-        'Procfile',
-        'runtime.txt',
-        'templates/index.html',
-        'README.md'
-    ]
-    
-    missing_files = []
-    for file in required_files:
-        if not os.path.exists(file):
-            missing_files.append(file)
-    
-    if missing_files:
-        print(f"❌ Missing files: {missing_files}")
-        return False
-    else:
-        print("✅ All required files present")
-        return True
+    print("✅ Parallel backtest test passed")
 
-def test_flask_app():
-    """Test if Flask app can be created"""
+def test_token_bucket():
+    """Test that the rate limiter enforces every configured limit"""
+    from rate_limit import RateLimiter
+
+    now = [0.0]
+    def sleep(seconds):
+        now[0] += seconds
+
+    limiter = RateLimiter([(3, 1), (5, 60)], clock=lambda: now[0], sleep=sleep)
+    grants = []
+    for _ in range(7):
+        limiter.acquire()
+        grants.append(now[0])
+
+    # Burst of 3, then 3/s, then the 5-per-minute bucket takes over
+    assert grants[:3] == [0.0, 0.0, 0.0]
+    assert abs(grants[3] - 1 / 3) < 1e-9
+    assert grants[5] >= 12 - 1e-9
+    assert grants[6] >= 24 - 1e-9
+
+    print("✅ Token bucket test passed")
+
+def test_smartapi_client():
+    """Test concurrent fetches and retries against the local fake SmartAPI"""
+    from app import AngelOneAPI
+    from candle_cache import CandleCache
+    from fake_smartapi import FakeSmartAPIServer, CANDLE_PATH
+    from rate_limit import RateLimiter
+
+    with FakeSmartAPIServer(latency=0.05) as server:
+        api = AngelOneAPI('key', 'C123', '1234', 'JBSWY3DPEHPK3PXP',
+                          base_url=server.base_url, max_concurrency=4)
+        api.rate_limiter = RateLimiter([(1000, 1)])
+        api.retry_backoff = 0.01
+
+        symbols = ['RELIANCE', 'TCS', 'INFY', 'HDFCBANK', 'ICICIBANK', 'SBIN', 'LT', 'MARUTI']
+        frames = api.get_historical_data_many(
+            [(symbol, 'FIFTEEN_MINUTE', '2024-01-01', '2024-01-05') for symbol in symbols])
+        assert all(frame is not None and len(frame) == 5 * 25 for frame in frames)
+        assert server.logins == 1
+        assert 2 <= server.max_in_flight <= 4
+
+        # 429 and 503 are retried with backoff until the request succeeds
+        server.failures = [429, 503]
+        before = len(server.requests)
+        frame = api.get_historical_data('TCS', 'ONE_HOUR', '2024-01-01', '2024-01-02')
+        assert frame is not None and not frame.empty
+        assert [path for path, _, _ in server.requests[before:]] == [CANDLE_PATH] * 3
+
+        # A range without candles (e.g. a holiday) is cached as fetched, except for today
+        server.candles = lambda token, interval, from_date, to_date: []
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CandleCache(cache_dir)
+            before = len(server.requests)
+            assert api.get_historical_data('TCS', 'ONE_HOUR', '2024-01-26', '2024-01-26').empty
+            for _ in range(2):
+                assert cache.get_historical_data(api, 'TCS', 'ONE_HOUR', '2024-01-26', '2024-01-26') is None
+            assert len(server.requests) == before + 2 and not api.request_failed
+            today = datetime.now().strftime('%Y-%m-%d')
+            # Weekend gaps are never missing, so end on the next weekday
+            end = (pd.Timestamp(today) + pd.offsets.BDay(0)).strftime('%Y-%m-%d')
+            cache.get_historical_data(api, 'TCS', 'ONE_HOUR', '2024-01-26', end)
+            assert cache.missing_ranges('NSE', api.symbol_tokens.get('TCS'), 'ONE_HOUR', '2024-01-26', end) == [
+                (today, end)]
+
+    print("✅ SmartAPI client test passed")
+
+def test_chunked_candle_requests():
+    """Test that long ranges are split per interval, fetched concurrently and stitched"""
+    from app import AngelOneAPI, MAX_DAYS_PER_REQUEST, split_date_range
+    from fake_smartapi import FakeSmartAPIServer, CANDLE_PATH
+    from rate_limit import RateLimiter
+
+    assert split_date_range('2024-01-01', '2024-01-30', 'ONE_MINUTE') == [('2024-01-01', '2024-01-30')]
+    chunks = split_date_range('2024-01-01 09:15', '2024-03-15 15:30', 'ONE_MINUTE')
+    assert chunks == [('2024-01-01 09:15', '2024-01-30'), ('2024-01-31', '2024-02-29'),
+                      ('2024-03-01', '2024-03-15 15:30')]
+    assert len(split_date_range('2020-01-01', '2024-12-31', 'ONE_DAY')) == 1
+
+    with FakeSmartAPIServer(latency=0.05) as server:
+        api = AngelOneAPI('key', 'C123', '1234', 'JBSWY3DPEHPK3PXP', base_url=server.base_url, max_concurrency=2)
+        api.rate_limiter = RateLimiter([(1000, 1)])
+
+        frame = api.get_historical_data('TCS', 'ONE_HOUR', '2023-01-01', '2024-12-31')
+        ranges = [(body['fromDate'], body['toDate']) for path, body, _ in server.requests if path == CANDLE_PATH]
+        assert len(ranges) == -(-731 // MAX_DAYS_PER_REQUEST['ONE_HOUR'])
+        assert min(ranges) == ('2023-01-01', '2024-02-04') and max(to for _, to in ranges) == '2024-12-31'
+        assert frame['timestamp'].is_monotonic_increasing and not frame['timestamp'].duplicated().any()
+        assert frame['timestamp'].iloc[0] == pd.Timestamp('2023-01-02 09:15')
+        assert frame['timestamp'].iloc[-1] == pd.Timestamp('2024-12-31 15:15')
+        assert server.max_in_flight <= 2
+
+        # A chunk that fails leaves no partial frame behind
+        server.failures = [400]
+        assert api.get_historical_data('TCS', 'ONE_HOUR', '2023-01-01', '2024-12-31') is None
+
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=30)
+        daily = client.post('/backtest', json=dict(request_data, interval='ONE_DAY'))
+        assert daily.status_code == 200 and daily.get_json()['results']
+        intervals = {body['interval'] for path, body, _ in server.requests if path == CANDLE_PATH}
+        assert intervals == {'ONE_DAY'}
+        daily_requests = len(server.requests)
+        minute = client.post('/backtest', json=request_data)
+        assert minute.status_code == 200 and minute.headers['X-Cache'] == 'MISS'
+        assert len(server.requests) - daily_requests > daily_requests
+
+        unknown = client.post('/backtest', json=dict(request_data, interval='TWO_MINUTE'))
+        assert unknown.status_code == 400
+
+    print("✅ Chunked candle requests test passed")
+
+def test_session_cache():
+    """Test that SmartAPI logins are reused, refreshed and scoped to their credentials"""
+    import base64
+    from app import AngelOneAPI
+    from fake_smartapi import FakeSmartAPIServer, CANDLE_PATH
+    from rate_limit import RateLimiter
+    from session_cache import SessionCache, REFRESH_MARGIN, token_expiry
+
+    claims = base64.urlsafe_b64encode(json.dumps({'exp': 1700000000}).encode()).decode().rstrip('=')
+    assert token_expiry(f"header.{claims}.signature") == 1700000000
+    assert token_expiry('opaque-token', now=100) > 100
+
+    with tempfile.TemporaryDirectory() as cache_dir, FakeSmartAPIServer() as server:
+        now = [time.time()]
+        cache = SessionCache(cache_dir, clock=lambda: now[0])
+
+        def client(password='1234'):
+            api = AngelOneAPI('key', 'C123', password, 'JBSWY3DPEHPK3PXP',
+                              base_url=server.base_url, session_cache=cache)
+            api.rate_limiter = RateLimiter([(1000, 1)])
+            return api
+
+        # A second client (another request or worker) skips the login entirely
+        assert client().get_historical_data('TCS', 'ONE_HOUR', '2024-01-01', '2024-01-02') is not None
+        assert client().get_historical_data('INFY', 'ONE_HOUR', '2024-01-01', '2024-01-02') is not None
+        assert server.logins == 1
+
+        # Close to expiry the refresh token is used instead of a new login
+        now[0] += 6 * 60 * 60 - REFRESH_MARGIN + 1
+        assert client().get_historical_data('TCS', 'ONE_HOUR', '2024-01-01', '2024-01-02') is not None
+        assert (server.logins, server.refreshes) == (1, 1)
+
+        # Different credentials never reuse the cached session
+        assert client(password='9999').get_historical_data('TCS', 'ONE_HOUR', '2024-01-01', '2024-01-02') is not None
+        assert server.logins == 2
+
+        # A revoked token is dropped and the fetch retried after logging in again
+        api = client(password='9999')
+        api._ensure_access_token()
+        api.access_token = 'revoked'
+        before = len(server.requests)
+        assert api.get_historical_data('TCS', 'ONE_HOUR', '2024-01-01', '2024-01-02') is not None
+        assert [path for path, _, _ in server.requests[before:]].count(CANDLE_PATH) == 2
+
+    print("✅ Session cache test passed")
+
+def test_candle_decoding():
+    """Test that the columnar candle decoder matches the row-by-row parser"""
+    from app import AngelOneAPI
+    from benchmark import candle_payload, legacy_process_historical_data
+
+    data = candle_payload(days=10, interval='FIVE_MINUTE')
+    candles = data['NSE']['2885']
+    rng = np.random.default_rng(11)
+    candles = [candles[i] for i in rng.permutation(len(candles))]
+    candles[3] = candles[3][:4]
+    candles[5] = [candles[5][0], 0, 1, 1, 1, 100]
+    data = {'NSE': {'2885': candles, '11536': [[1704186900000, 10.5, 11, 10, 10.75, 7]]}}
+    # String prices plus the short row take the per-column path
+    mixed = {'NSE': {'2885': [row[:1] + [str(value) for value in row[1:5]] + row[5:] for row in candles[:50]]}}
+
+    api = AngelOneAPI()
+    saved_tz = os.environ.get('TZ')
     try:
-        from app import app
-        with app.test_client() as client:
-            response = client.get('/')
-            if response.status_code == 200:
-                print("✅ Flask app test passed")
-                return True
-            else:
-                print(f"❌ Flask app returned status code: {response.status_code}")
-                return False
-    except Exception as e:
-        print(f"❌ Flask app error: {e}")
-        return False
+        # Timestamps are local wall-clock time, including across a DST change
+        for tz in ('UTC', 'Asia/Kolkata', 'America/New_York'):
+            os.environ['TZ'] = tz
+            time.tzset()
+            for payload in (data, mixed, candle_payload(days=120, interval='ONE_HOUR')):
+                # Timestamp resolution follows the candle cache, not pandas' inference for datetimes
+                pd.testing.assert_frame_equal(api._process_historical_data(payload),
+                                              legacy_process_historical_data(payload), check_dtype=False)
+    finally:
+        if saved_tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = saved_tz
+        time.tzset()
+
+    # SmartAPI's ISO 8601 timestamps are read as exchange wall-clock time
+    df = api._process_historical_data({'NSE': {'2885': [['2024-01-02T09:20:00+05:30', 1, 2, 0.5, 1.5, 10],
+                                                       ['2024-01-02T09:15:00+05:30', 1, 2, 0.5, 1.5, 20]]}})
+    assert df['timestamp'].tolist() == [pd.Timestamp('2024-01-02 09:15'), pd.Timestamp('2024-01-02 09:20')]
+    assert df['volume'].tolist() == [20, 10]
+    assert api._process_historical_data({'NSE': {'2885': [[1, 0, 0, 0, 0, 0]]}}) is None
+
+    print("✅ Candle decoding test passed")
+
+def test_instrument_master():
+    """Test scrip master download, daily refresh and symbol lookups"""
+    import io
+    from fake_smartapi import FakeSmartAPIServer, SCRIP_MASTER_PATH
+    from instruments import InstrumentMaster, SymbolTokens, iter_json_array
+
+    # The streaming decoder handles elements split across read chunks
+    rows = [{'token': str(i), 'symbol': f'S{i}-EQ', 'exch_seg': 'NSE'} for i in range(50)]
+    assert list(iter_json_array(io.StringIO(json.dumps(rows)), chunk_size=7)) == rows
+    assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+    # A stream cut off between elements is not a complete array
+    for truncated in (json.dumps(rows)[:-1], json.dumps(rows)[:json.dumps(rows).index('}, ') + 2], ''):
+        try:
+            list(iter_json_array(io.StringIO(truncated), chunk_size=7))
+            assert False, "Truncated array should raise"
+        except ValueError:
+            pass
+
+    with tempfile.TemporaryDirectory() as cache_dir, FakeSmartAPIServer() as server:
+        today = [datetime(2025, 8, 6).date()]
+        master = InstrumentMaster(cache_dir, url=server.base_url + SCRIP_MASTER_PATH, today=lambda: today[0])
+        tokens = SymbolTokens(master)
+
+        # Bare Chartink symbols resolve through the -EQ series; other exchanges are not indexed
+        assert tokens['RELIANCE'] == tokens['RELIANCE-EQ'] == '2885'
+        assert (tokens['INFY'], tokens['WIPRO'], tokens['ITC'], tokens['ASIANPAINT']) == ('1594', '3787', '1660', '236')
+        assert tokens.get('ZOMATO') == '5097'
+        assert tokens.get('SUZLON') is None and tokens.get('SUZLON-BE') == '12018'
+        assert 'RELIANCE26JAN1300CE' not in tokens
+        assert server.scrip_master_downloads == 1
+
+        # Another process starts from the pickled index without downloading
+        reloaded = InstrumentMaster(cache_dir, url=server.base_url + SCRIP_MASTER_PATH, today=lambda: today[0])
+        assert reloaded.token('zomato') == '5097'
+        assert server.scrip_master_downloads == 1
+
+        # A new day serves the existing index while refreshing in the background
+        today[0] = datetime(2025, 8, 7).date()
+        assert reloaded.token('TCS') == '11536'
+        deadline = time.time() + 10
+        while server.scrip_master_downloads < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert server.scrip_master_downloads == 2
+
+        # A truncated download is rejected and the previous index is kept, in memory and on disk
+        while reloaded._refreshing and time.time() < deadline:
+            time.sleep(0.05)
+        complete = server.scrip_master
+        server.scrip_master = complete[:complete.rindex(b'}') + 1]
+        assert not reloaded.refresh()
+        assert reloaded.token('ZOMATO') == '5097'
+        assert InstrumentMaster(cache_dir, url=server.base_url + SCRIP_MASTER_PATH,
+                                today=lambda: today[0]).token('ZOMATO') == '5097'
+        assert server.scrip_master_downloads == 3
+
+    # Without a master (or with an unreachable one) the built-in table still resolves large caps
+    with tempfile.TemporaryDirectory() as cache_dir:
+        offline = SymbolTokens(InstrumentMaster(cache_dir, url='http://127.0.0.1:9/scrip_master.json'))
+        assert offline['SBIN'] == '3045' and offline.get('ZOMATO') is None
+        assert SymbolTokens()['LT'] == '11483'
+
+    print("✅ Instrument master test passed")
+
+def test_trade_ingest():
+    """Test chunked CSV ingestion into typed trade files"""
+    import io
+    from trade_store import detect_date_format, ingest_trades_csv, load_trades
+
+    assert detect_date_format(['06-08-2025 10:15 AM']) == '%m-%d-%Y %I:%M %p'
+    assert detect_date_format(['06-08-2025 10:15 AM', '13-08-2025 02:30 pm']) == '%d-%m-%Y %I:%M %p'
+    assert detect_date_format(['2025-08-13 14:30:00']) == 'ISO8601'
+
+    rows = ['Alert Date,Stock Name,Market Cap,Industry']
+    rows += [f"{day % 28 + 1:02d}-08-2025 {hour % 12 + 1}:15 pm,SYM{day % 7},Midcap,IT"
+             for day, hour in zip(range(2500), range(2500))]
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'trades.npz')
+        result = ingest_trades_csv(io.StringIO('\n'.join(rows)), path, chunksize=300)
+        assert result.rows == 2500 and not result.invalid_count
+        assert result.date_format == '%d-%m-%Y %I:%M %p'
+
+        trades = load_trades(path)
+        assert list(trades.columns) == ['entry_datetime', 'symbol', 'market_cap', 'sector']
+        assert trades['entry_datetime'].iloc[20] == pd.Timestamp('2025-08-21 21:15')
+        assert trades['symbol'].iloc[20] == 'SYM6' and trades['sector'].iloc[0] == 'IT'
+
+        # Invalid rows are reported chunk by chunk and nothing is written
+        bad = rows[:1] + ['not a date,SYM1,Midcap,IT'] + rows[1:600] + ['01-08-2025 1:15 pm,,Midcap,IT']
+        reported = []
+        result = ingest_trades_csv(io.StringIO('\n'.join(bad)), os.path.join(workdir, 'bad.npz'),
+                                   chunksize=300, on_invalid=reported.append)
+        assert [row['row'] for row in result.invalid_rows] == [0, 600]
+        assert [row['reason'] for row in result.invalid_rows] == ['invalid date', 'missing symbol']
+        assert len(reported) == 2
+        assert not os.path.exists(os.path.join(workdir, 'bad.npz'))
+
+        # Headerless-looking columns are mapped by position; extra columns default
+        result = ingest_trades_csv(io.StringIO('a,b\n2025-08-13 09:30,TCS\n'), path)
+        assert load_trades(path).iloc[0].to_dict() == {
+            'entry_datetime': pd.Timestamp('2025-08-13 09:30'), 'symbol': 'TCS',
+            'market_cap': 'Unknown', 'sector': 'Unknown'}
+
+    print("✅ Trade ingest test passed")
+
+def test_pipeline_benchmark():
+    """Test the synthetic market and one small run of the pipeline benchmark"""
+    from benchmark import SyntheticMarket, bench_pipeline_scale
+
+    market = SyntheticMarket(symbols=3, days=4, seed=5)
+    assert len(market.candles('SYM001')) == 4 * 375
+    assert market.candles('SYM001') == SyntheticMarket(symbols=2, days=4, seed=5).candles('SYM001')
+    day = market.candles('SYM000', '2024-01-02', '2024-01-02')
+    assert len(day) == 375 and all(low <= min(o, c) and high >= max(o, c) for _, o, high, low, c, _ in day)
+
+    result = bench_pipeline_scale(trades=10, symbols=2, days=12, repeat=1)
+    stages = result['stages']
+    assert set(stages) == {'process_historical_data', 'get_entry_price', 'find_exit', 'evaluate_batch',
+                           'calculate_metrics', 'equity_curve_chart', 'returns_distribution_chart',
+                           'backtest_endpoint'}
+    assert stages['get_entry_price']['calls'] == 10
+    assert stages['backtest_endpoint']['cold_seconds'] > 0
+    json.dumps(result)
+
+    print("✅ Pipeline benchmark test passed")
+
+TEST_CREDENTIALS = {'api_key': 'test-key', 'client_id': 'C123', 'password': '1234', 'totp': 'JBSWY3DPEHPK3PXP'}
+
+@contextmanager
+def fake_backtest_environment():
+    """Point the Flask app at a fake SmartAPI and throwaway cache/upload/job folders"""
+    import app as app_module
+    import rate_limit
+    from candle_cache import CandleCache
+    from fake_smartapi import FakeSmartAPIServer, SCRIP_MASTER_PATH
+    from instruments import InstrumentMaster
+    from jobs import JobStore
+    from session_cache import SessionCache
+    from response_cache import ResponseCache
+    from trade_store import TradeStore
+
+    saved_config = dict(app_module.app.config)
+    saved_globals = (app_module.candle_cache, app_module.job_store, app_module.session_cache,
+                     app_module.instrument_master, app_module.trade_store, app_module.response_cache)
+    with tempfile.TemporaryDirectory() as workdir, FakeSmartAPIServer() as server:
+        app_module.app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app_module.app.config['SMARTAPI_BASE_URL'] = server.base_url
+        app_module.trade_store = TradeStore(app_module.app.config['UPLOAD_FOLDER'])
+        app_module.response_cache = ResponseCache()
+        app_module.candle_cache = CandleCache(os.path.join(workdir, 'cache'))
+        app_module.job_store = JobStore(os.path.join(workdir, 'jobs'), dumps=app_module.app.json.dumps)
+        app_module.session_cache = SessionCache(os.path.join(workdir, 'cache'))
+        app_module.instrument_master = InstrumentMaster(os.path.join(workdir, 'cache'),
+                                                        url=server.base_url + SCRIP_MASTER_PATH)
+        rate_limit._limiters[TEST_CREDENTIALS['api_key']] = rate_limit.RateLimiter([(1000, 1)])
+        try:
+            with app_module.app.test_client() as client:
+                with open('sample_data.csv', 'rb') as f:
+                    upload = client.post('/upload', data={'file': (f, 'sample_data.csv')})
+                assert upload.status_code == 200, upload.get_json()
+                yield client, server, upload.get_json()['filename']
+        finally:
+            app_module.app.config.clear()
+            app_module.app.config.update(saved_config)
+            (app_module.candle_cache, app_module.job_store, app_module.session_cache,
+             app_module.instrument_master, app_module.trade_store, app_module.response_cache) = saved_globals
+            rate_limit._limiters.pop(TEST_CREDENTIALS['api_key'], None)
+
+def test_trade_set_catalog():
+    """Test that identical uploads dedupe by content hash and show up in the catalog"""
+    import io
+
+    with fake_backtest_environment() as (client, server, filename):
+        entry = client.get(f'/trade-sets/{filename}').get_json()
+        trades = pd.read_csv('sample_data.csv')
+        assert entry['rows'] == len(trades) and entry['filenames'] == ['sample_data.csv']
+        assert entry['first_entry'] <= entry['last_entry']
+
+        # Re-uploading the same bytes under another name reuses the stored trade file
+        import app as app_module
+        stored = app_module.trade_store.path(filename)
+        mtime = os.stat(stored).st_mtime_ns
+        with open('sample_data.csv', 'rb') as f:
+            again = client.post('/upload', data={'file': (f, 'copy.csv')}).get_json()
+        assert again['filename'] == filename and again['duplicate']
+        assert again['trades_count'] == entry['rows'] and len(again['preview']) == 5
+        assert os.stat(stored).st_mtime_ns == mtime
+
+        other = b'date,symbol\n08-01-2025 10:15 AM,TCS\n08-03-2025 11:00 AM,INFY\n'
+        added = client.post('/upload', data={'file': (io.BytesIO(other), 'other.csv')}).get_json()
+        assert not added['duplicate']
+
+        catalog = client.get('/trade-sets').get_json()['trade_sets']
+        assert [item['id'] for item in catalog] == [added['filename'], filename]
+        assert catalog[0]['rows'] == 2 and catalog[0]['symbols'] == 2
+        assert (catalog[0]['first_entry'], catalog[0]['last_entry']) == ('2025-08-01T10:15:00', '2025-08-03T11:00:00')
+        assert catalog[1]['filenames'] == ['sample_data.csv', 'copy.csv']
+
+        assert client.get('/trade-sets/../app.py').status_code == 404
+        response = client.post('/backtest', json=dict(TEST_CREDENTIALS, filename='sample_data.csv'))
+        assert response.status_code == 400
+
+    print("✅ Trade set catalog test passed")
+
+def test_response_cache():
+    """Test LRU/TTL eviction and that cached /backtest responses skip the engine and charts"""
+    import app as app_module
+    from response_cache import ResponseCache
+
+    now = [0.0]
+    cache = ResponseCache(max_bytes=10, ttl=60, clock=lambda: now[0])
+    cache.put('a', '1234')
+    cache.put('b', '5678')
+    assert cache.get('a') == '1234'
+    cache.put('c', '90')
+    cache.put('d', '12')
+    # 'b' was least recently used
+    assert cache.get('b') is None and cache.get('a') == '1234'
+    cache.put('huge', 'x' * 11)
+    assert cache.get('huge') is None
+    now[0] = 61
+    assert cache.get('a') is None
+    assert cache.stats() == {'entries': 2, 'bytes': 4, 'hits': 2, 'misses': 3, 'evictions': 1}
+    # Sizes are UTF-8 bytes, not characters
+    cache.put('rupee', '₹' * 4)
+    assert cache.get('rupee') is None and cache.stats()['bytes'] == 4
+    cache.put('rupee', '₹' * 3)
+    assert cache.stats()['bytes'] == 9
+
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        first = client.post('/backtest', json=request_data)
+        assert first.status_code == 200 and first.headers['X-Cache'] == 'MISS'
+
+        charts = []
+        create_chart = app_module.create_equity_curve_chart
+        app_module.create_equity_curve_chart = lambda results_df: charts.append(1) or create_chart(results_df)
+        try:
+            before = len(server.requests)
+            second = client.post('/backtest', json=dict(request_data, stop_loss='2.0'))
+            assert second.headers['X-Cache'] == 'HIT' and second.get_json() == first.get_json()
+            assert not charts and len(server.requests) == before
+
+            other = client.post('/backtest', json=dict(request_data, exit_days=4))
+            assert other.headers['X-Cache'] == 'MISS' and charts == [1]
+
+            # Another account's request for the same trade set runs with its own credentials
+            other_account = client.post('/backtest', json=dict(request_data, client_id='OTHER'))
+            assert other_account.headers['X-Cache'] == 'MISS' and charts == [1, 1]
+        finally:
+            app_module.create_equity_curve_chart = create_chart
+        assert app_module.response_cache.stats()['hits'] == 1
+
+        # Jobs share the cache: a cached request finishes without running, and a job's result fills it
+        before = len(server.requests)
+        cached_job = client.post('/jobs', json=request_data)
+        assert cached_job.status_code == 202 and cached_job.headers['X-Cache'] == 'HIT'
+        status = client.get(cached_job.get_json()['status_url']).get_json()
+        assert status['status'] == 'completed' and len(server.requests) == before
+        assert client.get(status['result_url']).get_json() == first.get_json()
+
+        job = client.post('/jobs', json=dict(request_data, exit_days=5))
+        assert job.headers['X-Cache'] == 'MISS'
+        deadline = time.time() + 30
+        while client.get(job.get_json()['status_url']).get_json()['status'] != 'completed' and time.time() < deadline:
+            time.sleep(0.05)
+        assert client.post('/backtest', json=dict(request_data, exit_days=5)).headers['X-Cache'] == 'HIT'
+
+    # A run that lost a symbol to a failed candle request is served but not cached
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        server.failures = [None, 400]
+        degraded = client.post('/backtest', json=request_data)
+        assert degraded.status_code == 200 and degraded.get_json()['partial']
+        retried = client.post('/backtest', json=request_data)
+        assert retried.headers['X-Cache'] == 'MISS' and not retried.get_json()['partial']
+        assert client.post('/backtest', json=request_data).headers['X-Cache'] == 'HIT'
+
+    print("✅ Response cache test passed")
+
+def test_telemetry():
+    """Test stage spans, the Server-Timing breakdown and the Prometheus /metrics endpoint"""
+    import telemetry
+    from fake_smartapi import CANDLE_PATH
+
+    registry = telemetry.Registry(buckets=(0.1, 1))
+    registry.count('uploads_total', result='stored')
+    registry.count('uploads_total', 2, result='stored')
+    registry.observe('stage_duration_seconds', 0.5, stage='a"b')
+    text = registry.render()
+    assert 'uploads_total{result="stored"} 3' in text
+    assert '# TYPE stage_duration_seconds histogram' in text
+    assert 'stage_duration_seconds_bucket{stage="a\\"b",le="0.1"} 0' in text
+    assert 'stage_duration_seconds_bucket{stage="a\\"b",le="1"} 1' in text
+    assert 'stage_duration_seconds_count{stage="a\\"b"} 1' in text
+
+    # Spans in bound worker threads count towards the caller's timings
+    from concurrent.futures import ThreadPoolExecutor
+    with telemetry.collect_timings() as timings:
+        def work(_):
+            with telemetry.span('worker'):
+                time.sleep(0.01)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(telemetry.bind(work), range(2)))
+    assert timings.to_dict()['worker'] >= 20
+
+    with fake_backtest_environment() as (client, server, filename):
+        requests_before = telemetry.registry.value('smartapi_requests_total', endpoint='getCandleData', status=200)
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        response = client.post('/backtest', json=request_data)
+        assert response.status_code == 200
+        stages = dict(item.split(';dur=') for item in response.headers['Server-Timing'].split(', '))
+        assert {'backtest.total', 'backtest.engine', 'engine.candles', 'smartapi.http', 'smartapi.parse',
+                'engine.evaluate', 'backtest.metrics', 'backtest.charts', 'backtest.serialize'} <= set(stages)
+        candle_requests = sum(path == CANDLE_PATH for path, _, _ in server.requests)
+        assert telemetry.registry.value('smartapi_requests_total', endpoint='getCandleData',
+                                        status=200) - requests_before == candle_requests
+
+        client.post('/backtest', json=request_data)
+        metrics = client.get('/metrics')
+        assert metrics.mimetype == 'text/plain'
+        text = metrics.get_data(as_text=True)
+        assert 'response_cache_requests_total{result="hit"} 1' in text
+        assert 'stage_duration_seconds_count{stage="smartapi.http"}' in text
+        assert 'candle_cache_lookups_total{result="miss"}' in text
+        assert 'uploads_total{result="stored"}' in text
+
+    print("✅ Telemetry test passed")
+
+def test_backtest_job():
+    """Test that a backtest job reports progress and serves its result"""
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        submitted = client.post('/jobs', json=request_data)
+        assert submitted.status_code == 202
+        job_id = submitted.get_json()['job_id']
+
+        deadline = time.time() + 30
+        while True:
+            status = client.get(f'/jobs/{job_id}').get_json()
+            if status['status'] in ('completed', 'failed') or time.time() > deadline:
+                break
+            time.sleep(0.05)
+
+        assert status['status'] == 'completed', status
+        assert status['done'] == status['total'] == 15
+        assert len(status['partial_results']) == status['results_count'] > 0
+        assert 'api_key' not in status and 'totp' not in status
+
+        result = client.get(status['result_url']).get_json()
+        assert result['success'] and len(result['results']) == status['results_count']
+        assert client.get(f'/jobs/{job_id}?since={status["results_count"]}').get_json()['partial_results'] == []
+
+        # The synchronous endpoint returns the same payload
+        direct = client.post('/backtest', json=request_data).get_json()
+        assert direct['metrics'] == result['metrics']
+
+        assert client.get('/jobs/0123abcd').status_code == 404
+        assert client.get('/jobs/..%2Fapp').status_code == 404
+
+    print("✅ Backtest job test passed")
+
+def test_optimize_job():
+    """Test that /optimize runs as a background job and serves the grid as its result"""
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss={'start': 1, 'stop': 3, 'step': 1},
+                            target=[2, 4], exit_days=[3, 5])
+        assert client.post('/optimize', json=dict(request_data, totp='')).status_code == 400
+        too_large = client.post('/optimize', json=dict(request_data, stop_loss={'start': 0.1, 'stop': 100, 'step': 0.01}))
+        assert too_large.status_code == 400 and 'maximum' in too_large.get_json()['error']
+
+        submitted = client.post('/optimize', json=request_data)
+        assert submitted.status_code == 202
+        job_id = submitted.get_json()['job_id']
+
+        deadline = time.time() + 30
+        while True:
+            status = client.get(f'/jobs/{job_id}').get_json()
+            if status['status'] in ('completed', 'failed') or time.time() > deadline:
+                break
+            time.sleep(0.05)
+
+        assert status['status'] == 'completed', status
+        assert status['done'] == status['total'] == 15 and status['partial_results'] == []
+        result = client.get(status['result_url']).get_json()
+        assert result['success'] and len(result['grid']) == 3 * 2 * 2
+        assert result['best'] in result['grid'] and 'heatmap' in result
+
+    print("✅ Optimize job test passed")
+
+def parse_server_sent_events(body):
+    """Split an event-stream body into (event, id, data) tuples"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], fields.get('id'), json.loads(fields['data'])))
+    return events
+
+def test_backtest_event_stream():
+    """Test that job trades stream as server-sent events with running metrics"""
+    from app import RunningMetrics, calculate_metrics
+
+    # Running metrics agree with calculate_metrics for trades in exit order
+    rng = np.random.default_rng(5)
+    results = pd.DataFrame({'pnl_pct': rng.normal(0.2, 3, 200),
+                            'exit_datetime': pd.date_range('2024-01-01', periods=200, freq='h')})
+    running = RunningMetrics()
+    for pnl in results['pnl_pct']:
+        running.add(pnl)
+    final = calculate_metrics(results)
+    assert running.to_dict() == {key: final[key] for key in running.to_dict()}
+
+    with fake_backtest_environment() as (client, server, filename):
+        request_data = dict(TEST_CREDENTIALS, filename=filename, stop_loss=2, target=4, exit_days=3)
+        job_id = client.post('/jobs', json=request_data).get_json()['job_id']
+
+        stream = client.get(f'/jobs/{job_id}/events')
+        assert stream.mimetype == 'text/event-stream'
+        events = parse_server_sent_events(stream.get_data(as_text=True))
+        trades = [data for event, _, data in events if event == 'trade']
+        done = [data for event, _, data in events if event == 'done']
+
+        status = client.get(f'/jobs/{job_id}').get_json()
+        assert len(trades) == status['results_count'] > 0
+        assert done and done[0]['status'] == 'completed'
+        assert done[0]['metrics']['total_trades'] == len(trades)
+        assert abs(trades[-1]['cumulative_pnl'] - sum(t['trade']['pnl_pct'] for t in trades)) < 1e-3
+        assert any(event == 'progress' for event, _, _ in events)
+
+        # Reconnecting clients resume after the last event they saw
+        resumed = parse_server_sent_events(
+            client.get(f'/jobs/{job_id}/events', headers={'Last-Event-ID': '2'}).get_data(as_text=True))
+        resumed_ids = [event_id for event, event_id, _ in resumed if event == 'trade']
+        assert resumed_ids == [str(i) for i in range(3, len(trades))]
+
+    print("✅ Backtest event stream test passed")
+
+def test_interrupted_jobs():
+    """Test that jobs left running by a dead or silent worker, or by a previous process, are reported failed"""
+    import socket
+    import subprocess
+    import sys
+    import app as app_module
+    from jobs import INTERRUPTED_ERROR, JobStore
+
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    dead_worker = f"{socket.gethostname()}:{exited.pid}"
+
+    with fake_backtest_environment() as (client, server, filename):
+        store = app_module.job_store
+        orphaned = store.create()
+        store.update(orphaned, status='running', worker=dead_worker)
+        silent = store.create()
+        store.update(silent, status='running')
+        status = store.get(silent)
+        status['updated_at'] -= store.stale_after + 1
+        store._write(store._path(silent, '.json'), json.dumps(status))
+        alive = store.create()
+        store.update(alive, status='running')
+        queued = store.create()
+
+        for job_id in (orphaned, silent):
+            status = client.get(f'/jobs/{job_id}').get_json()
+            assert status['status'] == 'failed' and status['error'] == INTERRUPTED_ERROR
+        assert client.get(f'/jobs/{alive}').get_json()['status'] == 'running'
+        assert client.get(f'/jobs/{queued}').get_json()['status'] == 'queued'
+
+        # The event stream of an interrupted job ends instead of polling forever
+        store.update(alive, worker=dead_worker)
+        events = parse_server_sent_events(client.get(f'/jobs/{alive}/events').get_data(as_text=True))
+        assert events[-1][0] == 'done' and events[-1][2]['status'] == 'failed'
+
+        # A restarted app fails jobs its previous process left unfinished
+        leftover = [store.create(), store.create()]
+        store.update(leftover[1], status='running')
+        for job_id in leftover:
+            store.update(job_id, worker=dead_worker)
+        finished = store.create()
+        store.complete(finished, {'success': True})
+        restarted = JobStore(store.directory)
+        assert sorted(restarted.fail_interrupted()) == sorted(leftover)
+        assert all(store.get(job_id)['status'] == 'failed' for job_id in leftover)
+        assert store.get(finished)['status'] == 'completed'
+        assert restarted.fail_interrupted() == []
+
+    print("✅ Interrupted jobs test passed")
 
 def main():
     """Run all tests"""
@@ -208,7 +1477,35 @@ def main():
         ("Import Test", test_imports),
         ("File Structure Test", test_file_structure),
         ("CSV Parsing Test", test_csv_parsing),
-        ("Flask App Test", test_flask_app)
+        ("Flask App Test", test_flask_app),
+        ("Candle Cache Test", test_candle_cache),
+        ("Fetch Planning Test", test_fetch_planning),
+        ("Exit Kernel Parity Test", test_find_exit_parity),
+        ("Entry Price Lookup Test", test_entry_price_lookup),
+        ("Entry Bar Look-Ahead Test", test_entry_bar_look_ahead),
+        ("Batch Evaluation Parity Test", test_batch_parity),
+        ("Calculate Metrics Test", test_calculate_metrics),
+        ("Portfolio Simulation Test", test_portfolio_simulation),
+        ("Optimization Grid Test", test_optimize_matches_backtest),
+        ("Parallel Backtest Test", test_parallel_backtest),
+        ("Incremental Backtest Test", test_incremental_backtest),
+        ("Multi-Resolution Exits Test", test_multi_resolution_exits),
+        ("Mapped Candle Store Test", test_mapped_candle_store),
+        ("Token Bucket Test", test_token_bucket),
+        ("SmartAPI Client Test", test_smartapi_client),
+        ("Chunked Candle Requests Test", test_chunked_candle_requests),
+        ("Session Cache Test", test_session_cache),
+        ("Instrument Master Test", test_instrument_master),
+        ("Trade Ingest Test", test_trade_ingest),
+        ("Trade Set Catalog Test", test_trade_set_catalog),
+        ("Candle Decoding Test", test_candle_decoding),
+        ("Pipeline Benchmark Test", test_pipeline_benchmark),
+        ("Response Cache Test", test_response_cache),
+        ("Telemetry Test", test_telemetry),
+        ("Backtest Job Test", test_backtest_job),
+        ("Optimize Job Test", test_optimize_job),
+        ("Backtest Event Stream Test", test_backtest_event_stream),
+        ("Interrupted Jobs Test", test_interrupted_jobs)
     ]
     
     passed = 0
@@ -216,8 +1513,12 @@ def main():
     
     for test_name, test_func in tests:
         print(f"Running {test_name}...")
-        if test_func():
-            passed += 1
+        try:
+            # Assertion-style tests return None on success
+            if test_func() is not False:
+                passed += 1
+        except Exception as e:
+            print(f"❌ {test_name} failed: {e}")
         print()
     
     print(f"📊 Test Results: {passed}/{total} tests passed")
@@ -232,4 +1533,3 @@ def main():
 if __name__ == "__main__":
     success = main()
     sys.exit(0 if success else 1)
->>>>>>> 1abbab347fd49b3876b85f07a1608ddf2868e824
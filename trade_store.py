@@ -0,0 +1,299 @@
+"""
+Chunked ingestion of Chartink trade exports into typed binary trade files.
+
+A CSV is read in chunks straight from the upload stream. Column roles are
+worked out once from the header and the date format once from a sample of
+the first chunk; every chunk is then parsed with that single format and
+validated as it arrives. The result is saved as an .npz of typed columns
+(int64 epoch-ms entry times, int32 codes for the string columns), which the
+backtest routes load without parsing anything.
+
+TradeStore keeps those files keyed by the SHA-256 of the uploaded bytes,
+so uploading the same export again is recognised before any parsing and
+reuses the stored trade set. A JSON sidecar per trade set backs the
+catalog (row count, symbols, entry date span, original file names).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TRADE_COLUMNS = ['entry_datetime', 'symbol', 'market_cap', 'sector']
+STRING_COLUMNS = ['symbol', 'market_cap', 'sector']
+
+CHUNK_ROWS = 50_000
+DATE_SAMPLE_ROWS = 1_000
+MAX_REPORTED_INVALID_ROWS = 100
+
+# Tried in order on the sample; the first that parses all of it is used
+DATE_FORMATS = ['%m-%d-%Y %I:%M %p', '%d-%m-%Y %I:%M %p', 'ISO8601']
+
+
+def map_trade_columns(columns):
+    """New names for a CSV header: keyword matches first, then position for what is still missing"""
+    names = list(columns)
+    for i, col in enumerate(columns):
+        col_lower = str(col).lower().strip()
+        if any(keyword in col_lower for keyword in ['date', 'time', 'datetime', 'entry']):
+            names[i] = 'entry_datetime'
+        elif any(keyword in col_lower for keyword in ['symbol', 'stock', 'scrip', 'ticker']):
+            names[i] = 'symbol'
+        elif any(keyword in col_lower for keyword in ['market', 'cap', 'mcap']):
+            names[i] = 'market_cap'
+        elif any(keyword in col_lower for keyword in ['sector', 'industry']):
+            names[i] = 'sector'
+
+    for position, name in enumerate(TRADE_COLUMNS):
+        if name not in names and len(names) > position:
+            names[position] = name
+    return names
+
+
+def detect_date_format(values):
+    """The first DATE_FORMATS entry that parses every sample value, else 'mixed' (day first)"""
+    sample = pd.Series(values, dtype=object).dropna().astype(str).head(DATE_SAMPLE_ROWS)
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(sample, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return 'mixed'
+
+
+def parse_entry_datetimes(values, date_format):
+    """Parse a chunk's entry_datetime strings with the detected format; unparseable values become NaT"""
+    if date_format == 'mixed':
+        return pd.to_datetime(values, format='mixed', dayfirst=True, errors='coerce')
+    return pd.to_datetime(values, format=date_format, errors='coerce')
+
+
+class _Categories:
+    """Incremental string -> int32 code table shared by every chunk"""
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, values):
+        local_codes, uniques = pd.factorize(values)
+        table = np.array([self.codes.setdefault(value, len(self.codes)) for value in uniques], dtype=np.int32)
+        return table[local_codes]
+
+    def values(self):
+        return np.array(list(self.codes), dtype=str)
+
+
+class IngestResult:
+    def __init__(self):
+        self.rows = 0
+        self.first_entry_ms = None
+        self.last_entry_ms = None
+        self.date_format = None
+        self.invalid_count = 0
+        self.invalid_rows = []
+        self.preview = None
+        self.entry_ms = []
+        self.codes = {column: [] for column in STRING_COLUMNS}
+        self.categories = {column: _Categories() for column in STRING_COLUMNS}
+
+    def report_invalid(self, rows):
+        self.invalid_count += len(rows)
+        room = MAX_REPORTED_INVALID_ROWS - len(self.invalid_rows)
+        self.invalid_rows.extend(rows[:max(room, 0)])
+
+
+def ingest_trades_csv(source, destination, chunksize=CHUNK_ROWS, on_invalid=None):
+    """Stream a trades CSV into a typed .npz trade file.
+
+    Rows with an unparseable entry_datetime or an empty symbol are reported
+    (on_invalid is called with each chunk's invalid rows as it is read) and
+    not written. Raises ValueError when the CSV lacks the required columns;
+    returns an IngestResult with the row count, invalid rows and a preview.
+    The file at destination is only written when every row is valid.
+    """
+    result = IngestResult()
+    names = None
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False, na_values=['']):
+        if names is None:
+            if len(chunk.columns) < 2:
+                raise ValueError('CSV must have at least 2 columns: date/time and symbol')
+            names = map_trade_columns(chunk.columns)
+            if 'entry_datetime' not in names or 'symbol' not in names:
+                raise ValueError('CSV must have date/time and symbol columns')
+        chunk.columns = names
+        # A header can map two columns to the same name; the first one wins
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+        for column in ('market_cap', 'sector'):
+            if column not in chunk.columns:
+                chunk[column] = 'Unknown'
+
+        if result.date_format is None:
+            result.date_format = detect_date_format(chunk['entry_datetime'])
+            logger.info(f"Detected entry_datetime format {result.date_format!r}")
+
+        entry_datetimes = parse_entry_datetimes(chunk['entry_datetime'], result.date_format)
+        symbols = chunk['symbol'].str.strip()
+        bad_date = entry_datetimes.isna().to_numpy()
+        bad_symbol = (symbols.isna() | (symbols == '')).to_numpy()
+        invalid = bad_date | bad_symbol
+        if invalid.any():
+            rows = [{
+                'row': int(row),
+                'value': None if pd.isna(value) else value,
+                'reason': 'invalid date' if date_error else 'missing symbol'
+            } for row, value, date_error in zip(chunk.index[invalid], chunk['entry_datetime'][invalid],
+                                                bad_date[invalid])]
+            result.report_invalid(rows)
+            if on_invalid:
+                on_invalid(rows)
+
+        valid = ~invalid
+        result.rows += int(valid.sum())
+        if result.invalid_count:
+            # Nothing will be written; keep validating the rest for the report
+            continue
+
+        result.entry_ms.append(entry_datetimes[valid].to_numpy().astype('datetime64[ms]').astype(np.int64))
+        chunk = chunk.assign(symbol=symbols)[valid]
+        for column in STRING_COLUMNS:
+            values = chunk[column].fillna('Unknown').to_numpy()
+            result.codes[column].append(result.categories[column].encode(values))
+        if result.preview is None:
+            result.preview = chunk[TRADE_COLUMNS].head().assign(
+                entry_datetime=entry_datetimes[valid].head()).to_dict('records')
+
+    if names is None:
+        raise ValueError('CSV must have at least 2 columns: date/time and symbol')
+
+    if not result.invalid_count:
+        save_trades(destination, result)
+    return result
+
+
+def save_trades(destination, result):
+    arrays = {'entry_ms': np.concatenate(result.entry_ms) if result.entry_ms else np.empty(0, dtype=np.int64)}
+    for column in STRING_COLUMNS:
+        parts = result.codes[column]
+        arrays[f'{column}_codes'] = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+        arrays[f'{column}_values'] = result.categories[column].values()
+    tmp_path = f"{destination}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, destination)
+    if len(arrays['entry_ms']):
+        result.first_entry_ms = int(arrays['entry_ms'].min())
+        result.last_entry_ms = int(arrays['entry_ms'].max())
+
+
+def load_trades(path):
+    """Load a trade file written by ingest_trades_csv as a trades DataFrame"""
+    with np.load(path) as arrays:
+        columns = {'entry_datetime': pd.to_datetime(arrays['entry_ms'], unit='ms')}
+        for column in STRING_COLUMNS:
+            columns[column] = arrays[f'{column}_values'].astype(object)[arrays[f'{column}_codes']]
+    return pd.DataFrame(columns, columns=TRADE_COLUMNS)
+
+
+def _ms_to_iso(value):
+    return None if value is None else pd.Timestamp(value, unit='ms').isoformat()
+
+
+class TradeStore:
+    def __init__(self, directory='uploads', chunksize=CHUNK_ROWS):
+        self.directory = directory
+        self.chunksize = chunksize
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, trade_set_id, suffix):
+        # Ids are SHA-256 hex digests; reject anything else before touching the filesystem
+        if not trade_set_id or len(trade_set_id) != 64 or not all(c in '0123456789abcdef' for c in trade_set_id):
+            raise KeyError(trade_set_id)
+        return os.path.join(self.directory, f"{trade_set_id}{suffix}")
+
+    def path(self, trade_set_id):
+        """Trade file for a trade set id, or None if the id is malformed"""
+        try:
+            return self._path(trade_set_id, '.trades.npz')
+        except KeyError:
+            return None
+
+    def exists(self, trade_set_id):
+        path = self.path(trade_set_id)
+        return path is not None and os.path.exists(path)
+
+    def get(self, trade_set_id):
+        """Catalog entry for a trade set, or None"""
+        try:
+            with open(self._path(trade_set_id, '.json')) as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def _write_entry(self, entry):
+        path = self._path(entry['id'], '.json')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def ingest(self, stream, filename, on_invalid=None):
+        """Store an uploaded CSV stream; returns (catalog entry or None, IngestResult or None).
+
+        The stream is hashed first. When the same bytes were stored before
+        the existing entry is returned and nothing is parsed (the result is
+        None); otherwise the CSV is ingested and, if every row is valid,
+        recorded in the catalog. Raises ValueError like ingest_trades_csv.
+        """
+        digest = hashlib.sha256()
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+        trade_set_id = digest.hexdigest()
+        stream.seek(0)
+
+        entry = self.get(trade_set_id)
+        if entry is not None and self.exists(trade_set_id):
+            if filename not in entry['filenames']:
+                entry['filenames'].append(filename)
+                self._write_entry(entry)
+            logger.info(f"Upload {filename} matches stored trade set {trade_set_id}")
+            return entry, None
+
+        result = ingest_trades_csv(stream, self._path(trade_set_id, '.trades.npz'),
+                                   chunksize=self.chunksize, on_invalid=on_invalid)
+        if result.invalid_count:
+            return None, result
+
+        entry = {
+            'id': trade_set_id,
+            'filenames': [filename],
+            'rows': result.rows,
+            'symbols': len(result.categories['symbol'].codes),
+            'first_entry': _ms_to_iso(result.first_entry_ms),
+            'last_entry': _ms_to_iso(result.last_entry_ms),
+            'date_format': result.date_format,
+            'uploaded_at': time.time()
+        }
+        self._write_entry(entry)
+        return entry, result
+
+    def load(self, trade_set_id):
+        """Trades DataFrame for a stored trade set"""
+        path = self.path(trade_set_id)
+        if path is None:
+            raise KeyError(trade_set_id)
+        return load_trades(path)
+
+    def catalog(self):
+        """Every stored trade set's catalog entry, most recent upload first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') and len(name) == 64 + len('.json'):
+                entry = self.get(name[:-len('.json')])
+                if entry is not None:
+                    entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['uploaded_at'], reverse=True)